@@ -1,6 +1,7 @@
 # admin_handlers.py (ПОЛНЫЙ НОВЫЙ КОД)
 
 import os
+import re
 import uuid
 import openpyxl
 import logging
@@ -8,10 +9,23 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKe
 from telegram.ext import ContextTypes, ConversationHandler, CallbackQueryHandler, MessageHandler, filters, \
     CommandHandler
 from db_utils import *
-from utils import escape_html, read_qr_code_from_image, cancel_global, ROLE_SUPER_ADMIN, ROLE_ORG_OWNER, ROLE_ORG_ADMIN, \
-    hash_password
+from utils import escape_html, read_qr_code_from_image, cancel_global, ROLE_SUPER_ADMIN, ROLE_ORG_OWNER, ROLE_ORG_ADMIN
 import io
 import asyncio
+import metrics
+import db_trace
+import waiting_room
+import ballot
+import waitlist
+import event_cancellation
+import reaper
+import paginator
+import deep_links
+import catalog_import
+import ticket_codes
+import promo_codes
+import blacklist
+from event_dates import parse_event_datetime
 from datetime import datetime
 
 # Получаем ID супер-админа из .env
@@ -72,8 +86,29 @@ ORG_LIMIT_PER_OWNER = 2
     ORG_DELETE_CONFIRM,
 
     # Сброс БД
-    DB_RESET_CONFIRM
-) = range(30)  # <-- Убедитесь, что число в range() соответствует общему количеству состояний.
+    DB_RESET_CONFIRM,
+
+    # Виртуальная очередь
+    INPUT_WAITING_ROOM_RATE,
+
+    # Лотерея
+    BALLOT_MENU,
+
+    # Общая вместимость площадки
+    INPUT_EVENT_CAPACITY,
+
+    # Импорт каталога из файла
+    CATALOG_IMPORT_FILE,
+
+    # Партия одноразовых промокодов
+    PROMO_BATCH_COUNT,
+    PROMO_BATCH_PERCENT,
+    PROMO_BATCH_LABEL,
+
+    # Черный список организации, импорт черных списков из файла
+    ORG_BLACKLIST_MENU,
+    BLACKLIST_IMPORT_FILE
+) = range(39)  # <-- Убедитесь, что число в range() соответствует общему количеству состояний.
 
 
 # --- LEVEL 1: SUPER ADMIN MAIN MENU ---
@@ -204,24 +239,16 @@ async def list_orgs(update: Update, context: ContextTypes.DEFAULT_TYPE, direct_c
 
     # ---------------------------------------------
 
-    conn = connect_db()
-    cursor = conn.cursor()
-
     user_id = update.effective_user.id
     is_super = context.user_data.get('is_super')
+    page = paginator.parse(query and query.data, 'aorg')
 
     # Теперь mode гарантированно существует
     if is_super and mode == 'all':
-        cursor.execute("SELECT id, name, owner_id FROM organizations ORDER BY id ASC")
-        orgs = cursor.fetchall()
+        orgs, prev_key, next_key = get_admin_orgs_page(None, page, paginator.PAGE_SIZE)
         can_create = True
     else:
-        cursor.execute("""
-            SELECT o.id, o.name, o.owner_id FROM organizations o 
-            JOIN org_admins oa ON o.id = oa.org_id 
-            WHERE oa.user_id = %s
-        """, (user_id,))
-        orgs = cursor.fetchall()
+        orgs, prev_key, next_key = get_admin_orgs_page(user_id, page, paginator.PAGE_SIZE)
 
         # Проверка лимита для владельцев
         org_count = get_user_org_count(user_id)
@@ -230,10 +257,8 @@ async def list_orgs(update: Update, context: ContextTypes.DEFAULT_TYPE, direct_c
         else:
             can_create = False
 
-    conn.close()
-
     # Если орг всего одна и это прямой вызов (создали и вернулись) - заходим внутрь
-    if len(orgs) == 1 and direct_call:
+    if len(orgs) == 1 and next_key is None and direct_call:
         context.user_data['curr_org_id'] = orgs[0][0]
         return await org_menu(update, context, direct_call=True)
 
@@ -242,6 +267,8 @@ async def list_orgs(update: Update, context: ContextTypes.DEFAULT_TYPE, direct_c
         owner_text = f" (Владелец: {org[2]})" if is_super and org[2] else ""
         safe_name = escape_html(org[1])
         keyboard.append([InlineKeyboardButton(f"🏢 {safe_name}{owner_text}", callback_data=f"sel_org_{org[0]}")])
+    if nav := paginator.nav_row('aorg', prev_key, next_key):
+        keyboard.append(nav)
 
     if can_create:
         keyboard.append([InlineKeyboardButton("➕ Создать Организацию", callback_data="create_org")])
@@ -332,7 +359,8 @@ async def org_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, direct_ca
 
     keyboard = [
         [InlineKeyboardButton("📅 Управление мероприятиями", callback_data="goto_events")],
-        [InlineKeyboardButton("✅ Проверить билет (Org)", callback_data="check_ticket_org")]
+        [InlineKeyboardButton("✅ Проверить билет (Org)", callback_data="check_ticket_org")],
+        [InlineKeyboardButton("🚫 Черный список", callback_data="goto_org_bl")]
     ]
 
 
@@ -431,20 +459,20 @@ async def list_events(update: Update, context: ContextTypes.DEFAULT_TYPE, direct
         await query.answer()
 
     org_id = context.user_data['curr_org_id']
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM events WHERE org_id = %s", (org_id,))
-    events = cursor.fetchall()
-    conn.close()
+    page = paginator.parse(query and query.data, 'aev')
+    events, prev_key, next_key = get_org_events_admin_page(org_id, page, paginator.PAGE_SIZE)
 
     keyboard = []
     for ev in events:
         safe_name = escape_html(ev[1])
         keyboard.append([InlineKeyboardButton(f"🎉 {safe_name}", callback_data=f"sel_ev_{ev[0]}")])
+    if nav := paginator.nav_row('aev', prev_key, next_key):
+        keyboard.append(nav)
 
     role = context.user_data['curr_role']
     if role in [ROLE_SUPER_ADMIN, ROLE_ORG_OWNER]:
         keyboard.append([InlineKeyboardButton("➕ Создать Мероприятие", callback_data="create_event")])
+        keyboard.append([InlineKeyboardButton("📥 Импорт из файла", callback_data="import_catalog")])
         keyboard.append([InlineKeyboardButton("🗑 Удалить Мероприятие", callback_data="start_delete_event")])
 
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_lvl3")])
@@ -490,6 +518,15 @@ async def input_event_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
 
 async def input_event_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    starts_at = parse_event_datetime(update.message.text)
+    if not starts_at:
+        keyboard = [[InlineKeyboardButton("❌ Отмена создания", callback_data="back_menu_org")]]
+        await update.message.reply_text(
+            "❌ Не удалось распознать дату. Введите, например, '25.12.2025 18:00' или '25 декабря 18:00':",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return INPUT_NEW_EVENT_DATE
+
     context.user_data['new_ev_date'] = update.message.text
 
     org_id = context.user_data['curr_org_id']
@@ -498,15 +535,70 @@ async def input_event_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("INSERT INTO events (org_id, name, date_str) VALUES (%s, %s, %s)", (org_id, name, date))
+    cur.execute("INSERT INTO events (org_id, name, date_str, starts_at) VALUES (%s, %s, %s, %s)",
+                (org_id, name, date, starts_at))
     conn.commit()
     conn.close()
 
-    await update.message.reply_text(f"✅ Мероприятие <b>{escape_html(name)}</b> создано!", parse_mode='HTML')
+    await update.message.reply_text(f"✅ Мероприятие <b>{escape_html(name)}</b> создано!\n"
+                                    f"📅 Начало: {starts_at:%d.%m.%Y %H:%M}", parse_mode='HTML')
     # Возврат к списку мероприятий
     return await list_events(update, context, direct_call=True)
 
 
+# --- ИМПОРТ КАТАЛОГА (мероприятия + тарифы из .xlsx/.csv) ---
+
+async def ask_catalog_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    keyboard = [[InlineKeyboardButton("🔙 Отмена", callback_data="back_lvl4")]]
+    await query.edit_message_text(
+        "📥 <b>Импорт мероприятий и тарифов</b>\n\n"
+        "Пришлите файл .xlsx или .csv (до 5 МБ). Одна строка - один тариф.\n"
+        f"{catalog_import.TEMPLATE_HINT}\n\n"
+        "Файл проверяется целиком: при любой ошибке ничего не создается.",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return CATALOG_IMPORT_FILE
+
+
+async def catalog_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    document = update.message.document
+    filename = document.file_name or ""
+    if not filename.lower().endswith(('.xlsx', '.csv')):
+        await update.message.reply_text("❌ Нужен файл .xlsx или .csv.")
+        return CATALOG_IMPORT_FILE
+    if document.file_size and document.file_size > catalog_import.CATALOG_IMPORT_MAX_BYTES:
+        await update.message.reply_text("❌ Файл больше 5 МБ - разбейте его на части.")
+        return CATALOG_IMPORT_FILE
+
+    status = await update.message.reply_text("⏳ Проверяю файл...")
+    data = bytes(await (await document.get_file()).download_as_bytearray())
+    try:
+        events, errors = await asyncio.to_thread(catalog_import.parse_catalog, data, filename)
+    except Exception as e:
+        logging.error(f"Catalog file parse error: {e}")
+        await status.edit_text("❌ Не удалось прочитать файл. Проверьте формат и пришлите снова.")
+        return CATALOG_IMPORT_FILE
+
+    if errors:
+        await status.edit_text(f"❌ Ошибки в файле ({len(errors)}), ничего не создано:\n\n"
+                               f"{catalog_import.format_errors(errors)}\n\nИсправьте и пришлите файл снова.")
+        return CATALOG_IMPORT_FILE
+
+    result = await asyncio.to_thread(import_catalog, context.user_data['curr_org_id'], events)
+    if result is None:
+        await status.edit_text("❌ Ошибка БД при импорте, ничего не создано. Попробуйте позже.")
+        return CATALOG_IMPORT_FILE
+    if result.get('duplicates'):
+        await status.edit_text("❌ Эти мероприятия уже есть, ничего не создано:\n\n"
+                               f"{catalog_import.format_errors(result['duplicates'])}")
+        return CATALOG_IMPORT_FILE
+
+    await status.edit_text(f"✅ Импортировано: мероприятий - {result['events']}, тарифов - {result['products']}.")
+    return await list_events(update, context, direct_call=True)
+
+
 async def event_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
 
@@ -529,8 +621,13 @@ async def event_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         [InlineKeyboardButton("🎟 Промокоды", callback_data="list_promos")],
         [InlineKeyboardButton("✅ Проверить билет", callback_data="check_ticket_ev")],
         [InlineKeyboardButton("📊 Отчет (Excel)", callback_data="report_excel")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_lvl4")]
+        [InlineKeyboardButton("🏟 Вместимость площадки", callback_data="event_capacity_cfg")],
+        [InlineKeyboardButton("🚦 Очередь на продажу", callback_data="waiting_room_cfg")],
+        [InlineKeyboardButton("🎲 Лотерея", callback_data="adm_ballot_menu")],
     ]
+    if context.user_data.get('curr_role') in [ROLE_SUPER_ADMIN, ROLE_ORG_OWNER]:
+        keyboard.append([InlineKeyboardButton("⛔ Отменить мероприятие", callback_data="cancel_ev_ask")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_lvl4")])
 
     # 2. Отправка сообщения
     if query:
@@ -554,8 +651,10 @@ async def list_products_with_quantities(update: Update, context: ContextTypes.DE
     ev_id = context.user_data['curr_ev_id']
 
     products = get_event_products(ev_id)
+    username = context.bot.username
 
     msg = "🎫 <b>Список Тарифов</b>\n\n"
+    msg += f"🔗 Мероприятие: {deep_links.start_link(username, deep_links.event_payload(ev_id))}\n\n"
     keyboard = []
 
     for p in products:
@@ -567,6 +666,7 @@ async def list_products_with_quantities(update: Update, context: ContextTypes.DE
 
         msg += f"• <b>{escape_html(p['name'])}</b> ({p['price']} руб.)\n"
         msg += f"  <i>Продано: {p['sold']} | {limit_text}</i>\n"
+        msg += f"  🔗 {deep_links.start_link(username, deep_links.product_payload(p['id']))}\n"
 
     keyboard.append([InlineKeyboardButton("➕ Добавить Тариф", callback_data="add_product")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_menu_ev")])
@@ -747,13 +847,10 @@ async def start_delete_event(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     org_id = context.user_data['curr_org_id']
 
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM events WHERE org_id = %s", (org_id,))
-    events = cursor.fetchall()
-    conn.close()
+    page = paginator.parse(query.data, 'dev')
+    events, prev_key, next_key = get_org_events_admin_page(org_id, page, paginator.PAGE_SIZE)
 
-    if not events:
+    if not events and page is None:
         await query.edit_message_text("Нет мероприятий для удаления.")
         return await list_events(update, context)
 
@@ -761,6 +858,8 @@ async def start_delete_event(update: Update, context: ContextTypes.DEFAULT_TYPE)
     for ev in events:
         safe_name = escape_html(ev[1])
         keyboard.append([InlineKeyboardButton(f"🗑 {safe_name}", callback_data=f"del_ev_select_{ev[0]}")])
+    if nav := paginator.nav_row('dev', prev_key, next_key):
+        keyboard.append(nav)
 
     keyboard.append([InlineKeyboardButton("🔙 Отмена", callback_data="back_lvl4")])
 
@@ -785,20 +884,18 @@ async def confirm_delete_event(update: Update, context: ContextTypes.DEFAULT_TYP
     conn.close()
 
     if delete_event(ev_id):
-        await query.edit_message_text(f"✅ Мероприятие **{escape_html(event_name)}** и все связанные данные удалены.",
+        await query.edit_message_text(f"✅ Мероприятие **{escape_html(event_name)}** удалено. "
+                                      f"Связанные данные удаляются в фоне.",
                                       parse_mode='HTML')
+        reaper.kick(context.application, update.effective_chat.id, 'event', ev_id)
     else:
         await query.edit_message_text("❌ Ошибка при удалении мероприятия.")
 
     return await list_events(update, context)
 
 
-async def generate_excel_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer("Генерирую отчет, пожалуйста, подождите...")
-
-    ev_id = context.user_data['curr_ev_id']
-
+def build_excel_report(ev_id: int) -> tuple[io.BytesIO, str]:
+    """Синхронная часть отчета (запрос + openpyxl). Выполняется в потоке, чтобы не стопорить других пользователей."""
     conn = connect_db()
     cur = conn.cursor()
     cur.execute("""
@@ -823,6 +920,15 @@ async def generate_excel_report(update: Update, context: ContextTypes.DEFAULT_TY
     filename = f"report_event_{ev_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
     wb.save(bio)
     bio.seek(0)
+    return bio, filename
+
+
+async def generate_excel_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer("Генерирую отчет, пожалуйста, подождите...")
+
+    ev_id = context.user_data['curr_ev_id']
+    bio, filename = await asyncio.to_thread(build_excel_report, ev_id)
 
     await context.bot.send_document(chat_id=query.message.chat_id, document=InputFile(bio, filename=filename))
 
@@ -871,6 +977,13 @@ async def process_ticket_check(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("❌ Код не распознан (OpenCV). Попробуйте четче или введите ID вручную:", reply_markup=InlineKeyboardMarkup(kb))
         return INPUT_CHECK_TICKET
 
+    # Контрольный символ проверяется локально: опечатка в ручном вводе не доходит до БД
+    ticket_id = ticket_codes.normalize_ticket_id(ticket_id)
+    if not ticket_id:
+        await update.message.reply_text("❌ Неверный ID билета (опечатка?). Проверьте и введите снова:",
+                                        reply_markup=InlineKeyboardMarkup(kb))
+        return INPUT_CHECK_TICKET
+
     info = get_ticket_details(ticket_id)
     if not info:
         await update.message.reply_text("❌ Билет не найден в БД.", reply_markup=InlineKeyboardMarkup(kb))
@@ -881,7 +994,7 @@ async def process_ticket_check(update: Update, context: ContextTypes.DEFAULT_TYP
     if curr_org and info['org_id'] != curr_org and not context.user_data.get('is_super'):
         await update.message.reply_text(
             "❌ Билет от другой организации!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=InlineKeyboardMarkup(kb)
         )
         return INPUT_CHECK_TICKET
 
@@ -910,28 +1023,123 @@ async def confirm_use_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # --- GLOBAL BLACKLIST (ОБНОВЛЕНО) ---
 
-async def start_global_bl(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer()
-
-    blacklist = get_global_blacklist()
-    msg = "🚫 <b>Глобальный Черный Список</b>\n\n"
-    if blacklist:
+def _blacklist_text(title: str, entries: list, total: int | None) -> str:
+    msg = f"🚫 <b>{title}</b>" + (f" (всего: {total})" if total else "") + "\n\n"
+    if entries:
         msg += "<b>ID | Причина</b>\n"
-        for user_id, reason in blacklist:
+        for user_id, reason in entries:
             msg += f"<code>{user_id}</code> | {escape_html(reason) or 'Нет'}\n"
     else:
         msg += "Список пуст."
+    return msg
+
+
+async def start_global_bl(update: Update, context: ContextTypes.DEFAULT_TYPE, direct_call=False) -> int:
+    query = None
+    if not direct_call and update.callback_query:
+        query = update.callback_query
+        await query.answer()
+
+    page = paginator.parse(query and query.data, 'gbl')
+    entries, prev_key, next_key = get_global_blacklist_page(page, paginator.PAGE_SIZE)
+    msg = _blacklist_text("Глобальный Черный Список", entries, blacklist.count(None))
 
     keyboard = [
         [InlineKeyboardButton("➕ Добавить пользователя", callback_data="add_global_bl")],
+        [InlineKeyboardButton("📥 Импорт из файла", callback_data="import_global_bl")],
         [InlineKeyboardButton("🔙 Назад", callback_data="back_lvl1")]
     ]
+    if nav := paginator.nav_row('gbl', prev_key, next_key):
+        keyboard.insert(0, nav)
 
-    await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    if query:
+        await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    else:
+        await update.effective_chat.send_message(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
     return GLOBAL_BLACKLIST_MENU
 
 
+async def start_org_bl(update: Update, context: ContextTypes.DEFAULT_TYPE, direct_call=False) -> int:
+    query = None
+    if not direct_call and update.callback_query:
+        query = update.callback_query
+        await query.answer()
+
+    org_id = context.user_data['curr_org_id']
+    page = paginator.parse(query and query.data, 'obl')
+    entries, prev_key, next_key = get_org_blacklist_page(org_id, page, paginator.PAGE_SIZE)
+    msg = _blacklist_text("Черный список организации", entries, blacklist.count(org_id))
+
+    keyboard = [
+        [InlineKeyboardButton("📥 Импорт из файла", callback_data="import_org_bl")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="back_menu_org")]
+    ]
+    if nav := paginator.nav_row('obl', prev_key, next_key):
+        keyboard.insert(0, nav)
+
+    if query:
+        await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    else:
+        await update.effective_chat.send_message(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    return ORG_BLACKLIST_MENU
+
+
+async def ask_blacklist_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    is_org = query.data == "import_org_bl"
+    context.user_data['bl_import_org'] = context.user_data['curr_org_id'] if is_org else None
+    keyboard = [[InlineKeyboardButton("🔙 Отмена", callback_data="goto_org_bl" if is_org else "goto_global_bl")]]
+    await query.edit_message_text(
+        "📥 <b>Импорт в черный список</b>\n\n"
+        "Пришлите файл .xlsx, .csv или .txt (до 10 МБ).\n"
+        f"{blacklist.TEMPLATE_HINT}\n\n"
+        "Файл проверяется целиком: при любой ошибке никто не блокируется.",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return BLACKLIST_IMPORT_FILE
+
+
+async def blacklist_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    org_id = context.user_data.get('bl_import_org')
+    document = update.message.document
+    filename = document.file_name or ""
+    if not filename.lower().endswith(('.xlsx', '.csv', '.txt')):
+        await update.message.reply_text("❌ Нужен файл .xlsx, .csv или .txt.")
+        return BLACKLIST_IMPORT_FILE
+    if document.file_size and document.file_size > blacklist.BLACKLIST_IMPORT_MAX_BYTES:
+        await update.message.reply_text("❌ Файл больше 10 МБ - разбейте его на части.")
+        return BLACKLIST_IMPORT_FILE
+
+    status = await update.message.reply_text("⏳ Проверяю файл...")
+    data = bytes(await (await document.get_file()).download_as_bytearray())
+    try:
+        rows, errors = await asyncio.to_thread(blacklist.parse_ids, data, filename)
+    except Exception as e:
+        logging.error(f"Blacklist file parse error: {e}")
+        await status.edit_text("❌ Не удалось прочитать файл. Проверьте формат и пришлите снова.")
+        return BLACKLIST_IMPORT_FILE
+
+    if errors:
+        await status.edit_text(f"❌ Ошибки в файле ({len(errors)}), никто не заблокирован:\n\n"
+                               f"{blacklist.format_errors(errors)}\n\nИсправьте и пришлите файл снова.")
+        return BLACKLIST_IMPORT_FILE
+
+    result = await asyncio.to_thread(import_blacklist, org_id, rows, update.effective_user.id)
+    if result is None:
+        await status.edit_text("❌ Ошибка БД при импорте, никто не заблокирован. Попробуйте позже.")
+        return BLACKLIST_IMPORT_FILE
+    blacklist.invalidate(org_id)
+
+    msg = f"✅ Заблокировано: {result['added']}. Уже были в списке: {result['existing']}."
+    if result['unknown']:
+        msg += f"\n⚠️ Пропущено {result['unknown']} ID: эти пользователи еще не запускали бота."
+    await status.edit_text(msg)
+    if org_id is None:
+        return await start_global_bl(update, context, direct_call=True)
+    return await start_org_bl(update, context, direct_call=True)
+
+
 async def ask_global_bl_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.callback_query.answer()
 
@@ -976,7 +1184,8 @@ async def process_global_bl_add(update: Update, context: ContextTypes.DEFAULT_TY
     else:
         await update.message.reply_text(f"❌ Пользователь с ID <code>{user_id}</code> уже в списке.", parse_mode='HTML')
 
-    return await start_global_bl(update, context)
+    blacklist.invalidate(None)
+    return await start_global_bl(update, context, direct_call=True)
 
 
 # --- BROADCAST FLOW (ОБНОВЛЕНО) ---
@@ -1048,13 +1257,19 @@ async def execute_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     await update.message.reply_text(f"🚀 Начинаю рассылку для {target_name} ({total_count} получателей)...")
 
+    # Прогресс рассылки в /metrics
+    metrics.BROADCAST_PROGRESS.set(total_count, mode=mode, state='total')
+    metrics.BROADCAST_PROGRESS.set(0, mode=mode, state='sent')
+    metrics.BROADCAST_PROGRESS.set(0, mode=mode, state='failed')
+
     for uid in user_ids:
         try:
             await context.bot.send_message(chat_id=uid, text=message_text, parse_mode='HTML')
             success_count += 1
+            metrics.BROADCAST_PROGRESS.inc(mode=mode, state='sent')
             await asyncio.sleep(0.05)
         except Exception:
-            pass
+            metrics.BROADCAST_PROGRESS.inc(mode=mode, state='failed')
 
     await update.message.reply_text(f"✅ Рассылка завершена! Отправлено {success_count} из {total_count} сообщений.")
 
@@ -1089,21 +1304,33 @@ async def list_promos(update: Update, context: ContextTypes.DEFAULT_TYPE, direct
         await query.answer()
 
     ev_id = context.user_data['curr_ev_id']
-    promos = get_event_promos(ev_id)  # Из шага 1
+    page = paginator.parse(query and query.data, 'promo')
+    groups, prev_key, next_key = get_event_promo_groups_page(ev_id, page, paginator.PAGE_SIZE)
 
     msg = f"🎟 <b>Промокоды мероприятия #{ev_id}</b>\n\n"
 
     keyboard = []
-    if not promos:
+    if not groups:
         msg += "Список пуст."
-    else:
-        for p in promos:
-            limit_txt = f"{p['used']}/{p['limit']}" if p['limit'] > 0 else f"{p['used']}/∞"
-            row_txt = f"{p['code']} (-{p['discount']}%) [{limit_txt}]"
+    for g in groups:
+        if g['kind'] == 'batch':
+            # Партия - одна строка со статистикой вместо тысяч кнопок
+            msg += (f"📦 <b>{g['label']}</b> (-{g['discount']}%): использовано {g['used_codes']} "
+                    f"из {g['codes']} кодов\n")
+            keyboard.append([
+                InlineKeyboardButton(f"⬇️ {g['label']}", callback_data=f"promo_exp_{g['id']}"),
+                InlineKeyboardButton("🗑", callback_data=f"del_pbatch_{g['id']}")
+            ])
+        else:
+            limit_txt = f"{g['uses']}/{g['limit']}" if g['limit'] > 0 else f"{g['uses']}/∞"
+            row_txt = f"{g['label']} (-{g['discount']}%) [{limit_txt}]"
             # Кнопка для удаления конкретного промокода
-            keyboard.append([InlineKeyboardButton(f"🗑 {row_txt}", callback_data=f"del_promo_{p['code']}")])
+            keyboard.append([InlineKeyboardButton(f"🗑 {row_txt}", callback_data=f"del_promo_{g['label']}")])
+    if nav := paginator.nav_row('promo', prev_key, next_key):
+        keyboard.append(nav)
 
     keyboard.append([InlineKeyboardButton("➕ Создать промокод", callback_data="create_promo")])
+    keyboard.append([InlineKeyboardButton("📦 Сгенерировать партию", callback_data="create_promo_batch")])
     keyboard.append([InlineKeyboardButton("🔙 Назад в меню", callback_data="back_menu_ev")])
 
     if query:
@@ -1165,6 +1392,283 @@ async def input_promo_limit(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return INPUT_PROMO_LIMIT
 
 
+async def start_promo_batch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.answer()
+    kb = [[InlineKeyboardButton("🔙 Отмена", callback_data="back_promo_list")]]
+    await update.callback_query.edit_message_text(
+        f"📦 Партия одноразовых промокодов.\nВведите <b>количество кодов</b> (1-{promo_codes.PROMO_BATCH_MAX}):",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(kb)
+    )
+    return PROMO_BATCH_COUNT
+
+
+async def input_promo_batch_count(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    try:
+        count = int(update.message.text)
+        if not (1 <= count <= promo_codes.PROMO_BATCH_MAX): raise ValueError
+    except ValueError:
+        await update.message.reply_text(f"❌ Введите число от 1 до {promo_codes.PROMO_BATCH_MAX}.")
+        return PROMO_BATCH_COUNT
+    context.user_data['promo_batch_count'] = count
+    kb = [[InlineKeyboardButton("🔙 Отмена", callback_data="back_promo_list")]]
+    await update.message.reply_text("Введите <b>Процент скидки</b> (1-100):", reply_markup=InlineKeyboardMarkup(kb),
+                                    parse_mode='HTML')
+    return PROMO_BATCH_PERCENT
+
+
+async def input_promo_batch_percent(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    try:
+        val = int(update.message.text)
+        if not (1 <= val <= 100): raise ValueError
+    except ValueError:
+        await update.message.reply_text("❌ Введите число от 1 до 100.")
+        return PROMO_BATCH_PERCENT
+    context.user_data['promo_batch_perc'] = val
+    kb = [[InlineKeyboardButton("🔙 Отмена", callback_data="back_promo_list")]]
+    await update.message.reply_text(
+        f"Введите <b>префикс</b> партии (латиница и цифры, до {promo_codes.LABEL_MAX_LENGTH} символов), "
+        f"например VK2025. Коды будут вида <code>VK2025-XXXXXXXXXX</code>:",
+        reply_markup=InlineKeyboardMarkup(kb), parse_mode='HTML')
+    return PROMO_BATCH_LABEL
+
+
+async def input_promo_batch_label(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    label = update.message.text.strip().upper()
+    if not re.fullmatch(rf"[A-Z0-9]{{1,{promo_codes.LABEL_MAX_LENGTH}}}", label):
+        await update.message.reply_text(f"❌ Только латиница и цифры, до {promo_codes.LABEL_MAX_LENGTH} символов.")
+        return PROMO_BATCH_LABEL
+
+    count = context.user_data.pop('promo_batch_count')
+    perc = context.user_data.pop('promo_batch_perc')
+    ev_id = context.user_data['curr_ev_id']
+    await update.message.reply_text(f"⏳ Генерирую {count} кодов...")
+    codes = await asyncio.to_thread(promo_codes.create_batch, ev_id, label, perc, count, update.effective_user.id)
+
+    if not codes:
+        await update.message.reply_text("❌ Не удалось создать партию.")
+    else:
+        bio, filename = promo_codes.codes_file(label, codes)
+        await context.bot.send_document(chat_id=update.effective_chat.id, document=InputFile(bio, filename=filename),
+                                        caption=f"✅ Партия {label}: {len(codes)} кодов, скидка {perc}%, "
+                                                f"каждый код - на одну покупку.")
+    return await list_promos(update, context, direct_call=True)
+
+
+async def export_promo_batch_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer("Выгружаю коды...")
+    batch_id = int(query.data.split('_')[2])
+    data = await asyncio.to_thread(export_promo_batch, batch_id, context.user_data['curr_ev_id'])
+    if data is None:
+        await query.message.reply_text("❌ Не удалось выгрузить партию.")
+    else:
+        filename = f"promo_batch_{batch_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+        await context.bot.send_document(chat_id=query.message.chat_id, document=InputFile(io.BytesIO(data), filename=filename))
+    return LVL6_PROMO_MENU
+
+
+# --- ВМЕСТИМОСТЬ ПЛОЩАДКИ ---
+
+async def ask_event_capacity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.answer()
+    capacity, free = get_event_capacity(context.user_data.get('curr_ev_id'))
+
+    kb = [[InlineKeyboardButton("🔙 Назад", callback_data="back_menu_ev")]]
+    await update.callback_query.edit_message_text(
+        f"🏟 <b>Вместимость площадки</b>\n\n"
+        f"Сейчас: {f'{capacity} мест, свободно {free}' if capacity else 'без общего лимита'}\n\n"
+        f"Общий лимит действует на все тарифы вместе (лимиты тарифов тоже продолжают работать).\n"
+        f"Введите вместимость (0 = без общего лимита):",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(kb)
+    )
+    return INPUT_EVENT_CAPACITY
+
+
+async def save_event_capacity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    try:
+        capacity = int(update.message.text)
+        if capacity < 0: raise ValueError
+    except ValueError:
+        await update.message.reply_text("❌ Введите целое число (0 = без общего лимита).")
+        return INPUT_EVENT_CAPACITY
+
+    ev_id = context.user_data.get('curr_ev_id')
+    if set_event_capacity(ev_id, capacity):
+        _, free = get_event_capacity(ev_id)
+        waitlist.kick(context.application)  # Вместимость могла вырасти - места достанутся листу ожидания
+        await update.message.reply_text(
+            f"✅ Вместимость: {f'{capacity} мест (свободно {free})' if capacity else 'без общего лимита'}.")
+    else:
+        await update.message.reply_text("❌ Ошибка сохранения.")
+    return await event_menu(update, context)
+
+
+# --- ВИРТУАЛЬНАЯ ОЧЕРЕДЬ ---
+
+async def ask_waiting_room_rate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.answer()
+    ev_id = context.user_data.get('curr_ev_id')
+    current = waiting_room.rates.get(ev_id, 0)
+    room = waiting_room.rooms.get(ev_id)
+    in_queue = len(room.queue) if room else 0
+
+    kb = [[InlineKeyboardButton("🔙 Назад", callback_data="back_menu_ev")]]
+    await update.callback_query.edit_message_text(
+        f"🚦 <b>Очередь на продажу</b>\n\n"
+        f"Сейчас: {f'{current} чел./мин' if current else 'выключена'}, в очереди: {in_queue}\n\n"
+        f"Введите, сколько покупателей в минуту пускать к билетам (0 = выключить очередь):",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(kb)
+    )
+    return INPUT_WAITING_ROOM_RATE
+
+
+async def save_waiting_room_rate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    try:
+        rate = int(update.message.text)
+        if rate < 0: raise ValueError
+    except ValueError:
+        await update.message.reply_text("❌ Введите целое число (0 = выключить).")
+        return INPUT_WAITING_ROOM_RATE
+
+    ev_id = context.user_data.get('curr_ev_id')
+    if set_event_waiting_room_rate(ev_id, rate):
+        # Применяем сразу, не дожидаясь следующего тика
+        if rate:
+            waiting_room.rates[ev_id] = rate
+        else:
+            waiting_room.rates.pop(ev_id, None)
+        await update.message.reply_text(f"✅ Очередь: {f'{rate} чел./мин' if rate else 'выключена'}.")
+    else:
+        await update.message.reply_text("❌ Ошибка сохранения.")
+    return await event_menu(update, context)
+
+
+# --- ЛОТЕРЕЯ ---
+
+async def ballot_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    ev_id = context.user_data.get('curr_ev_id')
+    mode = get_event_sale_mode(ev_id)
+    stats = get_ballot_stats(ev_id)
+
+    mode_names = {ballot.MODE_FCFS: "обычная продажа", ballot.MODE_BALLOT: "идет прием заявок",
+                  ballot.MODE_BALLOT_DRAWN: "розыгрыш проведен"}
+    text = (
+        f"🎲 <b>Лотерея</b>\n\n"
+        f"Режим: {mode_names.get(mode, mode)}\n"
+        f"Заявок: {stats['entries']} (билетов запрошено: {stats['requested']})\n"
+        f"Выиграли: {stats['won']}, не выиграли: {stats['lost']}"
+    )
+
+    keyboard = []
+    if mode == ballot.MODE_FCFS:
+        keyboard.append([InlineKeyboardButton("▶️ Открыть прием заявок", callback_data=f"adm_ballot_mode_{ballot.MODE_BALLOT}")])
+    elif mode == ballot.MODE_BALLOT:
+        keyboard.append([InlineKeyboardButton("🎲 Провести розыгрыш", callback_data="adm_ballot_draw")])
+        keyboard.append([InlineKeyboardButton("⏹ Отменить лотерею", callback_data=f"adm_ballot_mode_{ballot.MODE_FCFS}")])
+    else:
+        # Остатки (невыигранные/непроданные билеты) можно продать обычным способом
+        keyboard.append([InlineKeyboardButton("🛒 Открыть обычную продажу остатков",
+                                              callback_data=f"adm_ballot_mode_{ballot.MODE_FCFS}")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_menu_ev")])
+
+    await query.edit_message_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+    return BALLOT_MENU
+
+
+async def ballot_set_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    mode = update.callback_query.data[len("adm_ballot_mode_"):]
+    if mode in (ballot.MODE_FCFS, ballot.MODE_BALLOT):
+        set_event_sale_mode(context.user_data.get('curr_ev_id'), mode)
+    return await ballot_menu(update, context)
+
+
+async def ballot_draw_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.answer()
+    kb = [
+        [InlineKeyboardButton("✅ Да, провести", callback_data="adm_ballot_run")],
+        [InlineKeyboardButton("🔙 Отмена", callback_data="adm_ballot_menu")]
+    ]
+    await update.callback_query.edit_message_text(
+        "Провести розыгрыш? Прием заявок будет закрыт, победители получат билеты и реквизиты для оплаты.",
+        reply_markup=InlineKeyboardMarkup(kb)
+    )
+    return BALLOT_MENU
+
+
+async def ballot_run_draw(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    ev_id = context.user_data.get('curr_ev_id')
+
+    await query.edit_message_text("⏳ Провожу розыгрыш...")
+    # Одна транзакция на все заявки - в отдельном потоке, чтобы не блокировать event loop
+    results = await asyncio.to_thread(run_ballot_draw, ev_id)
+
+    kb = [[InlineKeyboardButton("🔙 Назад", callback_data="adm_ballot_menu")]]
+    if results is None:
+        await query.edit_message_text("❌ Розыгрыш не проведен (прием заявок не идет или ошибка БД).",
+                                      reply_markup=InlineKeyboardMarkup(kb))
+        return BALLOT_MENU
+
+    won = sum(1 for r in results if r['won'])
+    tickets = sum(r['quantity'] for r in results if r['won'])
+    await query.edit_message_text(
+        f"✅ Розыгрыш проведен: {won} победителей ({tickets} билетов), {len(results) - won} без выигрыша.\n"
+        f"Рассылка результатов идет в фоне.",
+        reply_markup=InlineKeyboardMarkup(kb)
+    )
+
+    # Рассылка может занять минуты - не держим апдейт админа
+    context.application.create_task(ballot.notify_results(context.bot, results))
+    return BALLOT_MENU
+
+
+# --- ОТМЕНА МЕРОПРИЯТИЯ ---
+
+async def cancel_event_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    if context.user_data.get('curr_role') not in [ROLE_SUPER_ADMIN, ROLE_ORG_OWNER]:
+        return LVL5_EVENT_MENU
+
+    info = get_event_cancel_info(context.user_data.get('curr_ev_id'))
+    kb = [[InlineKeyboardButton("🔙 Назад", callback_data="back_menu_ev")]]
+    if not info:
+        await query.edit_message_text("❌ Мероприятие не найдено.", reply_markup=InlineKeyboardMarkup(kb))
+        return LVL5_EVENT_MENU
+
+    text = (
+        f"⛔ <b>Отменить мероприятие «{escape_html(info['name'])}»?</b>\n\n"
+        f"Билетов к аннулированию: {info['pending']}\n\n"
+        f"Мероприятие будет снято с продажи, все билеты аннулированы, покупатели получат уведомление, "
+        f"а вы - список выплат (Excel). Действие необратимо."
+    )
+    if info['cancelled_at']:
+        text += "\n\n⚠️ Отмена уже запускалась - повторный запуск продолжит ее с места остановки."
+    kb.insert(0, [InlineKeyboardButton("⛔ Да, отменить", callback_data="cancel_ev_run")])
+    await query.edit_message_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(kb))
+    return LVL5_EVENT_MENU
+
+
+async def cancel_event_run(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    if context.user_data.get('curr_role') not in [ROLE_SUPER_ADMIN, ROLE_ORG_OWNER]:
+        return LVL5_EVENT_MENU
+
+    # Возвраты и рассылка на десятки тысяч билетов идут в фоне, прогресс - отдельным сообщением
+    context.application.create_task(
+        event_cancellation.run(context.bot, query.message.chat_id, context.user_data.get('curr_ev_id'))
+    )
+    await query.edit_message_text(
+        "⏳ Отмена запущена. Прогресс и список выплат придут отдельными сообщениями.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 К мероприятиям", callback_data="back_lvl4")]])
+    )
+    return LVL5_EVENT_MENU
+
+
 async def delete_promo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -1174,6 +1678,14 @@ async def delete_promo_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     return await list_promos(update, context, direct_call=True)  # direct_call=True сработает как рефреш
 
 
+async def delete_promo_batch_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    batch_id = int(query.data.split('_')[2])
+    delete_promo_batch(batch_id, context.user_data['curr_ev_id'])
+    return await list_promos(update, context, direct_call=True)
+
+
 async def ask_org_card(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -1231,7 +1743,8 @@ async def confirm_delete_org(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Предполагается, что delete_organization_db(org_id) определена в db_utils
     from db_utils import delete_organization_db
     if delete_organization_db(org_id):
-        await query.edit_message_text("✅ Организация успешно удалена.")
+        await query.edit_message_text("✅ Организация успешно удалена. Связанные данные удаляются в фоне.")
+        reaper.kick(context.application, update.effective_chat.id, 'org', org_id)
     else:
         await query.edit_message_text("❌ Ошибка при удалении.")
 
@@ -1258,6 +1771,46 @@ async def stop_bot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     os._exit(0)
 
 
+async def db_trace_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Управление трассировкой запросов БД (только Супер-Админ):
+    /db_trace on|off, /db_trace slow <мс>, /db_trace top, /db_trace reset, /db_trace partitions
+    """
+    if update.effective_user.id != SUPER_ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    args = context.args or []
+    cmd = args[0].lower() if args else 'top'
+
+    if cmd in ('on', 'off'):
+        db_trace.set_enabled(cmd == 'on')
+        await update.message.reply_text(f"🔎 Трассировка БД: <b>{cmd.upper()}</b>", parse_mode='HTML')
+    elif cmd == 'slow' and len(args) > 1 and args[1].isdigit():
+        db_trace.set_slow_threshold(float(args[1]))
+        await update.message.reply_text(f"🐢 Порог медленных запросов: {args[1]} мс")
+    elif cmd == 'reset':
+        db_trace.reset_stats()
+        await update.message.reply_text("♻️ Статистика запросов сброшена.")
+    elif cmd == 'partitions':
+        parts = await asyncio.to_thread(get_ticket_partitions)
+        plan = await asyncio.to_thread(explain_month_tickets, datetime.now().date())
+        msg = "🗂 <b>Секции tickets</b> (≈ строк)\n\n"
+        msg += "\n".join(f"<code>{name}</code>: {rows}" for name, rows in parts) or "Таблица не секционирована."
+        msg += f"\n\n<b>План выборки за текущий месяц:</b>\n<pre>{escape_html(plan or 'нет данных')}</pre>"
+        await update.message.reply_text(msg, parse_mode='HTML')
+    else:
+        top = db_trace.top_queries(10)
+        state = "ON" if db_trace.TRACE_ENABLED else "OFF"
+        msg = f"🔎 <b>Трассировка БД: {state}</b> (порог {db_trace.SLOW_QUERY_MS:.0f} мс)\n\n"
+        if not top:
+            msg += "Нет данных. Включите: /db_trace on"
+        for r in top:
+            msg += (f"<code>{r['function']}</code>: {r['calls']} выз., всего {r['total_ms']:.0f} мс, "
+                    f"ср. {r['avg_ms']:.1f} мс, макс. {r['max_ms']:.1f} мс, строк {r['rows']}\n")
+        await update.message.reply_text(msg, parse_mode='HTML')
+
+
 # admin_handlers.py
 
 async def manage_admins_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -1277,8 +1830,9 @@ async def show_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     org_id = context.user_data.get('selected_org_id')
     current_user_id = update.effective_user.id
     
-    # Получаем список администраторов
-    admins_list = get_org_admins_list(org_id)
+    # Получаем страницу списка администраторов
+    page = paginator.parse(update.callback_query.data, 'adm')
+    admins_list, prev_key, next_key = get_org_admins_page(org_id, page, paginator.PAGE_SIZE)
     
     if not admins_list:
         text = "⚠️ Не удалось получить список администраторов."
@@ -1307,6 +1861,9 @@ async def show_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             keyboard.append(action_row)
 
         keyboard.append([InlineKeyboardButton("—", callback_data='ignore_divider')]) # Разделитель
+
+    if nav := paginator.nav_row('adm', prev_key, next_key):
+        keyboard.append(nav)
         
     # 2. Основные кнопки управления
     control_buttons = [
@@ -1497,6 +2054,7 @@ admin_handler = ConversationHandler(
 
         LVL2_ORG_LIST: [
             CallbackQueryHandler(org_menu, pattern="^sel_org_"),
+            CallbackQueryHandler(list_orgs, pattern=paginator.pattern('aorg')),
             CallbackQueryHandler(ask_new_org_name, pattern="^create_org"),
             CallbackQueryHandler(admin_start, pattern="^back_lvl1"),
             CallbackQueryHandler(list_orgs, pattern="^back_lvl2")  # Для возврата из ask_new_org_name
@@ -1513,6 +2071,7 @@ admin_handler = ConversationHandler(
             CallbackQueryHandler(start_check_ticket, pattern="^check_ticket_org"),
             CallbackQueryHandler(select_broadcast_audience, pattern="^start_org_broadcast$"),
             CallbackQueryHandler(ask_org_card, pattern="^set_org_card$"),
+            CallbackQueryHandler(start_org_bl, pattern="^goto_org_bl$"),
             CallbackQueryHandler(list_orgs, pattern="^back_lvl2"),
             CallbackQueryHandler(org_menu, pattern="^back_menu_org")
         ],
@@ -1546,6 +2105,7 @@ admin_handler = ConversationHandler(
             CallbackQueryHandler(ask_add_admin_login, pattern="^ask_add_admin_login$"),
             # Удалить админа (колбэк должен содержать ID: rm_admin_12345)
             CallbackQueryHandler(process_admin_remove, pattern="^rm_admin_"), # Предполагая, что process_admin_remove существует
+            CallbackQueryHandler(show_admin_menu, pattern=paginator.pattern('adm')),
             # Запрос на передачу прав
             CallbackQueryHandler(ask_transfer_confirm, pattern="^transfer_"), 
             # Назад
@@ -1563,13 +2123,20 @@ admin_handler = ConversationHandler(
         
         LVL4_EVENT_LIST: [
             CallbackQueryHandler(event_menu, pattern="^sel_ev_"),
+            CallbackQueryHandler(list_events, pattern=paginator.pattern('aev')),
             CallbackQueryHandler(start_create_event, pattern="^create_event"),
+            CallbackQueryHandler(ask_catalog_file, pattern="^import_catalog$"),
             CallbackQueryHandler(start_delete_event, pattern="^start_delete_event"),
             CallbackQueryHandler(org_menu, pattern="^back_lvl3")
         ],
+        CATALOG_IMPORT_FILE: [
+            MessageHandler(filters.Document.ALL, catalog_import_file),
+            CallbackQueryHandler(list_events, pattern="^back_lvl4")
+        ],
         
         EVENT_DELETE_CONFIRM: [
             CallbackQueryHandler(confirm_delete_event, pattern="^del_ev_select_"),
+            CallbackQueryHandler(start_delete_event, pattern=paginator.pattern('dev')),
             CallbackQueryHandler(list_events, pattern="^back_lvl4")
         ],
         # ДОБАВЛЕН CallbackQueryHandler для отмены ввода
@@ -1589,6 +2156,11 @@ admin_handler = ConversationHandler(
             CallbackQueryHandler(list_promos, pattern="^list_promos$"),
             CallbackQueryHandler(generate_excel_report, pattern="^report_excel"),
             CallbackQueryHandler(start_check_ticket, pattern="^check_ticket_ev"),
+            CallbackQueryHandler(ask_event_capacity, pattern="^event_capacity_cfg$"),
+            CallbackQueryHandler(ask_waiting_room_rate, pattern="^waiting_room_cfg$"),
+            CallbackQueryHandler(ballot_menu, pattern="^adm_ballot_menu$"),
+            CallbackQueryHandler(cancel_event_confirm, pattern="^cancel_ev_ask$"),
+            CallbackQueryHandler(cancel_event_run, pattern="^cancel_ev_run$"),
             CallbackQueryHandler(list_events, pattern="^back_lvl4"),
             CallbackQueryHandler(event_menu, pattern="^back_menu_ev")
         ],
@@ -1597,6 +2169,10 @@ admin_handler = ConversationHandler(
         LVL6_PROMO_MENU: [
             CallbackQueryHandler(start_create_promo, pattern="^create_promo$"),
             CallbackQueryHandler(delete_promo_handler, pattern="^del_promo_"),
+            CallbackQueryHandler(start_promo_batch, pattern="^create_promo_batch$"),
+            CallbackQueryHandler(export_promo_batch_handler, pattern="^promo_exp_"),
+            CallbackQueryHandler(delete_promo_batch_handler, pattern="^del_pbatch_"),
+            CallbackQueryHandler(list_promos, pattern=paginator.pattern('promo')),
             CallbackQueryHandler(event_menu, pattern="^back_menu_ev$"),  # Назад в меню ивента
             # Если вы используете "direct_call", иногда нужен обработчик "refresh":
             CallbackQueryHandler(list_promos, pattern="^back_promo_list$")
@@ -1614,6 +2190,18 @@ admin_handler = ConversationHandler(
             MessageHandler(filters.TEXT & ~filters.COMMAND, input_promo_limit),
             CallbackQueryHandler(list_promos, pattern="^back_promo_list$")
         ],
+        PROMO_BATCH_COUNT: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, input_promo_batch_count),
+            CallbackQueryHandler(list_promos, pattern="^back_promo_list$")
+        ],
+        PROMO_BATCH_PERCENT: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, input_promo_batch_percent),
+            CallbackQueryHandler(list_promos, pattern="^back_promo_list$")
+        ],
+        PROMO_BATCH_LABEL: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, input_promo_batch_label),
+            CallbackQueryHandler(list_promos, pattern="^back_promo_list$")
+        ],
         # ---------------------------------
 
 
@@ -1659,6 +2247,8 @@ admin_handler = ConversationHandler(
         # GLOBAL BLACKLIST STATES (ОБНОВЛЕНО)
         GLOBAL_BLACKLIST_MENU: [
             CallbackQueryHandler(ask_global_bl_id, pattern="^add_global_bl"),
+            CallbackQueryHandler(ask_blacklist_file, pattern="^import_global_bl$"),
+            CallbackQueryHandler(start_global_bl, pattern=paginator.pattern('gbl')),
             CallbackQueryHandler(admin_start, pattern="^back_lvl1"),
             CallbackQueryHandler(start_global_bl, pattern="^goto_global_bl")
         ],
@@ -1670,6 +2260,17 @@ admin_handler = ConversationHandler(
             MessageHandler(filters.TEXT & ~filters.COMMAND, process_global_bl_add),
             CallbackQueryHandler(start_global_bl, pattern="^goto_global_bl")
         ],
+        ORG_BLACKLIST_MENU: [
+            CallbackQueryHandler(ask_blacklist_file, pattern="^import_org_bl$"),
+            CallbackQueryHandler(start_org_bl, pattern=paginator.pattern('obl')),
+            CallbackQueryHandler(start_org_bl, pattern="^goto_org_bl$"),
+            CallbackQueryHandler(org_menu, pattern="^back_menu_org$")
+        ],
+        BLACKLIST_IMPORT_FILE: [
+            MessageHandler(filters.Document.ALL, blacklist_import_file),
+            CallbackQueryHandler(start_org_bl, pattern="^goto_org_bl$"),
+            CallbackQueryHandler(start_global_bl, pattern="^goto_global_bl")
+        ],
 
         # CHECK TICKET STATES (ОБНОВЛЕНО)
         INPUT_CHECK_TICKET: [
@@ -1684,6 +2285,24 @@ admin_handler = ConversationHandler(
             CallbackQueryHandler(confirm_db_reset, pattern="^db_reset_confirm$"),
             CallbackQueryHandler(admin_start, pattern="^back_lvl1")
         ],
+
+        BALLOT_MENU: [
+            CallbackQueryHandler(ballot_set_mode, pattern="^adm_ballot_mode_"),
+            CallbackQueryHandler(ballot_draw_confirm, pattern="^adm_ballot_draw$"),
+            CallbackQueryHandler(ballot_run_draw, pattern="^adm_ballot_run$"),
+            CallbackQueryHandler(ballot_menu, pattern="^adm_ballot_menu$"),
+            CallbackQueryHandler(event_menu, pattern="^back_menu_ev$"),
+        ],
+
+        INPUT_EVENT_CAPACITY: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, save_event_capacity),
+            CallbackQueryHandler(event_menu, pattern="^back_menu_ev$"),
+        ],
+
+        INPUT_WAITING_ROOM_RATE: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, save_waiting_room_rate),
+            CallbackQueryHandler(event_menu, pattern="^back_menu_ev$"),
+        ],
     },
     fallbacks=[CommandHandler("cancel", cancel_global), CallbackQueryHandler(cancel_global, pattern='^cancel_global')]
 
@@ -1,14 +1,17 @@
 # api/webhook.py
 
 import os
+import hmac
 import logging
 from fastapi import FastAPI, Request
+from fastapi.responses import Response
 
 # Убедитесь, что bot.py, db_utils.py и т.д. находятся на том же уровне
 # или доступны для импорта (в Vercel все файлы в корне проекта)
 try:
     from bot import setup_application
     from db_utils import create_tables
+    import metrics
 except ImportError:
     # Для локального тестирования
     import sys
@@ -16,6 +19,7 @@ except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from bot import setup_application
     from db_utils import create_tables
+    import metrics
 
 # --- Инициализация ---
 
@@ -24,6 +28,10 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
     logging.critical("TELEGRAM_TOKEN не найден в окружении Vercel.")
 
+# /metrics на публичном адресе вебхука отдается только с заголовком Authorization: Bearer <METRICS_TOKEN>;
+# без METRICS_TOKEN эндпоинт выключен (404)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 # Инициализируем приложение Telegram
 app_telegram = setup_application(TELEGRAM_TOKEN)
 app_telegram.set_sync_processing(False)  # Асинхронная обработка
@@ -51,4 +59,14 @@ async def telegram_webhook(request: Request):
         return {"status": "ok"}
     except Exception as e:
         logging.error(f"Ошибка обработки Webhook: {e}")
-        return {"status": "error", "message": str(e)}, 500
\ No newline at end of file
+        return {"status": "error", "message": str(e)}, 500
+
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Метрики бота в формате Prometheus (латентность хендлеров, БД, Telegram API, рассылки)."""
+    if not METRICS_TOKEN:
+        return Response(status_code=404)
+    if not hmac.compare_digest(request.headers.get("authorization", "").encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return Response(status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
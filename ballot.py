@@ -0,0 +1,34 @@
+# ballot.py
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from notifications import Notification, send_bulk
+from utils import escape_html
+
+# Настройки, режимы продажи и сам розыгрыш - в ballot_draw.py (без зависимости от telegram,
+# его импортирует db_utils); здесь - уведомления участникам
+from ballot_draw import BALLOT_MAX_PER_USER, MODE_FCFS, MODE_BALLOT, MODE_BALLOT_DRAWN, allocate
+
+
+def result_notification(result: dict) -> Notification:
+    """Уведомление участнику по результату run_ballot_draw."""
+    event_name = escape_html(result['event_name'])
+    if not result['won']:
+        return Notification(result['chat_id'],
+                            f"🎲 Розыгрыш билетов на <b>{event_name}</b> завершен.\n"
+                            f"К сожалению, в этот раз вам не повезло.")
+
+    text = (
+        f"🎉 <b>Вы выиграли в лотерее!</b>\n\n"
+        f"Мероприятие: {event_name}\n"
+        f"Билет: {escape_html(result['product_name'])} x{result['quantity']}\n"
+        f"<b>К оплате: {result['amount']} руб.</b>\n"
+        f"Карта: <code>{result['card'] or 'УТОЧНИТЕ У ОРГАНИЗАТОРА'}</code>\n\n"
+        f"Переведите сумму без комментариев и нажмите «Я оплатил»."
+    )
+    kb = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Я оплатил", callback_data=f"ballot_paid_{result['entry_id']}")]])
+    return Notification(result['chat_id'], text, kb)
+
+
+async def notify_results(bot, results: list[dict]) -> tuple[int, int]:
+    """Массовая рассылка результатов (с ограничением скорости, см. notifications.py)."""
+    return await send_bulk(bot, (result_notification(r) for r in results), mode='ballot')
@@ -0,0 +1,48 @@
+# ballot_draw.py
+
+import os
+import random
+
+# --- НАСТРОЙКИ ---
+# Сколько билетов один пользователь может запросить в лотерее
+BALLOT_MAX_PER_USER = int(os.getenv("BALLOT_MAX_PER_USER", 2))
+
+# Режимы продажи мероприятия (events.sale_mode)
+MODE_FCFS = 'fcfs'                  # обычная продажа: кто первый, тот и купил
+MODE_BALLOT = 'ballot'              # прием заявок в лотерею
+MODE_BALLOT_DRAWN = 'ballot_drawn'  # розыгрыш проведен
+
+_rng = random.SystemRandom()
+
+
+def allocate(entries: list[dict], remaining: dict, total: int | None = None,
+             rng: random.Random = None) -> list[tuple[dict, int, int]]:
+    """
+    Розыгрыш за один проход: заявки перемешиваются случайно, затем каждой по очереди
+    выдается основной тариф, а если его не хватает - запасной (все или ничего).
+
+    entries: [{'id', 'product_id', 'alt_product_id', 'quantity', ...}]
+    remaining: {product_id: остаток или None (безлимит)} - изменяется на месте.
+    total: общий остаток мест площадки (None - без общего лимита).
+    Возвращает [(заявка, выигранный product_id, количество)].
+    """
+    order = list(entries)
+    (rng or _rng).shuffle(order)
+
+    wins = []
+    for entry in order:
+        qty = max(1, min(entry['quantity'], BALLOT_MAX_PER_USER))
+        if total is not None and total < qty:
+            continue
+        for pid in (entry['product_id'], entry['alt_product_id']):
+            if pid is None or pid not in remaining:
+                continue
+            left = remaining[pid]
+            if left is None or left >= qty:
+                if left is not None:
+                    remaining[pid] = left - qty
+                if total is not None:
+                    total -= qty
+                wins.append((entry, pid, qty))
+                break
+    return wins
@@ -0,0 +1,158 @@
+# bench/capacity_concurrency.py
+#
+# Конкурентная проверка общей вместимости площадки (event_capacity_shards) и лимитов тарифов:
+# много потоков одновременно покупают билеты разных тарифов через create_ticket_record
+# (и, если задана доля заказов, заказы из нескольких тарифов через create_order_tickets),
+# спрос заведомо больше предложения. Проверяем, что:
+#   - ни один тариф не продан сверх quantity_limit (и quantity_sold совпадает с числом билетов),
+#   - общий лимит не превышен, а проданное + остаток пула = вместимость,
+#   - при избыточном спросе продано ровно min(вместимость, сумма лимитов) - нет ложных "мест нет",
+#   - ни одна покупка не оборвалась взаимной блокировкой (deadlock detected в логе ошибок).
+#
+# ВНИМАНИЕ: создает и затем удаляет тестовые организацию/мероприятие/пользователя в БД из DATABASE_URL.
+# Запуск: python bench/capacity_concurrency.py [потоков] [покупок на поток] [вместимость] [доля заказов, %]
+
+import os
+import sys
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_utils import connect_db, create_tables, create_ticket_record, create_order_tickets, set_event_capacity
+
+TEST_CHAT_ID = -990001
+TARIFF_LIMITS = (400, 400, 0)  # два тарифа с лимитом и один безлимитный
+
+
+class DeadlockCounter(logging.Handler):
+    """Считает ошибки покупок из-за взаимных блокировок (db_utils их логирует и возвращает None)."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        if "deadlock detected" in record.getMessage():
+            self.count += 1
+
+
+def setup(capacity: int) -> tuple[int, int, list[int]]:
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO users (chat_id, username, first_name) VALUES (%s, 'capacity_test', 'Capacity Test')
+        ON CONFLICT (chat_id) DO NOTHING
+    """, (TEST_CHAT_ID,))
+    cursor.execute("INSERT INTO organizations (name, owner_id) VALUES ('Capacity Test', %s) RETURNING id",
+                   (TEST_CHAT_ID,))
+    org_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO events (org_id, name) VALUES (%s, 'Capacity Test') RETURNING id", (org_id,))
+    event_id = cursor.fetchone()[0]
+    product_ids = []
+    for i, limit in enumerate(TARIFF_LIMITS):
+        cursor.execute("""
+            INSERT INTO products (event_id, name, price, quantity_limit) VALUES (%s, %s, 100, %s) RETURNING id
+        """, (event_id, f"Tariff {i}", limit))
+        product_ids.append(cursor.fetchone()[0])
+    conn.commit()
+    conn.close()
+
+    set_event_capacity(event_id, capacity)
+    return org_id, event_id, product_ids
+
+
+def cleanup(org_id: int):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM organizations WHERE id = %s", (org_id,))  # каскад: мероприятие, тарифы, билеты
+    cursor.execute("DELETE FROM users WHERE chat_id = %s", (TEST_CHAT_ID,))
+    conn.commit()
+    conn.close()
+
+
+def buyer(worker: int, attempts: int, product_ids: list[int], event_id: int, order_pct: int) -> int:
+    rnd = random.Random(worker)
+    sold = 0
+    for i in range(attempts):
+        if rnd.randrange(100) < order_pct:
+            # Заказ: два тарифа по 1-2 билета - блокирует несколько тарифов и шардов в одной транзакции
+            items = [(pid, rnd.randint(1, 2), 100) for pid in rnd.sample(product_ids, 2)]
+            ticket_ids = create_order_tickets(f"CAP{event_id}-{worker}-{i}", items, TEST_CHAT_ID,
+                                              "Test", "test@example.com")
+            sold += len(ticket_ids or [])
+            continue
+        pid = rnd.choice(product_ids)
+        # ID с номером мероприятия: ticket_registry хранит ID и после удаления тестовых билетов
+        if create_ticket_record(f"T-CAP{event_id}-{worker:03d}{i:05d}", pid, TEST_CHAT_ID, "Test", "test@example.com", 100):
+            sold += 1
+    return sold
+
+
+def verify(event_id: int, capacity: int, deadlocks: int) -> bool:
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT p.id, p.quantity_limit, p.quantity_sold, COUNT(t.ticket_id)
+        FROM products p LEFT JOIN tickets t ON t.product_id = p.id
+        WHERE p.event_id = %s GROUP BY p.id ORDER BY p.id
+    """, (event_id,))
+    products = cursor.fetchall()
+    cursor.execute("SELECT COALESCE(SUM(remaining), 0), MIN(remaining) FROM event_capacity_shards WHERE event_id = %s",
+                   (event_id,))
+    pool_left, shard_min = cursor.fetchone()
+    conn.close()
+
+    ok = True
+    total = 0
+    for pid, limit, sold, tickets in products:
+        total += tickets
+        good = sold == tickets and (limit == 0 or tickets <= limit)
+        ok &= good
+        print(f"  tariff {pid}: limit={limit or '∞'} sold={sold} tickets={tickets} {'OK' if good else 'OVERSOLD'}")
+
+    expected = capacity if 0 in TARIFF_LIMITS else min(capacity, sum(TARIFF_LIMITS))
+    checks = {
+        "event cap not exceeded": total <= capacity,
+        "sold + pool = capacity": total + pool_left == capacity,
+        "no negative shard": shard_min is None or shard_min >= 0,
+        "no false sold-out": total == expected,
+        "no deadlocks": deadlocks == 0,
+    }
+    for name, passed in checks.items():
+        ok &= passed
+        print(f"  {name:<24} {'OK' if passed else 'FAIL'}")
+    print(f"  total sold={total} capacity={capacity} pool_left={pool_left} deadlocks={deadlocks}")
+    return ok
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    capacity = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    order_pct = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+
+    create_tables()
+    deadlocks = DeadlockCounter()
+    logging.getLogger().addHandler(deadlocks)
+    org_id, event_id, product_ids = setup(capacity)
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            sold = sum(pool.map(lambda w: buyer(w, per_thread, product_ids, event_id, order_pct), range(threads)))
+        elapsed = time.perf_counter() - started
+
+        print(f"attempts={threads * per_thread} sold={sold} time={elapsed:.2f}s "
+              f"({threads * per_thread / elapsed:.0f} attempts/s, {threads} threads, {order_pct}% orders)")
+        ok = verify(event_id, capacity, deadlocks.count)
+    finally:
+        cleanup(org_id)
+
+    print("RESULT:", "PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# bench/delete_lock_wait.py
+#
+# Задержки продаж во время удаления большой организации: пока удаляется организация с N билетами,
+# потоки покупают билеты другой организации через create_ticket_record. Сравниваются два режима:
+#   cascade - прежнее удаление одной транзакцией (DELETE FROM organizations ... ON DELETE CASCADE),
+#   chunked - мягкое удаление + порционное удаление reap_chunk с паузами (как в reaper.py).
+# Параллельно раз в 20 мс снимается число сессий, ждущих блокировку (pg_stat_activity.wait_event_type = 'Lock').
+#
+# ВНИМАНИЕ: создает и затем удаляет тестовые организации/пользователя в БД из DATABASE_URL.
+# Запуск: python bench/delete_lock_wait.py [билетов удаляемой организации] [потоков-покупателей]
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_utils import connect_db, create_tables, create_ticket_record, delete_organization_db, reap_chunk
+
+TEST_CHAT_ID = -990002
+CHUNK = 500
+PAUSE = 0.05
+
+
+def create_org(name: str, tickets: int) -> tuple[int, int]:
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO organizations (name, owner_id) VALUES (%s, %s) RETURNING id", (name, TEST_CHAT_ID))
+    org_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO events (org_id, name) VALUES (%s, %s) RETURNING id", (org_id, name))
+    event_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO products (event_id, name, price, quantity_limit) VALUES (%s, 'Bench', 100, 0) RETURNING id",
+                   (event_id,))
+    product_id = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO tickets (ticket_id, product_id, buyer_chat_id, buyer_name, buyer_email, final_price, is_active)
+        SELECT 'T-DEL' || %s || '-' || g, %s, %s, 'Bench', 'bench@example.com', 100, TRUE
+        FROM generate_series(1, %s) AS g
+    """, (org_id, product_id, TEST_CHAT_ID, tickets))
+    conn.commit()
+    conn.close()
+    return org_id, product_id
+
+
+def setup():
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO users (chat_id, username, first_name) VALUES (%s, 'delete_bench', 'Delete Bench')
+        ON CONFLICT (chat_id) DO NOTHING
+    """, (TEST_CHAT_ID,))
+    conn.commit()
+    conn.close()
+
+
+def cleanup():
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM organizations WHERE owner_id = %s", (TEST_CHAT_ID,))
+    cursor.execute("DELETE FROM users WHERE chat_id = %s", (TEST_CHAT_ID,))
+    conn.commit()
+    conn.close()
+
+
+def delete_cascade(org_id: int):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM organizations WHERE id = %s", (org_id,))
+    conn.commit()
+    conn.close()
+
+
+def delete_chunked(org_id: int):
+    delete_organization_db(org_id)
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM events WHERE org_id = %s", (org_id,))
+    targets = [('event', r[0]) for r in cursor.fetchall()] + [('org', org_id)]
+    conn.close()
+
+    for kind, target_id in targets:
+        while True:
+            table, _ = reap_chunk(kind, target_id, CHUNK)
+            if table in ('events', 'organizations'):
+                break
+            time.sleep(PAUSE)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def run(mode: str, victim_tickets: int, threads: int):
+    victim_org, _ = create_org(f"Delete Bench victim ({mode})", victim_tickets)
+    live_org, live_product = create_org(f"Delete Bench live ({mode})", 0)
+
+    stop = threading.Event()
+    latencies: list[float] = []
+    lock_waiters: list[int] = []
+
+    def buyer(worker: int):
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            # ID с номером организации: ticket_registry хранит ID и после удаления тестовых билетов
+            create_ticket_record(f"T-LIVE{live_org}-{worker:03d}{i:06d}", live_product, TEST_CHAT_ID,
+                                 "Bench", "bench@example.com", 100)
+            latencies.append(time.perf_counter() - started)
+            i += 1
+
+    def sampler():
+        conn = connect_db()
+        conn.autocommit = True
+        cursor = conn.cursor()
+        while not stop.is_set():
+            cursor.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+            lock_waiters.append(cursor.fetchone()[0])
+            time.sleep(0.02)
+        conn.close()
+
+    with ThreadPoolExecutor(threads + 1) as pool:
+        pool.submit(sampler)
+        for w in range(threads):
+            pool.submit(buyer, w)
+        time.sleep(0.5)  # прогрев: покупки идут до начала удаления
+
+        started = time.perf_counter()
+        delete_cascade(victim_org) if mode == 'cascade' else delete_chunked(victim_org)
+        elapsed = time.perf_counter() - started
+        stop.set()
+
+    print(f"[{mode}] delete of {victim_tickets} tickets took {elapsed:.2f}s")
+    print(f"  purchases={len(latencies)} p50={percentile(latencies, 0.5) * 1000:.1f}ms "
+          f"p95={percentile(latencies, 0.95) * 1000:.1f}ms p99={percentile(latencies, 0.99) * 1000:.1f}ms "
+          f"max={max(latencies, default=0) * 1000:.1f}ms")
+    print(f"  lock waiters: max={max(lock_waiters, default=0)} "
+          f"samples with waits={sum(1 for n in lock_waiters if n)}/{len(lock_waiters)}")
+
+
+def main():
+    victim_tickets = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    create_tables()
+    setup()
+    try:
+        for mode in ('cascade', 'chunked'):
+            run(mode, victim_tickets, threads)
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# bench/login_latency.py
+#
+# Латентность входа при 50 одновременных логинах:
+#   inline - KDF прямо в корутине (как было бы без пула),
+#   pool   - KDF в пуле (passwords.verify_password).
+# Параллельно меряем задержку event loop (насколько "залипают" остальные апдейты).
+#
+# Запуск: python bench/login_latency.py [кол-во логинов]
+
+import os
+import sys
+import time
+import asyncio
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords
+
+PASSWORD = "Secret123"
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+async def loop_lag_probe(stop: asyncio.Event, lags: list[float], interval: float = 0.01):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def login_inline(stored_hash: str, started: float) -> float:
+    ok = passwords.verify_password_sync(PASSWORD, stored_hash)
+    assert ok
+    return time.perf_counter() - started
+
+
+async def login_pooled(stored_hash: str, started: float) -> float:
+    ok, _ = await passwords.verify_password(PASSWORD, stored_hash)
+    assert ok
+    return time.perf_counter() - started
+
+
+async def run(mode: str, concurrency: int, stored_hash: str):
+    fn = login_inline if mode == "inline" else login_pooled
+    lags: list[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop, lags))
+
+    started = time.perf_counter()
+    # Латентность считается от общего старта: все логины пришли одновременно
+    latencies = await asyncio.gather(*(fn(stored_hash, started) for _ in range(concurrency)))
+    total = time.perf_counter() - started
+
+    stop.set()
+    await probe
+
+    print(f"[{mode:6}] logins={concurrency} total={total * 1000:.0f}ms "
+          f"p50={statistics.median(latencies) * 1000:.1f}ms p99={percentile(latencies, 99) * 1000:.1f}ms "
+          f"loop_lag_max={max(lags or [0]) * 1000:.1f}ms")
+
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    stored_hash = passwords.hash_password_sync(PASSWORD)
+    print(f"scrypt n={passwords.SCRYPT_N} r={passwords.SCRYPT_R} p={passwords.SCRYPT_P}, "
+          f"pool={passwords.HASH_EXECUTOR_KIND} x{passwords.HASH_WORKERS}")
+    await run("inline", concurrency, stored_hash)
+    await run("pool", concurrency, stored_hash)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+# bench/update_throughput.py
+#
+# Пропускная способность обработки апдейтов при смешанной нагрузке:
+#   - покупатели: короткие хендлеры с I/O (вызовы Telegram API / БД ~ 5-40 мс),
+#   - админы: редкие "тяжелые" апдейты (отчет ~ 500 мс),
+#   - контролеры на входе: проверка билетов (use_*).
+# Сравниваем последовательную обработку (как было) с PerChatUpdateProcessor,
+# проверяем, что порядок апдейтов внутри каждого чата сохранен,
+# и печатаем p99 латентности по полосам приоритета.
+#
+# Запуск: python bench/update_throughput.py [чатов] [апдейтов на чат] [лимит параллельности]
+
+import os
+import sys
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_processing import PerChatUpdateProcessor, classify_update
+
+
+def make_traffic(chats: int, per_chat: int, admin_share: float = 0.05, checkin_share: float = 0.1):
+    rnd = random.Random(42)
+    updates = []
+    for seq in range(per_chat):
+        for chat_id in range(chats):
+            roll = rnd.random()
+            if roll < admin_share:
+                data, cost = "report_excel", 0.5
+            elif roll < admin_share + checkin_share:
+                data, cost = "use_T-1A2B3C4D", rnd.uniform(0.005, 0.02)
+            else:
+                data, cost = f"buy_ev_{rnd.randint(1, 50)}", rnd.uniform(0.005, 0.04)
+            updates.append(SimpleNamespace(
+                effective_chat=SimpleNamespace(id=chat_id),
+                effective_user=SimpleNamespace(id=chat_id),
+                callback_query=SimpleNamespace(data=data),
+                seq=seq,
+                cost=cost,
+            ))
+    return updates
+
+
+async def handle(update, seen: dict, latencies: list, arrived: float):
+    await asyncio.sleep(update.cost)
+    seen.setdefault(update.effective_chat.id, []).append(update.seq)
+    latencies.append((classify_update(update), time.perf_counter() - arrived))
+
+
+async def run(label: str, updates: list, processor: PerChatUpdateProcessor | None):
+    seen: dict = {}
+    latencies: list = []
+    started = time.perf_counter()
+
+    if processor is None:
+        for u in updates:
+            await handle(u, seen, latencies, started)
+    else:
+        # Как Application: задача на каждый апдейт в порядке получения
+        await asyncio.gather(*(
+            processor.process_update(u, handle(u, seen, latencies, started)) for u in updates
+        ))
+
+    total = time.perf_counter() - started
+    ordered = all(seq == sorted(seq) for seq in seen.values())
+    print(f"[{label:>12}] updates={len(updates)} time={total:.2f}s "
+          f"throughput={len(updates) / total:.0f} upd/s p99={p99([l for _, l in latencies]):.2f}s "
+          f"per_chat_order={'OK' if ordered else 'BROKEN'}")
+    for lane in sorted({lane for lane, _ in latencies}):
+        print(f"{'':>16}{lane:<10} p99={p99([l for ln, l in latencies if ln == lane]):.2f}s")
+
+
+def p99(values: list) -> float:
+    values = sorted(values)
+    return values[max(0, int(len(values) * 0.99) - 1)]
+
+
+async def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_chat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+
+    updates = make_traffic(chats, per_chat)
+    # Последовательный режим на всей выборке слишком долгий - берем срез и экстраполируем по upd/s
+    await run("sequential", updates[:chats], None)
+    await run(f"per-chat x{limit}", updates, PerChatUpdateProcessor(limit))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+# blacklist.py
+
+import os
+import re
+import time
+from catalog_import import read_rows
+from db_utils import get_blacklist_count
+
+# --- НАСТРОЙКИ ---
+BLACKLIST_IMPORT_MAX_ROWS = int(os.getenv("BLACKLIST_IMPORT_MAX_ROWS", 100000))
+BLACKLIST_IMPORT_MAX_BYTES = 10 * 1024 * 1024
+# Счетчик в шапке списка: COUNT(*) по десяткам тысяч строк не на каждое листание
+COUNT_CACHE_TTL = float(os.getenv("BLACKLIST_COUNT_TTL", 60))
+REASON_MAX_LENGTH = 200
+MAX_REPORTED_ERRORS = 30
+
+TEMPLATE_HINT = (
+    "Первая колонка - Telegram ID, вторая (необязательно) - причина. "
+    "Строка заголовков допускается. Подойдет и простой список ID по одному в строке."
+)
+
+# org_id (None - глобальный список) -> (monotonic время истечения, количество)
+_counts: dict = {}
+
+
+def parse_ids(data: bytes, filename: str) -> tuple[list[tuple[int, str | None]], list[str]]:
+    """Строки файла -> ([(user_id, причина)] без повторов, ошибки "Строка N: ...")."""
+    entries: dict[int, str | None] = {}
+    errors: list[str] = []
+    for line, raw in enumerate(read_rows(data, filename), start=1):
+        cells = ["" if v is None else str(v).strip() for v in raw]
+        if len(cells) == 1:
+            # Sniffer не угадывает разделитель, если причина есть не у всех строк
+            cells = [c.strip() for c in re.split(r'[,;\t]', cells[0], maxsplit=1)]
+        if not any(cells):
+            continue
+        value = cells[0].replace(' ', '')
+        if value.endswith('.0'):  # Числовая ячейка Excel
+            value = value[:-2]
+        if not value.lstrip('-').isdigit():
+            if line == 1:
+                continue  # Заголовок
+            errors.append(f"Строка {line}: '{cells[0][:30]}' - не Telegram ID")
+            continue
+        if len(entries) >= BLACKLIST_IMPORT_MAX_ROWS:
+            errors.append(f"Больше {BLACKLIST_IMPORT_MAX_ROWS} ID - разбейте файл на части")
+            break
+        reason = cells[1][:REASON_MAX_LENGTH] if len(cells) > 1 and cells[1] else None
+        entries.setdefault(int(value), reason)
+    if not entries and not errors:
+        errors.append("В файле нет ID")
+    return list(entries.items()), errors
+
+
+def format_errors(errors: list[str]) -> str:
+    shown = errors[:MAX_REPORTED_ERRORS]
+    more = len(errors) - len(shown)
+    return "\n".join(shown) + (f"\n... и еще {more}" if more else "")
+
+
+def count(org_id: int | None) -> int | None:
+    """Размер списка с кэшем на COUNT_CACHE_TTL. None - ошибка БД."""
+    now = time.monotonic()
+    cached = _counts.get(org_id)
+    if cached and cached[0] > now:
+        return cached[1]
+    result = get_blacklist_count(org_id)
+    if result is not None:
+        _counts[org_id] = (now + COUNT_CACHE_TTL, result)
+    return result
+
+
+def invalidate(org_id: int | None):
+    _counts.pop(org_id, None)
@@ -5,11 +5,23 @@ import logging
 import sys
 from dotenv import load_dotenv
 from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, InlineQueryHandler
 from db_utils import create_tables, add_bank_card_column, migrate_refund_system
-from user_handlers import buy_handler, issue_ticket_from_admin_notification
-from admin_handlers import admin_handler, stop_bot_handler
+from user_handlers import buy_handler, issue_ticket_from_admin_notification, ballot_paid, waitlist_decline
+from admin_handlers import admin_handler, stop_bot_handler, db_trace_handler
 from utils import cancel_global
+from rate_limit import throttle_handler
+from update_processing import PerChatUpdateProcessor, MAX_CONCURRENT_UPDATES
+from metrics import InstrumentedRequest, instrument_conversation, instrument_handler, start_http_server
+import waiting_room
+import waitlist
+import reaper
+import partitions
+import event_dates
+import reminders
+import inline_mode
+import ticket_codes
+import deep_links
 
 # --- Настройка логирования ---
 LOG_FILE_NAME = "bot.log"
@@ -34,6 +46,65 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Локальный /metrics в режиме polling (в webhook-режиме - FastAPI /metrics, только с METRICS_TOKEN)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+TG_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", 256))
+
+
+def setup_application(token: str) -> Application:
+    """Собирает Application со всеми хендлерами (используется и polling, и webhook)."""
+    ticket_codes.check_secret()
+    deep_links.check_secret()
+    app = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=TG_POOL_SIZE))
+        # Разные чаты обрабатываются параллельно, один чат - строго по порядку
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .build()
+    )
+
+    # Rate limiting (группа -1 обрабатывается раньше всех остальных)
+    app.add_handler(throttle_handler, group=-1)
+
+    # Хендлеры (с замером латентности, см. metrics.py)
+    app.add_handler(instrument_conversation(buy_handler, "buy"))
+    app.add_handler(instrument_conversation(admin_handler, "admin"))
+    app.add_handler(instrument_handler(CommandHandler("stop_bot", stop_bot_handler)))
+    app.add_handler(instrument_handler(CommandHandler("db_trace", db_trace_handler)))
+
+    # Глобальный callback для админов (подтверждение оплаты)
+    app.add_handler(instrument_handler(CallbackQueryHandler(
+        issue_ticket_from_admin_notification,
+        pattern=r'^(adm_approve_|adm_reject_)[0-9A-Z]+$'
+    )))
+
+    # Глобальный callback победителей лотереи ("Я оплатил" в рассылке результатов)
+    app.add_handler(instrument_handler(CallbackQueryHandler(ballot_paid, pattern=r'^ballot_paid_\d+$')))
+    # Отказ от места из листа ожидания
+    app.add_handler(instrument_handler(CallbackQueryHandler(waitlist_decline, pattern=r'^wl_decline_\d+$')))
+    # Inline-режим: поиск мероприятий из любого чата со ссылкой на покупку
+    app.add_handler(instrument_handler(InlineQueryHandler(inline_mode.inline_query)))
+
+    app.add_handler(instrument_handler(CommandHandler("cancel", cancel_global)))
+
+    # Виртуальная очередь: допуск по расписанию и обновление позиций
+    app.job_queue.run_repeating(waiting_room.tick, interval=waiting_room.TICK_SECONDS, first=waiting_room.TICK_SECONDS,
+                                name="waiting_room")
+    # Лист ожидания: истекшие предложения и раздача освободившихся мест
+    app.job_queue.run_repeating(waitlist.tick, interval=waitlist.WAITLIST_TICK, first=waitlist.WAITLIST_TICK,
+                                name="waitlist")
+    # Фоновое удаление мероприятий и организаций порциями (после мягкого удаления)
+    app.job_queue.run_repeating(reaper.tick, interval=reaper.REAPER_TICK, first=reaper.REAPER_TICK, name="reaper")
+    # Секции tickets: будущие месяцы сразу при старте, затем периодически; архив старых
+    app.job_queue.run_repeating(partitions.tick, interval=partitions.PARTITIONS_TICK, first=0, name="partitions")
+    # Разбор date_str в starts_at для мероприятий, созданных до появления колонки
+    app.job_queue.run_once(event_dates.backfill, 0, name="event_dates_backfill")
+    # Напоминания держателям билетов перед началом мероприятия
+    app.job_queue.run_repeating(reminders.tick, interval=reminders.REMINDER_TICK, first=reminders.REMINDER_TICK,
+                                name="reminders")
+
+    return app
 
 
 def main():
@@ -43,20 +114,10 @@ def main():
 
     create_tables()
 
-    app = Application.builder().token(TOKEN).build()
-
-    # Хендлеры
-    app.add_handler(buy_handler)
-    app.add_handler(admin_handler)
-    app.add_handler(CommandHandler("stop_bot", stop_bot_handler))
-
-    # Глобальный callback для админов (подтверждение оплаты)
-    app.add_handler(CallbackQueryHandler(
-        issue_ticket_from_admin_notification,
-        pattern=r'^(adm_approve_|adm_reject_)[a-fA-F0-9]+$'
-    ))
+    app = setup_application(TOKEN)
 
-    app.add_handler(CommandHandler("cancel", cancel_global))
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
 
     logger.info("Bot started...")
     app.run_polling()
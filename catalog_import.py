@@ -0,0 +1,163 @@
+# catalog_import.py
+
+import io
+import os
+import csv
+import openpyxl
+from datetime import datetime, date
+from event_dates import parse_event_datetime, EVENT_TZ, DEFAULT_TIME
+
+# --- НАСТРОЙКИ ---
+CATALOG_IMPORT_MAX_ROWS = int(os.getenv("CATALOG_IMPORT_MAX_ROWS", 5000))
+CATALOG_IMPORT_MAX_BYTES = 5 * 1024 * 1024
+# Сколько ошибок показываем админу (остальные - одной строкой "и еще N")
+MAX_REPORTED_ERRORS = 30
+
+# Строка файла = тариф. Строки с одинаковыми (event, date) - одно мероприятие; без tariff - мероприятие без тарифов.
+COLUMNS = ('event', 'date', 'location', 'description', 'tariff', 'price', 'limit', 'refundable')
+REQUIRED = ('event', 'date')
+# Русские заголовки -> колонки
+_ALIASES = {
+    'мероприятие': 'event', 'дата': 'date', 'место': 'location', 'описание': 'description',
+    'тариф': 'tariff', 'цена': 'price', 'лимит': 'limit', 'возврат': 'refundable',
+}
+_YES = {'1', 'yes', 'y', 'true', 'да', '+'}
+_NO = {'', '0', 'no', 'n', 'false', 'нет', '-'}
+
+TEMPLATE_HINT = (
+    "Колонки (первая строка - заголовки): <code>" + ", ".join(COLUMNS) + "</code>\n"
+    "• event, date - обязательно; строки с одинаковыми event+date - одно мероприятие\n"
+    "• tariff, price, limit (0 - безлимит), refundable (да/нет) - тариф этой строки\n"
+    "• location, description - необязательно"
+)
+
+
+def read_rows(data: bytes, filename: str):
+    """Строки файла по одной (xlsx - openpyxl read-only, без загрузки листа целиком; иначе CSV)."""
+    if filename.lower().endswith('.xlsx'):
+        wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        try:
+            yield from wb.active.iter_rows(values_only=True)
+        finally:
+            wb.close()
+        return
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(text, dialect)
+
+
+def _text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _int(value, field: str, default: int | None = None) -> int:
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value == int(value):
+        number = int(value)
+    elif _text(value) == "" and default is not None:
+        return default
+    else:
+        try:
+            number = int(_text(value).replace(' ', ''))
+        except ValueError:
+            raise ValueError(f"{field}: нужно целое число")
+    if number < 0:
+        raise ValueError(f"{field}: не может быть отрицательным")
+    return number
+
+
+def _starts_at(value) -> tuple[str, datetime]:
+    """(date_str как в мастере создания, starts_at). Ячейка-дата Excel или текст, как в input_event_date."""
+    if isinstance(value, datetime):
+        if value.hour == value.minute == 0:  # Ячейка с датой без времени
+            value = value.replace(hour=DEFAULT_TIME[0], minute=DEFAULT_TIME[1])
+        starts_at = value.replace(tzinfo=EVENT_TZ) if value.tzinfo is None else value
+        return f"{starts_at:%d.%m.%Y %H:%M}", starts_at
+    if isinstance(value, date):
+        starts_at = datetime(value.year, value.month, value.day, *DEFAULT_TIME, tzinfo=EVENT_TZ)
+        return f"{starts_at:%d.%m.%Y %H:%M}", starts_at
+    date_str = _text(value)
+    starts_at = parse_event_datetime(date_str)
+    if not starts_at:
+        raise ValueError(f"date: не удалось распознать дату '{date_str[:30]}'")
+    return date_str[:50], starts_at
+
+
+def parse_catalog(data: bytes, filename: str) -> tuple[list[dict], list[str]]:
+    """
+    Один потоковый проход по файлу: проверка всех строк и группировка тарифов по мероприятиям.
+    Возвращает (мероприятия, ошибки "Строка N: ..."). Мероприятие: {'name', 'date_str', 'starts_at',
+    'location', 'description', 'products': [{'name', 'price', 'limit', 'refundable'}], 'row'}.
+    """
+    events: dict[tuple, dict] = {}
+    errors: list[str] = []
+    rows = read_rows(data, filename)
+
+    header = next(rows, None)
+    columns = {}
+    for i, title in enumerate(header or ()):
+        key = _text(title).lower()
+        key = _ALIASES.get(key, key)
+        if key in COLUMNS and key not in columns:
+            columns[key] = i
+    missing = [c for c in REQUIRED if c not in columns]
+    if missing:
+        return [], [f"Нет обязательных колонок: {', '.join(missing)}"]
+
+    count = 0
+    for line, raw in enumerate(rows, start=2):
+        row = {c: (raw[i] if i < len(raw) else None) for c, i in columns.items()}
+        if all(_text(v) == "" for v in row.values()):
+            continue  # Пустые строки (часто в конце листа)
+        count += 1
+        if count > CATALOG_IMPORT_MAX_ROWS:
+            errors.append(f"Больше {CATALOG_IMPORT_MAX_ROWS} строк - разбейте файл на части")
+            break
+        try:
+            name = _text(row['event'])
+            if not name:
+                raise ValueError("event: пустое название")
+            if len(name) > 100:
+                raise ValueError("event: название длиннее 100 символов")
+            date_str, starts_at = _starts_at(row['date'])
+            location = _text(row.get('location'))
+            if len(location) > 200:
+                raise ValueError("location: длиннее 200 символов")
+
+            product = None
+            tariff = _text(row.get('tariff'))
+            if tariff:
+                if len(tariff) > 100:
+                    raise ValueError("tariff: название длиннее 100 символов")
+                refundable = _text(row.get('refundable')).lower()
+                if refundable not in _YES | _NO:
+                    raise ValueError("refundable: ожидается да/нет")
+                product = {'name': tariff, 'price': _int(row.get('price'), 'price'),
+                           'limit': _int(row.get('limit'), 'limit', default=0), 'refundable': refundable in _YES}
+        except ValueError as e:
+            errors.append(f"Строка {line}: {e}")
+            continue
+
+        event = events.setdefault((name, date_str), {
+            'name': name, 'date_str': date_str, 'starts_at': starts_at, 'location': location or None,
+            'description': _text(row.get('description')) or None, 'products': [], 'row': line,
+        })
+        if product:
+            if any(p['name'] == product['name'] for p in event['products']):
+                errors.append(f"Строка {line}: tariff '{tariff}' уже есть у этого мероприятия")
+                continue
+            event['products'].append(product)
+
+    if not events and not errors:
+        errors.append("В файле нет строк с мероприятиями")
+    return list(events.values()), errors
+
+
+def format_errors(errors: list[str]) -> str:
+    shown = errors[:MAX_REPORTED_ERRORS]
+    more = len(errors) - len(shown)
+    return "\n".join(shown) + (f"\n... и еще {more}" if more else "")
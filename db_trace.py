@@ -0,0 +1,171 @@
+# db_trace.py
+
+import os
+import sys
+import time
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+import psycopg2.extensions
+import metrics
+
+# --- НАСТРОЙКИ ---
+# Трассировку можно включать/выключать на лету (/db_trace on|off), порог - /db_trace slow <мс>.
+TRACE_ENABLED = os.getenv("DB_TRACE", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG", "slow_queries.log")
+MAX_SQL_LEN = 300
+
+slow_logger = logging.getLogger("slow_queries")
+if SLOW_QUERY_LOG:
+    # delay=True: файл создается при первой медленной записи, а не при импорте (бот, бенчмарки, утилиты)
+    _handler = logging.FileHandler(SLOW_QUERY_LOG, mode='a', encoding='utf-8', delay=True)
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    slow_logger.addHandler(_handler)
+
+# Текущая трассируемая функция db_utils (для учета строк и SQL из курсора)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("db_trace", default=None)
+
+# Агрегаты по функциям: {name: [вызовы, суммарное время (с), строки, максимум (с)]}.
+# Обновляются из потоков asyncio.to_thread - под локом
+_stats: dict = {}
+_stats_lock = threading.Lock()
+
+_THIS_FILE = __file__
+
+
+def set_enabled(enabled: bool):
+    global TRACE_ENABLED
+    TRACE_ENABLED = enabled
+    logging.warning(f"DB tracing {'enabled' if enabled else 'disabled'}")
+
+
+def set_slow_threshold(ms: float):
+    global SLOW_QUERY_MS
+    SLOW_QUERY_MS = ms
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def top_queries(limit: int = 10) -> list[dict]:
+    """Самые "дорогие" функции по суммарному времени с момента включения трассировки."""
+    with _stats_lock:
+        snapshot = [(name, list(s)) for name, s in _stats.items()]
+    rows = [
+        {'function': name, 'calls': s[0], 'total_ms': s[1] * 1000, 'avg_ms': s[1] * 1000 / s[0],
+         'max_ms': s[3] * 1000, 'rows': s[2]}
+        for name, s in snapshot if s[0]
+    ]
+    rows.sort(key=lambda r: r['total_ms'], reverse=True)
+    return rows[:limit]
+
+
+class _Trace:
+    __slots__ = ('rows', 'statements')
+
+    def __init__(self):
+        self.rows = 0
+        self.statements = []
+
+
+class TracingCursor(psycopg2.extensions.cursor):
+    """Курсор, который (при включенной трассировке) считает строки и запоминает SQL."""
+
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace = _current_trace.get()
+            if trace is not None:
+                if self.rowcount and self.rowcount > 0:
+                    trace.rows += self.rowcount
+                trace.statements.append(query if isinstance(query, str) else str(query))
+
+    def executemany(self, query, vars_list):
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            trace = _current_trace.get()
+            if trace is not None:
+                if self.rowcount and self.rowcount > 0:
+                    trace.rows += self.rowcount
+                trace.statements.append(query if isinstance(query, str) else str(query))
+
+
+def _call_site(db_module_file: str) -> str:
+    """Первый кадр вне db_utils/db_trace: кто вызвал функцию БД."""
+    frame = sys._getframe(2)
+    while frame and frame.f_code.co_filename in (db_module_file, _THIS_FILE):
+        frame = frame.f_back
+    if not frame:
+        return "?"
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+
+
+def _compact_sql(statements: list) -> str:
+    sql = " | ".join(" ".join(s.split()) for s in statements)
+    return sql[:MAX_SQL_LEN] + ("…" if len(sql) > MAX_SQL_LEN else "")
+
+
+def traced(fn, db_module_file: str):
+    """
+    Обертка для функций db_utils.
+    Всегда: латентность/ошибки в metrics (дешево).
+    При TRACE_ENABLED: строки, место вызова, агрегаты и slow-query лог.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+
+        if not TRACE_ENABLED:
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                metrics.DB_QUERY_ERRORS.inc(function=name)
+                raise
+            finally:
+                metrics.DB_QUERY_LATENCY.observe(time.perf_counter() - started, function=name)
+
+        trace = _Trace()
+        token = _current_trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            metrics.DB_QUERY_ERRORS.inc(function=name)
+            raise
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - started
+            metrics.DB_QUERY_LATENCY.observe(elapsed, function=name)
+
+            with _stats_lock:
+                s = _stats.setdefault(name, [0, 0.0, 0, 0.0])
+                s[0] += 1
+                s[1] += elapsed
+                s[2] += trace.rows
+                s[3] = max(s[3], elapsed)
+
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                slow_logger.warning(
+                    f"SLOW {name} {elapsed * 1000:.1f}ms rows={trace.rows} "
+                    f"at {_call_site(db_module_file)} sql={_compact_sql(trace.statements)}"
+                )
+
+    return wrapper
+
+
+def instrument_module(namespace: dict, exclude: tuple = ()):
+    """Оборачивает traced все публичные функции, объявленные в модуле (globals())."""
+    module_name = namespace['__name__']
+    module_file = namespace['__file__']
+    for name, obj in list(namespace.items()):
+        if (inspect.isfunction(obj) and obj.__module__ == module_name
+                and not name.startswith('_') and name not in exclude):
+            namespace[name] = traced(obj, module_file)
@@ -2,30 +2,49 @@
 
 import os
 import logging
+import io
+import csv
 import psycopg2
-from datetime import datetime
+import psycopg2.extensions
+import psycopg2.extras
+from datetime import datetime, date
 from dotenv import load_dotenv
-import hashlib
+import metrics
+import db_trace
+import ticket_codes
+from ballot_draw import allocate, MODE_FCFS, MODE_BALLOT, MODE_BALLOT_DRAWN
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# На сколько строк делится общий пул мест мероприятия (event_capacity_shards)
+EVENT_CAPACITY_SHARDS = int(os.getenv("EVENT_CAPACITY_SHARDS", 8))
+# Сколько часов после начала мероприятие еще видно в списках (продажа на входе, билеты в "Мои билеты")
+EVENT_LISTING_GRACE_HOURS = int(os.getenv("EVENT_LISTING_GRACE_HOURS", 6))
 
 
 # --- БАЗОВЫЕ ФУНКЦИИ ---
 
+class TrackedConnection(psycopg2.extensions.connection):
+    """Соединение, которое учитывается в metrics (открытые/закрытые)."""
+
+    def close(self):
+        if not self.closed:
+            metrics.DB_CONNECTIONS.inc(event='closed')
+        super().close()
+
+
 def connect_db():
     try:
-        return psycopg2.connect(DATABASE_URL)
+        conn = psycopg2.connect(DATABASE_URL, connection_factory=TrackedConnection,
+                                cursor_factory=db_trace.TracingCursor)
+        metrics.DB_CONNECTIONS.inc(event='opened')
+        return conn
     except Exception as e:
+        metrics.DB_CONNECTIONS.inc(event='failed')
         logging.error(f"DB Connection Error: {e}")
         return None
 
 
-def hash_password(password: str) -> str:
-    """Хеширование пароля с использованием SHA256."""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
-
-
 def create_tables():
     conn = connect_db()
     if conn is None: return
@@ -38,12 +57,15 @@ def create_tables():
             username VARCHAR(100),
             first_name VARCHAR(100),
             login VARCHAR(50) UNIQUE,
-            password_hash VARCHAR(64),
+            password_hash VARCHAR(255),
             is_authenticated BOOLEAN DEFAULT FALSE,
             org_owned_count INTEGER DEFAULT 0,
             joined_at TIMESTAMP DEFAULT NOW()
         );""",
 
+        # 1.1. Хеши scrypt длиннее SHA256 (см. passwords.py)
+        """ALTER TABLE users ALTER COLUMN password_hash TYPE VARCHAR(255);""",
+
         # 2. Организации
         """CREATE TABLE IF NOT EXISTS organizations (
             id SERIAL PRIMARY KEY,
@@ -128,7 +150,200 @@ def create_tables():
             usage_limit INTEGER DEFAULT 0, 
             used_count INTEGER DEFAULT 0,
             is_active BOOLEAN DEFAULT TRUE
-        );"""
+        );""",
+
+        # 10. Виртуальная очередь (waiting room): пропускная способность, чел./мин (0 = выключена)
+        """ALTER TABLE events ADD COLUMN IF NOT EXISTS waiting_room_rate INTEGER DEFAULT 0;""",
+
+        # 11. Лотерея (ballot): режим продажи мероприятия и заявки участников
+        """ALTER TABLE events ADD COLUMN IF NOT EXISTS sale_mode VARCHAR(20) DEFAULT 'fcfs';""",  # fcfs | ballot | ballot_drawn
+        """CREATE TABLE IF NOT EXISTS ballot_entries (
+            id SERIAL PRIMARY KEY,
+            event_id INTEGER REFERENCES events(id) ON DELETE CASCADE,
+            chat_id BIGINT REFERENCES users(chat_id) ON DELETE CASCADE,
+            product_id INTEGER REFERENCES products(id) ON DELETE CASCADE,
+            alt_product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            buyer_name VARCHAR(100),
+            buyer_email VARCHAR(100),
+            status VARCHAR(10) DEFAULT 'pending', -- pending | won | lost
+            created_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE (event_id, chat_id)
+        );""",
+        """ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ballot_entry_id INTEGER REFERENCES ballot_entries(id) ON DELETE SET NULL;""",
+        """CREATE INDEX IF NOT EXISTS idx_tickets_ballot_entry ON tickets(ballot_entry_id) WHERE ballot_entry_id IS NOT NULL;""",
+
+        # 12. Общая вместимость площадки (0 = без общего лимита). Пул мест разбит на шарды,
+        # чтобы покупки разных тарифов не ждали блокировку одной строки
+        """ALTER TABLE events ADD COLUMN IF NOT EXISTS capacity INTEGER DEFAULT 0;""",
+        """CREATE TABLE IF NOT EXISTS event_capacity_shards (
+            event_id INTEGER REFERENCES events(id) ON DELETE CASCADE,
+            shard SMALLINT NOT NULL,
+            remaining INTEGER NOT NULL CHECK (remaining >= 0),
+            PRIMARY KEY (event_id, shard)
+        );""",
+
+        # 13. Заказы из нескольких билетов: билеты одного заказа связаны ссылкой оплаты (pay ref)
+        """ALTER TABLE tickets ADD COLUMN IF NOT EXISTS order_ref VARCHAR(16);""",
+        """CREATE INDEX IF NOT EXISTS idx_tickets_order_ref ON tickets(order_ref) WHERE order_ref IS NOT NULL;""",
+
+        # 14. Лист ожидания по тарифам. offered - место придержано за пользователем до offer_expires_at
+        """CREATE TABLE IF NOT EXISTS waitlist (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER REFERENCES products(id) ON DELETE CASCADE,
+            chat_id BIGINT REFERENCES users(chat_id) ON DELETE CASCADE,
+            joined_at TIMESTAMP DEFAULT NOW(),
+            status VARCHAR(10) DEFAULT 'waiting', -- waiting | offered | claimed | expired | declined
+            offer_expires_at TIMESTAMP,
+            UNIQUE (product_id, chat_id)
+        );""",
+        """CREATE INDEX IF NOT EXISTS idx_waitlist_queue ON waitlist(product_id, joined_at) WHERE status = 'waiting';""",
+        """CREATE INDEX IF NOT EXISTS idx_waitlist_offers ON waitlist(offer_expires_at) WHERE status = 'offered';""",
+
+        # 15. Возвраты (колонки из migrate_refund_system) и отмена мероприятий.
+        # refund_amount заполняется при отмене: сумма к выплате покупателю (0 - билет не был оплачен)
+        """ALTER TABLE products ADD COLUMN IF NOT EXISTS is_refundable BOOLEAN DEFAULT FALSE;""",
+        """ALTER TABLE tickets ADD COLUMN IF NOT EXISTS is_refunded BOOLEAN DEFAULT FALSE;""",
+        """ALTER TABLE tickets ADD COLUMN IF NOT EXISTS refund_amount INTEGER;""",
+        """ALTER TABLE events ADD COLUMN IF NOT EXISTS cancelled_at TIMESTAMP;""",
+        """CREATE INDEX IF NOT EXISTS idx_tickets_product ON tickets(product_id);""",
+
+        # 16. Мягкое удаление: строка скрывается сразу, зависимые данные удаляет фоновый reaper.py порциями
+        """ALTER TABLE organizations ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;""",
+        """ALTER TABLE events ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;""",
+        """CREATE INDEX IF NOT EXISTS idx_events_deleted ON events(deleted_at) WHERE deleted_at IS NOT NULL;""",
+        """CREATE INDEX IF NOT EXISTS idx_orgs_deleted ON organizations(deleted_at) WHERE deleted_at IS NOT NULL;""",
+        """CREATE INDEX IF NOT EXISTS idx_products_event ON products(event_id);""",
+
+        # 17. Секционирование tickets по месяцу покупки (RANGE по purchase_date). Обычная таблица переносится
+        # один раз; ключ секционирования входит в PK. Будущие секции создает и старые архивирует partitions.py
+        # PK (ticket_id, purchase_date) не гарантирует уникальность ticket_id - ее держит ticket_registry (миграция 24)
+        """CREATE SCHEMA IF NOT EXISTS tickets_archive;""",
+        """DO $$
+        DECLARE
+            m DATE;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                       WHERE c.relname = 'tickets' AND n.nspname = current_schema() AND c.relkind = 'r') THEN
+                ALTER TABLE tickets RENAME TO tickets_unpartitioned;
+                UPDATE tickets_unpartitioned SET purchase_date = NOW() WHERE purchase_date IS NULL;
+
+                CREATE TABLE tickets (LIKE tickets_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (purchase_date);
+                CREATE TABLE tickets_default PARTITION OF tickets DEFAULT;
+                FOR m IN
+                    SELECT g::date FROM generate_series(
+                        (SELECT date_trunc('month', COALESCE(MIN(purchase_date), NOW())) FROM tickets_unpartitioned),
+                        date_trunc('month', NOW()) + INTERVAL '3 months', INTERVAL '1 month') AS g
+                LOOP
+                    EXECUTE format('CREATE TABLE %I PARTITION OF tickets FOR VALUES FROM (%L) TO (%L)',
+                                   'tickets_' || to_char(m, 'YYYY_MM'), m, m + INTERVAL '1 month');
+                END LOOP;
+
+                INSERT INTO tickets SELECT * FROM tickets_unpartitioned;
+                DROP TABLE tickets_unpartitioned;
+
+                ALTER TABLE tickets ADD PRIMARY KEY (ticket_id, purchase_date);
+                ALTER TABLE tickets ADD FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE;
+                ALTER TABLE tickets ADD FOREIGN KEY (buyer_chat_id) REFERENCES users(chat_id) ON DELETE CASCADE;
+                ALTER TABLE tickets ADD FOREIGN KEY (ballot_entry_id) REFERENCES ballot_entries(id) ON DELETE SET NULL;
+                CREATE INDEX idx_tickets_ballot_entry ON tickets(ballot_entry_id) WHERE ballot_entry_id IS NOT NULL;
+                CREATE INDEX idx_tickets_order_ref ON tickets(order_ref) WHERE order_ref IS NOT NULL;
+                CREATE INDEX idx_tickets_product ON tickets(product_id);
+            END IF;
+        END $$;""",
+        """CREATE INDEX IF NOT EXISTS idx_tickets_buyer ON tickets(buyer_chat_id);""",
+
+        # 18. Дата начала мероприятия (разобранная из date_str, см. event_dates.py) для сортировки
+        # и скрытия прошедших мероприятий; частичный индекс под публичные списки
+        """ALTER TABLE events ADD COLUMN IF NOT EXISTS starts_at TIMESTAMPTZ;""",
+        """CREATE INDEX IF NOT EXISTS idx_events_org_upcoming ON events(org_id, starts_at) WHERE is_active = TRUE;""",
+
+        # 19. Напоминания о мероприятии: одно напоминание пользователю на (мероприятие, смещение), сколько бы билетов ни было
+        """CREATE TABLE IF NOT EXISTS event_reminders_sent (
+            event_id INTEGER REFERENCES events(id) ON DELETE CASCADE,
+            offset_hours INTEGER NOT NULL,
+            chat_id BIGINT NOT NULL,
+            sent_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (event_id, offset_hours, chat_id)
+        );""",
+        """CREATE INDEX IF NOT EXISTS idx_events_starts ON events(starts_at) WHERE is_active = TRUE;""",
+
+        # 20. Постраничные списки (keyset, см. paginator.py): индексы точно под ключ сортировки каждого списка.
+        # Публичный список мероприятий: (без даты в конце, дата, id) - заменяет idx_events_org_upcoming
+        """CREATE INDEX IF NOT EXISTS idx_events_org_listing
+           ON events(org_id, ((starts_at IS NULL)::int), (COALESCE(starts_at, 'epoch'::timestamptz)), id)
+           WHERE is_active = TRUE;""",
+        """DROP INDEX IF EXISTS idx_events_org_upcoming;""",
+        """CREATE INDEX IF NOT EXISTS idx_events_org_id ON events(org_id, id) WHERE deleted_at IS NULL;""",
+        """CREATE INDEX IF NOT EXISTS idx_products_event_id ON products(event_id, id);""",
+        """CREATE INDEX IF NOT EXISTS idx_org_admins_org ON org_admins(org_id, user_id);""",
+
+        # 21. Поиск мероприятий покупателем (event_search.py): триграммные GIN-индексы под оператор <%
+        """CREATE EXTENSION IF NOT EXISTS pg_trgm;""",
+        """CREATE INDEX IF NOT EXISTS idx_events_name_trgm ON events USING gin (name gin_trgm_ops) WHERE is_active = TRUE;""",
+        """CREATE INDEX IF NOT EXISTS idx_events_location_trgm ON events USING gin (location gin_trgm_ops)
+           WHERE is_active = TRUE;""",
+        """CREATE INDEX IF NOT EXISTS idx_orgs_name_trgm ON organizations USING gin (name gin_trgm_ops)
+           WHERE deleted_at IS NULL;""",
+
+        # 22. Партии промокодов (promo_codes.py): генерация тысячами через COPY, статистика по партии.
+        # id - суррогатный ключ для постраничного списка (code - строка произвольной длины)
+        """CREATE TABLE IF NOT EXISTS promo_batches (
+            id SERIAL PRIMARY KEY,
+            event_id INTEGER REFERENCES events(id) ON DELETE CASCADE,
+            label VARCHAR(20) NOT NULL,
+            discount_percent INTEGER NOT NULL,
+            usage_limit INTEGER DEFAULT 1,
+            created_by BIGINT,
+            created_at TIMESTAMP DEFAULT NOW()
+        );""",
+        """ALTER TABLE promocodes ADD COLUMN IF NOT EXISTS batch_id INTEGER REFERENCES promo_batches(id) ON DELETE CASCADE;""",
+        """ALTER TABLE promocodes ADD COLUMN IF NOT EXISTS id BIGSERIAL;""",
+        """CREATE INDEX IF NOT EXISTS idx_promocodes_batch ON promocodes(batch_id) INCLUDE (used_count) WHERE batch_id IS NOT NULL;""",
+        """CREATE INDEX IF NOT EXISTS idx_promocodes_manual ON promocodes(event_id, id) WHERE batch_id IS NULL;""",
+        """CREATE INDEX IF NOT EXISTS idx_promo_batches_event ON promo_batches(event_id, id);""",
+
+        # 23. ID билетов и номера заказов из последовательностей (ticket_codes.py): 40 бит на ID
+        """CREATE SEQUENCE IF NOT EXISTS ticket_id_seq MAXVALUE 1099511627775;""",
+        """CREATE SEQUENCE IF NOT EXISTS order_ref_seq MAXVALUE 1099511627775;""",
+
+        # 24. Реестр ID билетов. После секционирования (миграция 17) PK tickets - (ticket_id, purchase_date),
+        # и уникальность самого ticket_id в таблице не проверяется. ticket_registry (ticket_id PK) заполняется
+        # триггером в той же транзакции, что и INSERT билета: повторный ID падает на вставке, как до секционирования.
+        # purchase_date из реестра дает отсечение секций в запросах по ticket_id (см. _TICKET_PARTITION).
+        """CREATE TABLE IF NOT EXISTS ticket_registry (
+            ticket_id VARCHAR(50) PRIMARY KEY,
+            purchase_date TIMESTAMP NOT NULL
+        );""",
+        """CREATE OR REPLACE FUNCTION register_ticket_id() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO ticket_registry (ticket_id, purchase_date) VALUES (NEW.ticket_id, NEW.purchase_date);
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql;""",
+        """DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_ticket_registry') THEN
+                CREATE TRIGGER trg_ticket_registry AFTER INSERT ON tickets
+                    FOR EACH ROW EXECUTE FUNCTION register_ticket_id();
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM ticket_registry) THEN
+                INSERT INTO ticket_registry (ticket_id, purchase_date)
+                SELECT ticket_id, purchase_date FROM tickets ON CONFLICT (ticket_id) DO NOTHING;
+            END IF;
+        END $$;""",
+        # 25. Отмена мероприятия: отметка, что покупатель уже уведомлен и попал в список выплат.
+        # Повторный запуск прерванной отмены уведомляет только остальных. Отмены, прошедшие до миграции,
+        # считаются уведомленными (один раз, при добавлении колонки)
+        """DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_name = 'tickets' AND column_name = 'refund_notified_at') THEN
+                ALTER TABLE tickets ADD COLUMN refund_notified_at TIMESTAMPTZ;
+                UPDATE tickets t SET refund_notified_at = e.cancelled_at
+                FROM products p JOIN events e ON e.id = p.event_id
+                WHERE p.id = t.product_id AND t.refund_amount IS NOT NULL AND e.cancelled_at IS NOT NULL;
+            END IF;
+        END $$;""",
     ]
 
     try:
@@ -268,37 +483,37 @@ def register_user_db(chat_id: int, login: str, password_hash: str):
         conn.close()
 
 
-def authenticate_user_db(chat_id: int):
+def complete_login(chat_id: int, login: str, old_hash: str, new_hash: str | None = None) -> bool:
+    """
+    Завершает вход одним запросом: ставит is_authenticated текущему чату
+    и (если передан new_hash) сохраняет пересчитанный хеш пароля.
+    Хеш обновляется только если он не менялся с момента проверки (old_hash).
+    """
     conn = connect_db()
-    if not conn: return
+    if not conn: return False
     cursor = conn.cursor()
-    cursor.execute("UPDATE users SET is_authenticated = TRUE WHERE chat_id = %s", (chat_id,))
-    conn.commit()
-    conn.close()
+    try:
+        cursor.execute("""
+            UPDATE users SET
+                is_authenticated = CASE WHEN chat_id = %(chat_id)s THEN TRUE ELSE is_authenticated END,
+                password_hash = CASE
+                    WHEN login = %(login)s AND password_hash = %(old_hash)s AND %(new_hash)s IS NOT NULL
+                    THEN %(new_hash)s ELSE password_hash END
+            WHERE chat_id = %(chat_id)s OR login = %(login)s
+        """, {'chat_id': chat_id, 'login': login.lower(), 'old_hash': old_hash, 'new_hash': new_hash})
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Complete login error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
 
 
 # --- ORG & EVENT LOGIC ---
 
-def get_active_orgs():
-    conn = connect_db()
-    if not conn: return []
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM organizations ORDER BY id ASC;")
-    rows = cursor.fetchall()
-    conn.close()
-    return [{'id': r[0], 'name': r[1]} for r in rows]
-
-
-def get_org_events_public(org_id: int):
-    conn = connect_db()
-    if not conn: return []
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, date_str FROM events WHERE org_id = %s AND is_active = TRUE", (org_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [{'id': r[0], 'name': r[1], 'date': r[2]} for r in rows]
-
-
 def get_event_products(event_id: int):
     conn = connect_db()
     if not conn: return []
@@ -330,46 +545,132 @@ def get_product_info(product_id: int):
 
 
 def check_product_availability(product_id: int) -> tuple[bool, int]:
-    """Возвращает (доступно_ли, остаток). Если лимит 0, возвращает (True, -1)."""
+    """Возвращает (доступно_ли, остаток) с учетом лимита тарифа и общей вместимости. Безлимит - (True, 9999)."""
     conn = connect_db()
     if not conn: return (False, 0)
     cursor = conn.cursor()
-    cursor.execute("SELECT quantity_limit, quantity_sold FROM products WHERE id = %s", (product_id,))
+    cursor.execute("""
+        SELECT p.quantity_limit, p.quantity_sold, e.capacity,
+               (SELECT COALESCE(SUM(s.remaining), 0) FROM event_capacity_shards s WHERE s.event_id = p.event_id)
+        FROM products p JOIN events e ON e.id = p.event_id
+        WHERE p.id = %s
+    """, (product_id,))
     row = cursor.fetchone()
     conn.close()
 
     if not row: return (False, 0)
 
-    limit, sold = row[0], row[1]
-    if limit == 0: return (True, 9999)  # Безлимит
-
-    remaining = limit - sold
+    limit, sold, capacity, pool_left = row
+    remaining = limit - sold if limit > 0 else 9999  # 0 = безлимит
+    if capacity:
+        remaining = min(remaining, pool_left)
     return (remaining > 0, remaining)
 
 
+def _take_from_shard(cursor, event_id: int, amount: int, skip_locked: bool) -> bool:
+    """Списывает (amount > 0) или возвращает (amount < 0) места в одном случайном шарде пула мероприятия."""
+    # Сначала блокируем ровно один шард, потом меняем его отдельным UPDATE.
+    # В виде UPDATE ... FROM (подзапрос FOR UPDATE) перепроверка строки после ожидания
+    # заново выполняла подзапрос с random() и блокировала второй шард -> взаимные блокировки
+    cursor.execute(f"""
+        SELECT shard FROM event_capacity_shards
+        WHERE event_id = %s AND remaining >= %s
+        ORDER BY random() LIMIT 1
+        FOR UPDATE {'SKIP LOCKED' if skip_locked else ''}
+    """, (event_id, max(amount, 0)))
+    row = cursor.fetchone()
+    if not row:
+        return False
+    cursor.execute("UPDATE event_capacity_shards SET remaining = remaining - %s WHERE event_id = %s AND shard = %s",
+                   (amount, event_id, row[0]))
+    return True
+
+
+def _take_from_shards(cursor, event_id: int, amount: int) -> bool:
+    """
+    Несколько мест сразу (заказ), когда ни в одном свободном шарде их не хватает: блокирует все
+    непустые шарды в порядке номеров (два заказа не ждут друг друга по кругу) и списывает по очереди.
+    """
+    cursor.execute("""
+        SELECT shard, remaining FROM event_capacity_shards
+        WHERE event_id = %s AND remaining > 0
+        ORDER BY shard
+        FOR UPDATE
+    """, (event_id,))
+    taken = []
+    for shard, remaining in cursor.fetchall():
+        if amount == 0:
+            break
+        n = min(remaining, amount)
+        taken.append((n, event_id, shard))
+        amount -= n
+    if amount:
+        return False  # Во всем пуле меньше мест, чем в заказе
+    cursor.executemany("UPDATE event_capacity_shards SET remaining = remaining - %s WHERE event_id = %s AND shard = %s",
+                       taken)
+    return True
+
+
+def _take_event_capacity(cursor, event_id: int, amount: int = 1) -> bool:
+    """
+    Общий лимит площадки: списывает amount мест из пула мероприятия (шарды event_capacity_shards).
+    Покупки разных тарифов берут разные шарды и не ждут друг друга; SKIP LOCKED
+    пропускает занятые шарды. True - места есть (или общего лимита нет).
+    Вызывать после блокировки тарифов: пока ждем шард, других блокировок транзакция не берет.
+    """
+    if _take_from_shard(cursor, event_id, amount, skip_locked=True):
+        return True
+
+    cursor.execute("SELECT capacity FROM events WHERE id = %s", (event_id,))
+    row = cursor.fetchone()
+    if not row or not row[0]:
+        return True  # Общий лимит не задан
+    if amount > 1:
+        return _take_from_shards(cursor, event_id, amount)
+
+    # Все шарды с остатком заняты или пусты: ждем блокировку, пока в пуле что-то есть.
+    # Без фиксированного числа попыток: "мест нет" только когда пул действительно пуст
+    while True:
+        if _take_from_shard(cursor, event_id, 1, skip_locked=False):
+            return True
+        cursor.execute("SELECT COALESCE(SUM(remaining), 0) FROM event_capacity_shards WHERE event_id = %s",
+                       (event_id,))
+        if cursor.fetchone()[0] == 0:
+            return False
+
+
+def _return_event_capacity(cursor, event_id: int, amount: int = 1):
+    """Возвращает места в пул мероприятия (возврат билета). Без общего лимита - ничего не делает."""
+    if not _take_from_shard(cursor, event_id, -amount, skip_locked=True):
+        _take_from_shard(cursor, event_id, -amount, skip_locked=False)
+
+
 def create_ticket_record(ticket_id, product_id, chat_id, name, email, price):
     """Создает билет и увеличивает счетчик продаж."""
     conn = connect_db()
     if not conn: return False
     cursor = conn.cursor()
     try:
-        # Проверка доступности еще раз внутри транзакции (для надежности)
-        cursor.execute("SELECT quantity_limit, quantity_sold FROM products WHERE id = %s FOR UPDATE", (product_id,))
+        # 1. Лимит тарифа: условный инкремент (блокируется только строка этого тарифа)
+        cursor.execute("""
+            UPDATE products SET quantity_sold = quantity_sold + 1
+            WHERE id = %s AND (quantity_limit = 0 OR quantity_sold < quantity_limit)
+              AND NOT EXISTS (SELECT 1 FROM events e WHERE e.id = products.event_id
+                              AND (e.cancelled_at IS NOT NULL OR e.deleted_at IS NOT NULL))
+            RETURNING event_id
+        """, (product_id,))
         row = cursor.fetchone()
-        if not row: return False
-        limit, sold = row[0], row[1]
+        if not row: return False  # Закончились (соединение закрывается без commit - откат)
 
-        if limit > 0 and sold >= limit:
-            return False  # Закончились
+        # 2. Общий лимит площадки (шардированный пул мероприятия)
+        if not _take_event_capacity(cursor, row[0]):
+            return False
 
         cursor.execute("""
             INSERT INTO tickets (ticket_id, product_id, buyer_chat_id, buyer_name, buyer_email, final_price, is_active)
             VALUES (%s, %s, %s, %s, %s, %s, FALSE)
         """, (ticket_id, product_id, chat_id, name, email, price))
 
-        # Инкремент
-        cursor.execute("UPDATE products SET quantity_sold = quantity_sold + 1 WHERE id = %s", (product_id,))
-
         conn.commit()
         return True
     except Exception as e:
@@ -380,6 +681,85 @@ def create_ticket_record(ticket_id, product_id, chat_id, name, email, price):
         conn.close()
 
 
+def create_order_tickets(order_ref: str, items: list[tuple[int, int, int]], chat_id: int, name: str,
+                         email: str, waitlist_id: int | None = None, promo_code: str | None = None) -> list[str] | None:
+    """
+    Заказ из нескольких билетов одной транзакцией: резервирует места по всем тарифам
+    (лимиты тарифов + общий пул площадки) и вставляет все билеты одним multi-row INSERT.
+    items: [(product_id, количество, цена за билет)]. Возвращает ID билетов или None (мест не хватило
+    или промокод уже исчерпан).
+    waitlist_id: предложение из листа ожидания - его место уже придержано и не списывается повторно.
+    promo_code: примененный промокод - использование списывается в этой же транзакции.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        if promo_code:
+            # Условный инкремент: одноразовый код (usage_limit=1) проходит ровно в одном заказе
+            cursor.execute("""
+                UPDATE promocodes SET used_count = used_count + 1
+                WHERE code = %s AND (usage_limit = 0 OR used_count < usage_limit)
+                  AND event_id = (SELECT event_id FROM products WHERE id = %s)
+                RETURNING 1
+            """, (promo_code, items[0][0]))
+            if not cursor.fetchone(): return None  # Соединение закрывается без commit - откат
+
+        held_product = None
+        if waitlist_id:
+            cursor.execute("""
+                UPDATE waitlist SET status = 'claimed'
+                WHERE id = %s AND chat_id = %s AND status = 'offered' AND offer_expires_at > NOW()
+                  AND product_id = ANY(%s)
+                RETURNING product_id
+            """, (waitlist_id, chat_id, [i[0] for i in items]))
+            row = cursor.fetchone()
+            held_product = row[0] if row else None  # Предложение истекло - покупаем на общих основаниях
+
+        rows = []
+        seats = {}  # event_id -> сколько мест взять из общего пула
+        # Сначала все тарифы в порядке id, потом пул одним шагом: пока ждем шард, не держим
+        # его и не ждем следующий тариф - параллельные заказы с общими тарифами не зациклятся
+        for product_id, qty, price in sorted(items):
+            held = 1 if product_id == held_product else 0
+            rows.extend((product_id, chat_id, name, email, price, order_ref) for _ in range(held))
+            qty -= held
+            if not qty:
+                continue
+
+            cursor.execute("""
+                UPDATE products SET quantity_sold = quantity_sold + %s
+                WHERE id = %s AND (quantity_limit = 0 OR quantity_sold + %s <= quantity_limit)
+                  AND NOT EXISTS (SELECT 1 FROM events e WHERE e.id = products.event_id
+                                  AND (e.cancelled_at IS NOT NULL OR e.deleted_at IS NOT NULL))
+                RETURNING event_id
+            """, (qty, product_id, qty))
+            row = cursor.fetchone()
+            if not row: return None  # Тариф закончился (соединение закрывается без commit - откат)
+
+            seats[row[0]] = seats.get(row[0], 0) + qty
+            rows.extend((product_id, chat_id, name, email, price, order_ref) for _ in range(qty))
+
+        for event_id, qty in seats.items():
+            if not _take_event_capacity(cursor, event_id, qty):
+                return None
+
+        ticket_ids = _next_ticket_ids(cursor, len(rows))
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO tickets (ticket_id, product_id, buyer_chat_id, buyer_name, buyer_email, final_price, order_ref)
+            VALUES %s
+        """, [(tid, *row) for tid, row in zip(ticket_ids, rows)])
+
+        conn.commit()
+        return ticket_ids
+    except Exception as e:
+        logging.error(f"Create order error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+
 # --- ADMIN/ORG UTILS ---
 def create_organization(name: str, owner_id: int):
     conn = connect_db()
@@ -458,11 +838,15 @@ def create_product(event_id: int, name: str, price: int, quantity_limit: int, is
 
 
 def delete_event(event_id: int) -> bool:
+    """Мягкое удаление: мероприятие сразу скрывается и снимается с продажи, данные порциями удаляет reaper.py."""
     conn = connect_db()
     if not conn: return False
     cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM events WHERE id = %s", (event_id,))
+        cursor.execute("""
+            UPDATE events SET deleted_at = COALESCE(deleted_at, NOW()), is_active = FALSE, waiting_room_rate = 0
+            WHERE id = %s
+        """, (event_id,))
         conn.commit()
         return True
     except Exception as e:
@@ -526,10 +910,29 @@ def is_blacklisted(org_id: int, user_id: int) -> bool:
     return res is not None
 
 
+# Отсечение секций tickets в запросах по одному ticket_id: дата покупки из реестра (миграция 24).
+# Подзапрос вычисляется один раз до сканирования, лишние секции отбрасываются при выполнении.
+_TICKET_PARTITION = "purchase_date = (SELECT r.purchase_date FROM ticket_registry r WHERE r.ticket_id = %s)"
+
+
 def activate_ticket_db(ticket_id: str):
     conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tickets SET is_active = TRUE WHERE ticket_id = %s", (ticket_id,))
+    cursor.execute(f"UPDATE tickets SET is_active = TRUE WHERE ticket_id = %s AND {_TICKET_PARTITION} AND is_refunded = FALSE",
+                   (ticket_id, ticket_id))
+    conn.commit()
+    conn.close()
+
+
+def activate_tickets_db(ticket_ids: list[str]):
+    """Активирует все билеты заказа одним запросом."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE tickets SET is_active = TRUE
+        WHERE ticket_id = ANY(%s) AND is_refunded = FALSE
+          AND purchase_date = ANY(ARRAY(SELECT r.purchase_date FROM ticket_registry r WHERE r.ticket_id = ANY(%s)))
+    """, (list(ticket_ids), list(ticket_ids)))
     conn.commit()
     conn.close()
 
@@ -538,14 +941,14 @@ def get_ticket_details(ticket_id: str):
     conn = connect_db()
     if not conn: return None
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT t.ticket_id, t.buyer_name, t.final_price, t.is_active, t.is_used, 
                p.name as product_name, e.name as event_name, e.org_id
         FROM tickets t
         JOIN products p ON t.product_id = p.id
         JOIN events e ON p.event_id = e.id
-        WHERE t.ticket_id = %s
-    """, (ticket_id,))
+        WHERE t.ticket_id = %s AND t.{_TICKET_PARTITION} AND e.deleted_at IS NULL
+    """, (ticket_id, ticket_id))
     row = cursor.fetchone()
     conn.close()
     if row:
@@ -560,7 +963,7 @@ def get_ticket_details(ticket_id: str):
 def mark_ticket_used(ticket_id: str):
     conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tickets SET is_used = TRUE WHERE ticket_id = %s", (ticket_id,))
+    cursor.execute(f"UPDATE tickets SET is_used = TRUE WHERE ticket_id = %s AND {_TICKET_PARTITION}", (ticket_id, ticket_id))
     conn.commit()
     conn.close()
 
@@ -582,15 +985,6 @@ def add_to_global_blacklist(user_id: int, reason: str, admin_id: int):
         conn.close()
 
 
-def get_global_blacklist():
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, reason FROM global_blacklist")
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-
 def get_all_user_ids():
     conn = connect_db()
     cursor = conn.cursor()
@@ -608,42 +1002,14 @@ def get_org_buyer_ids(org_id: int):
         FROM tickets t
         JOIN products p ON t.product_id = p.id
         JOIN events e ON p.event_id = e.id
-        WHERE e.org_id = %s AND t.is_active = TRUE
+        WHERE e.org_id = %s AND t.is_active = TRUE AND e.deleted_at IS NULL
     """, (org_id,))
     rows = cursor.fetchall()
     conn.close()
     return [r[0] for r in rows]
 
-def increment_promo_usage(code):
-    """Увеличивает счетчик использования промокода."""
-    conn = connect_db()
-    if not conn: return
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE promocodes SET used_count = used_count + 1 WHERE code = %s", (code,))
-        conn.commit()
-    except Exception as e:
-        logging.error(f"Promo usage increment error: {e}")
-    finally:
-        cursor.close()
-        conn.close()
-
-
 # --- db_utils.py (ДОБАВИТЬ В КОНЕЦ) ---
 
-def get_event_promos(event_id: int):
-    conn = connect_db()
-    if not conn: return []
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT code, discount_percent, usage_limit, used_count 
-        FROM promocodes 
-        WHERE event_id = %s
-    """, (event_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [{'code': r[0], 'discount': r[1], 'limit': r[2], 'used': r[3]} for r in rows]
-
 def create_promo_db(code: str, event_id: int, discount: int, limit: int):
     conn = connect_db()
     if not conn: return False
@@ -715,6 +1081,24 @@ def find_promo(code: str, event_id: int):
         return {'code': row[0], 'discount': row[1]}
     return None
 
+
+def release_promo_usage(code: str) -> bool:
+    """Возвращает использование промокода (оплата заказа отклонена): списывается при создании заказа."""
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE promocodes SET used_count = GREATEST(used_count - 1, 0) WHERE code = %s",
+                       (code.upper(),))
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Release promo usage error: {e}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
 # db_utils.py (ДОБАВИТЬ В КОНЕЦ ФАЙЛА или к функциям администрирования)
 
 # db_utils.py (фрагмент функции delete_organization_db)
@@ -723,13 +1107,18 @@ def delete_organization_db(org_id: int) -> bool:
     conn = connect_db()
     cursor = conn.cursor()
     try:
-        # 1. Получаем ID владельца, чтобы сбросить его счетчик
-        cursor.execute("SELECT owner_id FROM organizations WHERE id = %s", (org_id,))
+        # 1. Помечаем организацию удаленной и получаем ID владельца, чтобы сбросить его счетчик
+        cursor.execute("""
+            UPDATE organizations SET deleted_at = NOW() WHERE id = %s AND deleted_at IS NULL RETURNING owner_id
+        """, (org_id,))
         owner_id_row = cursor.fetchone()
         owner_id = owner_id_row[0] if owner_id_row else None
 
-        # 2. Удаляем организацию, которая должна каскадно удалить всё связанное (события, продукты, билеты и т.д.)
-        cursor.execute("DELETE FROM organizations WHERE id = %s", (org_id,))
+        # 2. Скрываем все ее мероприятия. Сами строки (события, продукты, билеты и т.д.) порциями удалит reaper.py
+        cursor.execute("""
+            UPDATE events SET deleted_at = COALESCE(deleted_at, NOW()), is_active = FALSE, waiting_room_rate = 0
+            WHERE org_id = %s
+        """, (org_id,))
 
         # 3. ЕСЛИ ВЛАДЕЛЕЦ НАЙДЕН, УМЕНЬШАЕМ ЕГО СЧЕТЧИК
         if owner_id:
@@ -832,7 +1221,10 @@ def get_user_tickets(chat_id: int):
           AND t.is_active = TRUE 
           AND t.is_used = FALSE
           AND t.is_refunded = FALSE
-    """, (chat_id,))
+          AND e.deleted_at IS NULL
+          AND (e.starts_at IS NULL OR e.starts_at > NOW() - make_interval(hours => %s))
+        ORDER BY e.starts_at NULLS LAST
+    """, (chat_id, EVENT_LISTING_GRACE_HOURS))
     rows = cursor.fetchall()
     conn.close()
     return [{'id': r[0], 'event': r[1], 'prod': r[2], 'price': r[3], 'date': r[4], 'refundable': r[5]} for r in rows]
@@ -847,13 +1239,13 @@ def process_refund_ticket(ticket_id: str) -> tuple[bool, str, int, int]:
     cursor = conn.cursor()
     try:
         # 1. Получаем данные и блокируем строку
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT t.product_id, t.buyer_chat_id, t.final_price, p.is_refundable, e.org_id
             FROM tickets t
             JOIN products p ON t.product_id = p.id
             JOIN events e ON p.event_id = e.id
-            WHERE t.ticket_id = %s FOR UPDATE
-        """, (ticket_id,))
+            WHERE t.ticket_id = %s AND t.{_TICKET_PARTITION} FOR UPDATE
+        """, (ticket_id, ticket_id))
         row = cursor.fetchone()
 
         if not row: return False, "Билет не найден", 0, 0
@@ -864,18 +1256,20 @@ def process_refund_ticket(ticket_id: str) -> tuple[bool, str, int, int]:
             return False, "Этот билет невозвратный.", 0, 0
 
         # 2. Аннулируем билет
-        cursor.execute("""
+        cursor.execute(f"""
             UPDATE tickets 
             SET is_active = FALSE, is_refunded = TRUE 
-            WHERE ticket_id = %s
-        """, (ticket_id,))
+            WHERE ticket_id = %s AND {_TICKET_PARTITION}
+        """, (ticket_id, ticket_id))
 
-        # 3. Возвращаем "место" в продажу (уменьшаем счетчик проданного)
+        # 3. Возвращаем "место" в продажу (уменьшаем счетчик проданного и общий пул площадки)
         cursor.execute("""
             UPDATE products 
             SET quantity_sold = quantity_sold - 1 
             WHERE id = %s
+            RETURNING event_id
         """, (prod_id,))
+        _return_event_capacity(cursor, cursor.fetchone()[0])
 
         # 4. Получаем ID владельца организации для уведомления
         cursor.execute("SELECT owner_id FROM organizations WHERE id = %s", (org_id,))
@@ -949,59 +1343,6 @@ def get_user_org_count(chat_id: int) -> int:
         conn.close()
 
 
-
-# db_utils.py
-
-# ... (существующие импорты и функции) ...
-
-def get_org_admins_list(org_id: int) -> list[dict]:
-    """
-    Получает список всех администраторов организации, включая владельца.
-    Возвращает список словарей: [{'chat_id': 123, 'username': 'user1', 'role': 'org_owner'}, ...]
-    """
-    conn = connect_db()
-    if not conn: return []
-    cursor = conn.cursor()
-    admins_list = []
-    
-    try:
-        # Получаем данные о владельце и администраторах из связанных таблиц
-        # (Предполагается, что владелец также присутствует в org_admins с ролью 'org_owner')
-        cursor.execute("""
-            SELECT 
-                oa.chat_id, 
-                u.username, 
-                oa.role,
-                CASE 
-                    WHEN o.owner_id = oa.chat_id THEN 1 
-                    ELSE 0 
-                END AS is_owner
-            FROM org_admins oa
-            JOIN users u ON oa.chat_id = u.chat_id
-            JOIN organizations o ON oa.org_id = o.id
-            WHERE oa.org_id = %s
-            ORDER BY is_owner DESC, u.username ASC
-        """, (org_id,))
-
-        rows = cursor.fetchall()
-        
-        for chat_id, username, role, is_owner in rows:
-            admins_list.append({
-                'chat_id': chat_id,
-                # Используем username, если есть, иначе отображаем ID
-                'username': username if username else f"ID:{chat_id}",
-                'role': role
-            })
-            
-        return admins_list
-        
-    except Exception as e:
-        logging.error(f"❌ Ошибка при получении списка админов организации: {e}")
-        return []
-    finally:
-        conn.close()
-
-
 # db_utils.py
 
 # ... (существующие функции) ...
@@ -1045,3 +1386,1410 @@ def transfer_org_ownership(org_id: int, new_owner_chat_id: int, old_owner_chat_i
     finally:
         conn.close()
 
+
+# --- WAITING ROOM ---
+
+def get_waiting_room_rates() -> dict[int, int]:
+    """Мероприятия с включенной очередью: {event_id: чел./мин}. Один запрос на тик waiting_room."""
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, waiting_room_rate FROM events WHERE is_active = TRUE AND waiting_room_rate > 0")
+        return {r[0]: r[1] for r in cursor.fetchall()}
+    except Exception as e:
+        logging.error(f"Get waiting room rates error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def set_event_waiting_room_rate(event_id: int, rate: int) -> bool:
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE events SET waiting_room_rate = %s WHERE id = %s", (rate, event_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Set waiting room rate error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ЛОТЕРЕЯ (BALLOT) ---
+
+def get_event_sale_mode(event_id: int) -> str:
+    conn = connect_db()
+    if not conn: return MODE_FCFS
+    cursor = conn.cursor()
+    cursor.execute("SELECT sale_mode FROM events WHERE id = %s", (event_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row and row[0] else MODE_FCFS
+
+
+def set_event_sale_mode(event_id: int, mode: str) -> bool:
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE events SET sale_mode = %s WHERE id = %s", (mode, event_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Set sale mode error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def add_ballot_entry(event_id: int, chat_id: int, product_id: int, alt_product_id: int | None, quantity: int,
+                     name: str, email: str) -> bool:
+    """Заявка в лотерею (повторная подача заменяет заявку). Только пока идет прием заявок."""
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO ballot_entries (event_id, chat_id, product_id, alt_product_id, quantity, buyer_name, buyer_email)
+            SELECT %s, %s, %s, %s, %s, %s, %s
+            WHERE EXISTS (SELECT 1 FROM events WHERE id = %s AND sale_mode = %s)
+            ON CONFLICT (event_id, chat_id) DO UPDATE SET
+                product_id = EXCLUDED.product_id,
+                alt_product_id = EXCLUDED.alt_product_id,
+                quantity = EXCLUDED.quantity,
+                buyer_name = EXCLUDED.buyer_name,
+                buyer_email = EXCLUDED.buyer_email
+            WHERE ballot_entries.status = 'pending'
+        """, (event_id, chat_id, product_id, alt_product_id, quantity, name, email, event_id, MODE_BALLOT))
+        conn.commit()
+        return cursor.rowcount == 1
+    except Exception as e:
+        logging.error(f"Add ballot entry error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_ballot_stats(event_id: int) -> dict:
+    conn = connect_db()
+    if not conn: return {'entries': 0, 'requested': 0, 'won': 0, 'lost': 0}
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COUNT(*), COALESCE(SUM(quantity), 0),
+               COUNT(*) FILTER (WHERE status = 'won'), COUNT(*) FILTER (WHERE status = 'lost')
+        FROM ballot_entries WHERE event_id = %s
+    """, (event_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return {'entries': row[0], 'requested': row[1], 'won': row[2], 'lost': row[3]}
+
+
+def run_ballot_draw(event_id: int) -> list[dict] | None:
+    """
+    Розыгрыш одной транзакцией: блокируем тарифы мероприятия, распределяем билеты (ballot_draw.allocate),
+    вставляем все билеты победителей пачкой и обновляем счетчики/статусы set-based запросами.
+    Возвращает результаты для рассылки или None (ошибка / прием заявок не идет).
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT e.sale_mode, e.name, o.bank_card FROM events e
+            JOIN organizations o ON o.id = e.org_id
+            WHERE e.id = %s FOR UPDATE OF e
+        """, (event_id,))
+        row = cursor.fetchone()
+        if not row or row[0] != MODE_BALLOT:
+            return None
+        event_name, card = row[1], row[2]
+
+        cursor.execute("""
+            SELECT id, name, price, quantity_limit, quantity_sold FROM products
+            WHERE event_id = %s FOR UPDATE
+        """, (event_id,))
+        rows = cursor.fetchall()
+        products = {r[0]: {'name': r[1], 'price': r[2]} for r in rows}
+        # Остаток по тарифу; None - безлимит (quantity_limit = 0)
+        remaining = {r[0]: (max(0, r[3] - r[4]) if r[3] > 0 else None) for r in rows}
+
+        cursor.execute("""
+            SELECT id, chat_id, product_id, alt_product_id, quantity, buyer_name, buyer_email
+            FROM ballot_entries WHERE event_id = %s AND status = 'pending'
+        """, (event_id,))
+        entries = [{'id': r[0], 'chat_id': r[1], 'product_id': r[2], 'alt_product_id': r[3], 'quantity': r[4],
+                    'name': r[5], 'email': r[6]} for r in cursor.fetchall()]
+
+        # Общий пул площадки: пакетная операция - блокируем все шарды сразу
+        cursor.execute("""
+            SELECT shard, remaining FROM event_capacity_shards WHERE event_id = %s ORDER BY shard FOR UPDATE
+        """, (event_id,))
+        shards = cursor.fetchall()
+
+        wins = allocate(entries, remaining, sum(r[1] for r in shards) if shards else None)
+
+        ticket_rows, sold, won_ids, results = [], {}, [], []
+        new_ids = iter(_next_ticket_ids(cursor, sum(qty for _, _, qty in wins)))
+        for entry, pid, qty in wins:
+            price = products[pid]['price']
+            ticket_ids = [next(new_ids) for _ in range(qty)]
+            ticket_rows.extend((tid, pid, entry['chat_id'], entry['name'], entry['email'], price, entry['id'])
+                               for tid in ticket_ids)
+            sold[pid] = sold.get(pid, 0) + qty
+            won_ids.append(entry['id'])
+            results.append({'entry_id': entry['id'], 'chat_id': entry['chat_id'], 'won': True,
+                            'event_name': event_name, 'product_name': products[pid]['name'], 'quantity': qty,
+                            'amount': price * qty, 'card': card, 'ticket_ids': ticket_ids})
+
+        if ticket_rows:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO tickets (ticket_id, product_id, buyer_chat_id, buyer_name, buyer_email, final_price,
+                                     ballot_entry_id)
+                VALUES %s
+            """, ticket_rows, page_size=1000)
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE products p SET quantity_sold = p.quantity_sold + v.n
+                FROM (VALUES %s) AS v(id, n) WHERE p.id = v.id
+            """, list(sold.items()))
+            cursor.execute("UPDATE ballot_entries SET status = 'won' WHERE id = ANY(%s)", (won_ids,))
+
+            if shards:
+                left, taken = sum(sold.values()), []
+                for shard, shard_left in shards:
+                    n = min(shard_left, left)
+                    if n:
+                        taken.append((event_id, shard, n))
+                        left -= n
+                psycopg2.extras.execute_values(cursor, """
+                    UPDATE event_capacity_shards s SET remaining = s.remaining - v.n
+                    FROM (VALUES %s) AS v(event_id, shard, n) WHERE s.event_id = v.event_id AND s.shard = v.shard
+                """, taken)
+
+        cursor.execute("""
+            UPDATE ballot_entries SET status = 'lost' WHERE event_id = %s AND status = 'pending'
+            RETURNING chat_id
+        """, (event_id,))
+        results.extend({'chat_id': r[0], 'won': False, 'event_name': event_name} for r in cursor.fetchall())
+
+        cursor.execute("UPDATE events SET sale_mode = %s WHERE id = %s", (MODE_BALLOT_DRAWN, event_id))
+        conn.commit()
+        return results
+    except Exception as e:
+        logging.error(f"Ballot draw error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_ballot_payment(entry_id: int, chat_id: int) -> dict | None:
+    """Данные для оплаты выигрыша: неоплаченные (неактивные) билеты заявки этого пользователя."""
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT t.ticket_id, t.final_price, b.buyer_name, e.org_id
+        FROM ballot_entries b
+        JOIN tickets t ON t.ballot_entry_id = b.id
+        JOIN events e ON e.id = b.event_id
+        WHERE b.id = %s AND b.chat_id = %s AND t.is_active = FALSE
+    """, (entry_id, chat_id))
+    rows = cursor.fetchall()
+    conn.close()
+    if not rows:
+        return None
+    return {'ticket_ids': [r[0] for r in rows], 'amount': sum(r[1] for r in rows), 'buyer': rows[0][2],
+            'org_id': rows[0][3]}
+
+
+# --- ВМЕСТИМОСТЬ ПЛОЩАДКИ ---
+
+def get_event_capacity(event_id: int) -> tuple[int, int]:
+    """(общая вместимость, свободно в пуле). Вместимость 0 - общего лимита нет."""
+    conn = connect_db()
+    if not conn: return (0, 0)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT e.capacity, (SELECT COALESCE(SUM(remaining), 0) FROM event_capacity_shards WHERE event_id = e.id)
+        FROM events e WHERE e.id = %s
+    """, (event_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return (row[0] or 0, row[1]) if row else (0, 0)
+
+
+def _fill_capacity_pool(cursor, event_id: int, capacity: int, sold: int):
+    """Пересобирает пул: свободно = вместимость - продано, поровну по EVENT_CAPACITY_SHARDS шардам."""
+    cursor.execute("DELETE FROM event_capacity_shards WHERE event_id = %s", (event_id,))
+    if capacity > 0:
+        free, n = max(0, capacity - sold), EVENT_CAPACITY_SHARDS
+        cursor.execute("""
+            INSERT INTO event_capacity_shards (event_id, shard, remaining)
+            SELECT %s, g, %s / %s + CASE WHEN g < %s %% %s THEN 1 ELSE 0 END
+            FROM generate_series(0, %s - 1) AS g
+        """, (event_id, free, n, free, n, n))
+
+
+def set_event_capacity(event_id: int, capacity: int) -> bool:
+    """
+    Задает общую вместимость и пересобирает пул (см. _fill_capacity_pool). Тарифы блокируются на время пересборки (тот же порядок
+    блокировок, что и при покупке: тариф -> шард).
+    """
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT quantity_sold FROM products WHERE event_id = %s FOR UPDATE", (event_id,))
+        sold = sum(r[0] for r in cursor.fetchall())
+
+        cursor.execute("UPDATE events SET capacity = %s WHERE id = %s", (capacity, event_id))
+        _fill_capacity_pool(cursor, event_id, capacity, sold)
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Set event capacity error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ЛИСТ ОЖИДАНИЯ ---
+
+def join_waitlist(product_id: int, chat_id: int) -> bool:
+    """Встать в очередь на тариф (повторно - в конец, если прошлое предложение истекло)."""
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO waitlist (product_id, chat_id) VALUES (%s, %s)
+            ON CONFLICT (product_id, chat_id) DO UPDATE SET status = 'waiting', joined_at = NOW(),
+                offer_expires_at = NULL
+            WHERE waitlist.status IN ('expired', 'declined', 'claimed')
+        """, (product_id, chat_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Join waitlist error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_waitlisted_products_with_free_seats() -> list[int]:
+    """Тарифы, где есть и ожидающие, и свободные места (после возвратов, истекших предложений, роста лимита)."""
+    conn = connect_db()
+    if not conn: return []
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT p.id
+        FROM (SELECT DISTINCT product_id FROM waitlist WHERE status = 'waiting') w
+        JOIN products p ON p.id = w.product_id
+        JOIN events e ON e.id = p.event_id
+        WHERE (p.quantity_limit = 0 OR p.quantity_limit > p.quantity_sold)
+          AND (COALESCE(e.capacity, 0) = 0
+               OR EXISTS (SELECT 1 FROM event_capacity_shards s WHERE s.event_id = e.id AND s.remaining > 0))
+    """)
+    rows = cursor.fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+def offer_waitlist_seats(product_id: int, batch: int, claim_minutes: int) -> list[dict]:
+    """
+    Придерживает свободные места тарифа за следующими в очереди (до batch человек):
+    места списываются сразу (quantity_sold + общий пул), пользователь получает claim_minutes на оформление.
+    Возвращает предложения для рассылки.
+    """
+    conn = connect_db()
+    if not conn: return []
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT p.quantity_limit, p.quantity_sold, p.event_id, p.name, e.name
+            FROM products p JOIN events e ON e.id = p.event_id
+            WHERE p.id = %s FOR UPDATE OF p
+        """, (product_id,))
+        row = cursor.fetchone()
+        if not row:
+            return []
+        limit, sold, event_id, product_name, event_name = row
+        free = limit - sold if limit > 0 else batch  # Безлимитный тариф ограничен только общим пулом
+        if free <= 0:
+            return []
+
+        cursor.execute("""
+            SELECT id, chat_id FROM waitlist
+            WHERE product_id = %s AND status = 'waiting'
+            ORDER BY joined_at LIMIT %s FOR UPDATE SKIP LOCKED
+        """, (product_id, min(free, batch)))
+        candidates = cursor.fetchall()
+
+        offered = []
+        for waitlist_id, chat_id in candidates:
+            if not _take_event_capacity(cursor, event_id):
+                break  # Общий пул площадки исчерпан
+            offered.append((waitlist_id, chat_id))
+        if not offered:
+            conn.rollback()
+            return []
+
+        cursor.execute("UPDATE products SET quantity_sold = quantity_sold + %s WHERE id = %s",
+                       (len(offered), product_id))
+        cursor.execute("""
+            UPDATE waitlist SET status = 'offered', offer_expires_at = NOW() + make_interval(mins => %s)
+            WHERE id = ANY(%s)
+        """, (claim_minutes, [w[0] for w in offered]))
+        conn.commit()
+        return [{'waitlist_id': w, 'chat_id': c, 'product_id': product_id, 'product_name': product_name,
+                 'event_name': event_name} for w, c in offered]
+    except Exception as e:
+        logging.error(f"Offer waitlist seats error: {e}")
+        conn.rollback()
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _release_waitlist_holds(cursor, where_sql: str, params: tuple) -> list[int]:
+    """Снимает придержанные места (set-based) и возвращает их в продажу. Возвращает затронутые тарифы."""
+    cursor.execute(f"""
+        UPDATE waitlist SET status = CASE WHEN offer_expires_at < NOW() THEN 'expired' ELSE 'declined' END
+        WHERE status = 'offered' AND {where_sql}
+        RETURNING product_id
+    """, params)
+    released = {}
+    for (product_id,) in cursor.fetchall():
+        released[product_id] = released.get(product_id, 0) + 1
+    if not released:
+        return []
+
+    rows = psycopg2.extras.execute_values(cursor, """
+        UPDATE products p SET quantity_sold = p.quantity_sold - v.n
+        FROM (VALUES %s) AS v(id, n) WHERE p.id = v.id
+        RETURNING p.event_id, v.n
+    """, list(released.items()), fetch=True)
+    for event_id, n in rows:
+        _return_event_capacity(cursor, event_id, n)
+    return list(released)
+
+
+def expire_waitlist_offers() -> list[int]:
+    """Истекшие предложения: места возвращаются в продажу (и достанутся следующим в очереди)."""
+    conn = connect_db()
+    if not conn: return []
+    cursor = conn.cursor()
+    try:
+        released = _release_waitlist_holds(cursor, "offer_expires_at < NOW()", ())
+        conn.commit()
+        return released
+    except Exception as e:
+        logging.error(f"Expire waitlist offers error: {e}")
+        conn.rollback()
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def decline_waitlist_offer(waitlist_id: int, chat_id: int) -> bool:
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        released = _release_waitlist_holds(cursor, "id = %s AND chat_id = %s", (waitlist_id, chat_id))
+        conn.commit()
+        return bool(released)
+    except Exception as e:
+        logging.error(f"Decline waitlist offer error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_waitlist_offer(waitlist_id: int, chat_id: int) -> dict | None:
+    """Действующее предложение пользователя + данные тарифа для оформления."""
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT w.product_id, w.offer_expires_at, p.event_id
+        FROM waitlist w JOIN products p ON p.id = w.product_id
+        WHERE w.id = %s AND w.chat_id = %s AND w.status = 'offered' AND w.offer_expires_at > NOW()
+    """, (waitlist_id, chat_id))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {'product_id': row[0], 'expires_at': row[1], 'event_id': row[2]}
+
+
+# --- ОТМЕНА МЕРОПРИЯТИЯ (массовый возврат) ---
+
+# Порция билетов мероприятия аннулируется одним UPDATE; LIMIT NULL - без ограничения
+_REFUND_EVENT_TICKETS_SQL = """
+    WITH batch AS (
+        SELECT t.ticket_id FROM tickets t
+        JOIN products p ON p.id = t.product_id
+        WHERE p.event_id = %s AND t.is_refunded = FALSE
+        LIMIT %s
+        FOR UPDATE OF t
+    )
+    UPDATE tickets t
+    SET is_refunded = TRUE, is_active = FALSE,
+        refund_amount = CASE WHEN t.is_active THEN t.final_price ELSE 0 END
+    FROM batch WHERE t.ticket_id = batch.ticket_id
+"""
+
+
+def get_event_cancel_info(event_id: int) -> dict | None:
+    """Название, карта организации (куда платили покупатели), дата отмены и сколько билетов еще не аннулировано."""
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT e.name, o.bank_card, e.cancelled_at,
+                   (SELECT COUNT(*) FROM tickets t JOIN products p ON p.id = t.product_id
+                    WHERE p.event_id = e.id AND t.is_refunded = FALSE)
+            FROM events e JOIN organizations o ON o.id = e.org_id
+            WHERE e.id = %s
+        """, (event_id,))
+        row = cursor.fetchone()
+        if not row: return None
+        return {'name': row[0], 'card': row[1], 'cancelled_at': row[2], 'pending': row[3]}
+    except Exception as e:
+        logging.error(f"Get event cancel info error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def start_event_cancellation(event_id: int) -> bool:
+    """
+    Снимает мероприятие с продажи перед массовым возвратом: скрывает из списков, выключает очередь,
+    закрывает лист ожидания и лотерею. После cancelled_at новые покупки не проходят (см. create_ticket_record).
+    Повторный вызов безопасен - отмена продолжается с места остановки.
+    """
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE events SET is_active = FALSE, waiting_room_rate = 0, cancelled_at = COALESCE(cancelled_at, NOW())
+            WHERE id = %s
+        """, (event_id,))
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute("""
+            UPDATE waitlist w SET status = 'expired'
+            FROM products p
+            WHERE p.id = w.product_id AND p.event_id = %s AND w.status IN ('waiting', 'offered')
+        """, (event_id,))
+        cursor.execute("UPDATE ballot_entries SET status = 'lost' WHERE event_id = %s AND status = 'pending'",
+                       (event_id,))
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Start event cancellation error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def refund_event_tickets_chunk(event_id: int, limit: int) -> int | None:
+    """
+    Одна порция массового возврата: до limit билетов аннулируются одним UPDATE в короткой транзакции
+    (блокировки держатся миллисекунды, проверка билетов на входе не ждет). Счетчики не трогаются -
+    их один раз сбрасывает finish_event_cancellation. Возвращает число аннулированных билетов (0 - все).
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_REFUND_EVENT_TICKETS_SQL, (event_id, limit))
+        done = cursor.rowcount
+        conn.commit()
+        return done
+    except Exception as e:
+        logging.error(f"Refund event chunk error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def finish_event_cancellation(event_id: int) -> int | None:
+    """
+    Завершает отмену одной транзакцией: блокирует тарифы (покупки, начатые до cancelled_at, дождутся ее),
+    аннулирует оставшиеся билеты, сбрасывает quantity_sold и пул площадки.
+    Возвращает число билетов, аннулированных на этом шаге.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        # Тот же порядок блокировок, что и при покупке: тариф -> шард
+        cursor.execute("SELECT id FROM products WHERE event_id = %s ORDER BY id FOR UPDATE", (event_id,))
+        cursor.execute(_REFUND_EVENT_TICKETS_SQL, (event_id, None))
+        done = cursor.rowcount
+        cursor.execute("UPDATE products SET quantity_sold = 0 WHERE event_id = %s", (event_id,))
+        cursor.execute("SELECT capacity FROM events WHERE id = %s", (event_id,))
+        row = cursor.fetchone()
+        _fill_capacity_pool(cursor, event_id, (row[0] or 0) if row else 0, 0)
+        conn.commit()
+        return done
+    except Exception as e:
+        logging.error(f"Finish event cancellation error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_event_refund_payouts(event_id: int) -> list[tuple] | None:
+    """
+    Список выплат по отмененному мероприятию, по покупателю:
+    [(chat_id, имя, email, билетов, оплачено билетов, сумма к возврату)], крупные выплаты первыми.
+    Только еще не уведомленные (refund_notified_at IS NULL) - см. mark_refunds_notified.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT t.buyer_chat_id, MAX(t.buyer_name), MAX(t.buyer_email), COUNT(*),
+                   COUNT(*) FILTER (WHERE t.refund_amount > 0), SUM(t.refund_amount)
+            FROM tickets t JOIN products p ON p.id = t.product_id
+            WHERE p.event_id = %s AND t.refund_amount IS NOT NULL AND t.refund_notified_at IS NULL
+            GROUP BY t.buyer_chat_id
+            ORDER BY SUM(t.refund_amount) DESC, t.buyer_chat_id
+        """, (event_id,))
+        return cursor.fetchall()
+    except Exception as e:
+        logging.error(f"Get refund payouts error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def mark_refunds_notified(event_id: int, chat_ids: list[int]) -> bool:
+    """Отмечает возвраты покупателей как уведомленные (список выплат отправлен админу)."""
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE tickets t SET refund_notified_at = NOW()
+            FROM products p
+            WHERE p.id = t.product_id AND p.event_id = %s AND t.buyer_chat_id = ANY(%s)
+              AND t.refund_amount IS NOT NULL AND t.refund_notified_at IS NULL
+        """, (event_id, chat_ids))
+        conn.commit()
+        return True
+    except Exception as e:
+        logging.error(f"Mark refunds notified error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ФОНОВОЕ УДАЛЕНИЕ (reaper) ---
+
+# Порционное удаление зависимых строк: (таблица, DELETE не более %(limit)s строк объекта %(id)s).
+# Остальное (тарифы, шарды пула, админы) - единицы строк, удаляется каскадом вместе с самим объектом
+_REAP_EVENT_STEPS = (
+    ("tickets", """DELETE FROM tickets WHERE ticket_id IN (
+        SELECT t.ticket_id FROM tickets t JOIN products p ON p.id = t.product_id
+        WHERE p.event_id = %(id)s LIMIT %(limit)s)"""),
+    ("waitlist", """DELETE FROM waitlist WHERE id IN (
+        SELECT w.id FROM waitlist w JOIN products p ON p.id = w.product_id
+        WHERE p.event_id = %(id)s LIMIT %(limit)s)"""),
+    ("ballot_entries", """DELETE FROM ballot_entries WHERE id IN (
+        SELECT id FROM ballot_entries WHERE event_id = %(id)s LIMIT %(limit)s)"""),
+    ("promocodes", """DELETE FROM promocodes WHERE code IN (
+        SELECT code FROM promocodes WHERE event_id = %(id)s LIMIT %(limit)s)"""),
+    ("event_reminders_sent", """DELETE FROM event_reminders_sent WHERE event_id = %(id)s AND (offset_hours, chat_id) IN (
+        SELECT offset_hours, chat_id FROM event_reminders_sent WHERE event_id = %(id)s LIMIT %(limit)s)"""),
+)
+_REAP_ORG_STEPS = (
+    ("org_blacklist", """DELETE FROM org_blacklist WHERE org_id = %(id)s AND user_id IN (
+        SELECT user_id FROM org_blacklist WHERE org_id = %(id)s LIMIT %(limit)s)"""),
+)
+
+
+def get_next_reap_target() -> tuple[str, int, int] | None:
+    """
+    Следующий удаленный (deleted_at) объект: ('event', id, org_id) или ('org', id, id).
+    Сначала мероприятия; организация - когда ее мероприятий уже не осталось.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, org_id FROM events WHERE deleted_at IS NOT NULL ORDER BY deleted_at LIMIT 1")
+        row = cursor.fetchone()
+        if row:
+            return 'event', row[0], row[1]
+        cursor.execute("""
+            SELECT o.id FROM organizations o
+            WHERE o.deleted_at IS NOT NULL AND NOT EXISTS (SELECT 1 FROM events e WHERE e.org_id = o.id)
+            ORDER BY o.deleted_at LIMIT 1
+        """)
+        row = cursor.fetchone()
+        return ('org', row[0], row[0]) if row else None
+    except Exception as e:
+        logging.error(f"Get reap target error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def reap_chunk(kind: str, target_id: int, limit: int) -> tuple[str, int] | None:
+    """
+    Один шаг фонового удаления в короткой транзакции: до limit строк первой непустой зависимой таблицы,
+    а когда они закончились - сама строка мероприятия/организации.
+    Возвращает (таблица, удалено строк); таблица events/organizations - объект удален полностью.
+    """
+    steps, table = (_REAP_EVENT_STEPS, 'events') if kind == 'event' else (_REAP_ORG_STEPS, 'organizations')
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        for step_table, sql in steps:
+            cursor.execute(sql, {'id': target_id, 'limit': limit})
+            deleted = cursor.rowcount
+            if deleted:
+                conn.commit()
+                return step_table, deleted
+
+        cursor.execute(f"DELETE FROM {table} WHERE id = %s AND deleted_at IS NOT NULL", (target_id,))
+        deleted = cursor.rowcount
+        conn.commit()
+        return table, deleted
+    except Exception as e:
+        logging.error(f"Reap chunk error ({kind} {target_id}): {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- СЕКЦИИ TICKETS (по месяцу покупки) ---
+
+# Выборка за месяц: по ней видно отсечение секций (в плане остается одна tickets_YYYY_MM)
+_MONTH_TICKETS_SQL = """
+    SELECT COUNT(*), COALESCE(SUM(final_price), 0) FROM tickets
+    WHERE purchase_date >= %s AND purchase_date < %s
+"""
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _ticket_partition_name(month: date) -> str:
+    return f"tickets_{month:%Y_%m}"
+
+
+def ensure_ticket_partitions(months_ahead: int) -> list[str] | None:
+    """
+    Создает недостающие месячные секции tickets: текущий месяц и months_ahead вперед,
+    чтобы покупки не попадали в tickets_default. Возвращает имена созданных секций.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        created = []
+        start = date.today().replace(day=1)
+        for i in range(months_ahead + 1):
+            month = _add_months(start, i)
+            name = _ticket_partition_name(month)
+            cursor.execute("SELECT to_regclass(%s)", (name,))
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(f"CREATE TABLE {name} PARTITION OF tickets FOR VALUES FROM (%s) TO (%s)",
+                           (month, _add_months(month, 1)))
+            created.append(name)
+        conn.commit()
+        return created
+    except Exception as e:
+        logging.error(f"Ensure ticket partitions error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def archive_ticket_partitions(older_than_months: int) -> list[str] | None:
+    """
+    Отсоединяет месячные секции старше older_than_months и переносит их в схему tickets_archive:
+    обычные запросы к tickets их больше не сканируют. Секция остается, пока в ней есть действующие
+    неиспользованные билеты на живые мероприятия. Возвращает имена архивированных секций.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cutoff = _add_months(date.today().replace(day=1), -older_than_months)
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'tickets'::regclass AND c.relname ~ '^tickets_[0-9]{4}_[0-9]{2}$'
+            ORDER BY c.relname
+        """)
+        archived = []
+        for (name,) in cursor.fetchall():
+            if date(int(name[8:12]), int(name[13:15]), 1) >= cutoff:
+                continue
+            cursor.execute(f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM {name} t
+                    JOIN products p ON p.id = t.product_id
+                    JOIN events e ON e.id = p.event_id
+                    WHERE t.is_active AND NOT t.is_used AND e.is_active AND e.deleted_at IS NULL
+                )
+            """)
+            if cursor.fetchone()[0]:
+                continue
+            # Каждая секция - своя короткая транзакция (DETACH блокирует tickets на мгновение)
+            cursor.execute(f"ALTER TABLE tickets DETACH PARTITION {name}")
+            cursor.execute(f"ALTER TABLE {name} SET SCHEMA tickets_archive")
+            conn.commit()
+            archived.append(name)
+        conn.commit()
+        return archived
+    except Exception as e:
+        logging.error(f"Archive ticket partitions error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_ticket_partitions() -> list[tuple[str, int]]:
+    """Секции tickets и оценка числа строк (pg_class.reltuples), плюс архивные в tickets_archive."""
+    conn = connect_db()
+    if not conn: return []
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT n.nspname || '.' || c.relname, GREATEST(c.reltuples, 0)::bigint
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'tickets'::regclass)
+           OR (n.nspname = 'tickets_archive' AND c.relkind = 'r')
+        ORDER BY n.nspname, c.relname
+    """)
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def explain_month_tickets(month: date) -> str | None:
+    """План выборки билетов за месяц (EXPLAIN без выполнения) - проверка отсечения секций."""
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        month = month.replace(day=1)
+        cursor.execute("EXPLAIN (COSTS OFF) " + _MONTH_TICKETS_SQL, (month, _add_months(month, 1)))
+        return "\n".join(r[0] for r in cursor.fetchall())
+    except Exception as e:
+        logging.error(f"Explain error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_events_missing_start(after_id: int, limit: int) -> list[tuple[int, str]]:
+    """Мероприятия без starts_at, но с date_str (для разбора), по возрастанию id начиная после after_id."""
+    conn = connect_db()
+    if not conn: return []
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, date_str FROM events
+        WHERE starts_at IS NULL AND date_str IS NOT NULL AND id > %s
+        ORDER BY id LIMIT %s
+    """, (after_id, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def set_event_starts(pairs: list[tuple[int, datetime]]) -> int:
+    """Записывает разобранные даты начала одним UPDATE ... FROM (VALUES ...). Возвращает число строк."""
+    conn = connect_db()
+    if not conn: return 0
+    cursor = conn.cursor()
+    try:
+        psycopg2.extras.execute_values(cursor, """
+            UPDATE events e SET starts_at = v.starts_at
+            FROM (VALUES %s) AS v(id, starts_at)
+            WHERE e.id = v.id AND e.starts_at IS NULL
+        """, pairs, page_size=len(pairs))
+        updated = cursor.rowcount  # один запрос: page_size = len(pairs)
+        conn.commit()
+        return updated
+    except Exception as e:
+        logging.error(f"Set event starts error: {e}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- НАПОМИНАНИЯ О МЕРОПРИЯТИИ ---
+
+def get_due_reminders(offsets: list[int]) -> list[dict]:
+    """
+    Мероприятия, по которым пора напоминать: начало в пределах max(offsets) часов.
+    Для каждого - наименьшее подходящее смещение (если до начала 1 ч, а смещения 24 и 2 - только 2).
+    """
+    conn = connect_db()
+    if not conn: return []
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT e.id, e.name, e.date_str, e.starts_at,
+               (SELECT MIN(o) FROM unnest(%s::int[]) AS o WHERE e.starts_at <= NOW() + make_interval(hours => o))
+        FROM events e
+        WHERE e.is_active = TRUE AND e.cancelled_at IS NULL AND e.deleted_at IS NULL
+          AND e.starts_at > NOW() AND e.starts_at <= NOW() + make_interval(hours => %s)
+        ORDER BY e.starts_at
+    """, (list(offsets), max(offsets)))
+    rows = cursor.fetchall()
+    conn.close()
+    return [{'event_id': r[0], 'name': r[1], 'date': r[2], 'starts_at': r[3], 'offset_hours': r[4]} for r in rows]
+
+
+def claim_reminder_recipients(event_id: int, offset_hours: int, limit: int) -> list[int] | None:
+    """
+    Следующая порция держателей действующих билетов мероприятия, которым еще не отправлено это напоминание.
+    Один индексный запрос (tickets по product_id + антиджойн по PK event_reminders_sent); получатели
+    сразу помечаются отправленными - повторный тик или второй процесс их не возьмет (не более одного раза).
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO event_reminders_sent (event_id, offset_hours, chat_id)
+            SELECT %(event_id)s, %(offset)s, h.chat_id
+            FROM (
+                SELECT DISTINCT t.buyer_chat_id AS chat_id
+                FROM tickets t JOIN products p ON p.id = t.product_id
+                WHERE p.event_id = %(event_id)s AND t.is_active = TRUE AND t.is_used = FALSE AND t.is_refunded = FALSE
+                  AND NOT EXISTS (SELECT 1 FROM event_reminders_sent r
+                                  WHERE r.event_id = %(event_id)s AND r.offset_hours = %(offset)s
+                                    AND r.chat_id = t.buyer_chat_id)
+                LIMIT %(limit)s
+            ) h
+            ON CONFLICT DO NOTHING
+            RETURNING chat_id
+        """, {'event_id': event_id, 'offset': offset_hours, 'limit': limit})
+        chat_ids = [r[0] for r in cursor.fetchall()]
+        conn.commit()
+        return chat_ids
+    except Exception as e:
+        logging.error(f"Claim reminder recipients error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ПОСТРАНИЧНЫЕ СПИСКИ (keyset) ---
+# Страница = один запрос "WHERE (ключ) > (ключ последней строки) ORDER BY ключ LIMIT n+1" по индексу,
+# без OFFSET и COUNT(*): стоимость не зависит ни от размера каталога, ни от номера страницы.
+# page: None (первая страница) или ('n' | 'p', ключ) - строки после / перед ключом (см. paginator.py).
+
+def _keyset_page(cursor, columns: str, source: str, params: tuple, key_cols: tuple, page, limit: int):
+    """
+    source - FROM ... WHERE ... (без ORDER BY/LIMIT), key_cols - столбцы уникального ключа сортировки.
+    Возвращает (строки без ключа, ключ для "◀" или None, ключ для "▶" или None).
+    """
+    direction, key = page or ('n', None)
+    backward = direction == 'p'
+    if key is not None:
+        source += f" AND ({', '.join(key_cols)}) {'<' if backward else '>'} %s"
+        params += (tuple(key),)
+    order = ", ".join(f"{c} {'DESC' if backward else 'ASC'}" for c in key_cols)
+    cursor.execute(f"SELECT {', '.join(key_cols)}, {columns} {source} ORDER BY {order} LIMIT %s", params + (limit + 1,))
+    rows = cursor.fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    has_prev, has_next = (more, True) if backward else (key is not None, more)
+    n = len(key_cols)
+    return ([r[n:] for r in rows],
+            tuple(rows[0][:n]) if rows and has_prev else None,
+            tuple(rows[-1][:n]) if rows and has_next else None)
+
+
+def _fetch_page(columns: str, source: str, params: tuple, key_cols: tuple, page, limit: int):
+    conn = connect_db()
+    if not conn: return [], None, None
+    cursor = conn.cursor()
+    try:
+        return _keyset_page(cursor, columns, source, params, key_cols, page, limit)
+    except Exception as e:
+        logging.error(f"Keyset page error: {e}")
+        return [], None, None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_active_orgs_page(page, limit: int):
+    rows, prev_key, next_key = _fetch_page(
+        "id, name", "FROM organizations WHERE deleted_at IS NULL", (), ("id",), page, limit)
+    return [{'id': r[0], 'name': r[1]} for r in rows], prev_key, next_key
+
+
+def get_org_events_public_page(org_id: int, page, limit: int):
+    # Как get_org_events_public: только предстоящие, без разобранной даты - в конце (idx_events_org_listing)
+    rows, prev_key, next_key = _fetch_page(
+        "id, name, date_str",
+        """FROM events WHERE org_id = %s AND is_active = TRUE
+           AND (starts_at IS NULL OR starts_at > NOW() - make_interval(hours => %s))""",
+        (org_id, EVENT_LISTING_GRACE_HOURS),
+        ("(starts_at IS NULL)::int", "COALESCE(starts_at, 'epoch'::timestamptz)", "id"), page, limit)
+    return [{'id': r[0], 'name': r[1], 'date': r[2]} for r in rows], prev_key, next_key
+
+
+def get_event_products_page(event_id: int, page, limit: int):
+    rows, prev_key, next_key = _fetch_page(
+        "id, name, description, price, quantity_limit, quantity_sold",
+        "FROM products WHERE event_id = %s", (event_id,), ("id",), page, limit)
+    return ([{'id': r[0], 'name': r[1], 'desc': r[2], 'price': r[3], 'limit': r[4], 'sold': r[5]} for r in rows],
+            prev_key, next_key)
+
+
+def get_admin_orgs_page(user_id: int | None, page, limit: int):
+    """Организации для админки: все (user_id=None, режим супер-админа) или те, где user_id - админ."""
+    if user_id is None:
+        source, params = "FROM organizations o WHERE o.deleted_at IS NULL", ()
+    else:
+        source = ("FROM organizations o JOIN org_admins oa ON o.id = oa.org_id "
+                  "WHERE oa.user_id = %s AND o.deleted_at IS NULL")
+        params = (user_id,)
+    return _fetch_page("o.id, o.name, o.owner_id", source, params, ("o.id",), page, limit)
+
+
+def get_org_events_admin_page(org_id: int, page, limit: int):
+    return _fetch_page("id, name", "FROM events WHERE org_id = %s AND deleted_at IS NULL", (org_id,),
+                       ("id",), page, limit)
+
+
+def get_global_blacklist_page(page, limit: int):
+    return _fetch_page("user_id, reason", "FROM global_blacklist WHERE TRUE", (), ("user_id",), page, limit)
+
+
+def get_org_blacklist_page(org_id: int, page, limit: int):
+    return _fetch_page("user_id, reason", "FROM org_blacklist WHERE org_id = %s", (org_id,), ("user_id",), page, limit)
+
+
+def get_org_admins_page(org_id: int, page, limit: int):
+    """Как get_org_admins_list, постранично: владелец первым, затем админы по chat_id."""
+    rows, prev_key, next_key = _fetch_page(
+        "oa.user_id, u.username, oa.role",
+        """FROM org_admins oa
+           JOIN users u ON oa.user_id = u.chat_id
+           JOIN organizations o ON oa.org_id = o.id
+           WHERE oa.org_id = %s""",
+        (org_id,), ("CASE WHEN o.owner_id = oa.user_id THEN 0 ELSE 1 END", "oa.user_id"), page, limit)
+    admins = [{'chat_id': chat_id, 'username': username if username else f"ID:{chat_id}", 'role': role}
+              for chat_id, username, role in rows]
+    return admins, prev_key, next_key
+
+
+# --- ПОИСК МЕРОПРИЯТИЙ (pg_trgm) ---
+
+def search_events(text: str, threshold: float, limit: int) -> list[dict] | None:
+    """
+    Предстоящие мероприятия, похожие на text по названию, месту или организатору, лучшие первыми.
+    Каждая ветка UNION идет по своему триграммному индексу (migration 21); порог word_similarity
+    задается SET LOCAL в том же запросе. Ошибка - None (пустой результат - []).
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SET LOCAL pg_trgm.word_similarity_threshold = %(threshold)s;
+            WITH hits AS (
+                SELECT id AS event_id, word_similarity(%(q)s, name) AS score
+                FROM events WHERE %(q)s <%% name AND is_active = TRUE
+                UNION ALL
+                SELECT id, word_similarity(%(q)s, location) * 0.8
+                FROM events WHERE %(q)s <%% location AND is_active = TRUE
+                UNION ALL
+                SELECT e.id, word_similarity(%(q)s, o.name) * 0.9
+                FROM organizations o JOIN events e ON e.org_id = o.id AND e.is_active = TRUE
+                WHERE %(q)s <%% o.name AND o.deleted_at IS NULL
+            )
+            SELECT e.id, e.name, e.date_str, e.org_id, o.name, e.location,
+                   (SELECT MIN(p.price) FROM products p WHERE p.event_id = e.id) AS min_price,
+                   MAX(h.score) AS score
+            FROM hits h
+            JOIN events e ON e.id = h.event_id
+            JOIN organizations o ON o.id = e.org_id
+            WHERE e.deleted_at IS NULL AND o.deleted_at IS NULL
+              AND (e.starts_at IS NULL OR e.starts_at > NOW() - make_interval(hours => %(grace)s))
+            GROUP BY e.id, o.name
+            ORDER BY score DESC, e.starts_at NULLS LAST, e.id
+            LIMIT %(limit)s
+        """, {'q': text, 'threshold': threshold, 'grace': EVENT_LISTING_GRACE_HOURS, 'limit': limit})
+        rows = cursor.fetchall()
+        conn.rollback()  # только чтение; закрываем транзакцию с SET LOCAL
+        return [{'id': r[0], 'name': r[1], 'date': r[2], 'org_id': r[3], 'org_name': r[4], 'location': r[5],
+                 'min_price': r[6]} for r in rows]
+    except Exception as e:
+        logging.error(f"Event search error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- DEEP LINKS (/start ev_... / p_..., см. deep_links.py) ---
+
+def get_deep_link_target(kind: str, target_id: int, user_id: int) -> dict | None:
+    """
+    Все, что нужно для перехода по ссылке, одним запросом: организация, мероприятие (в продаже и
+    не прошедшее - как в списках, EVENT_LISTING_GRACE_HOURS), тарифы с остатком (kind='ev' - все, 'p' - один) и черный список пользователя.
+    None - мероприятие/тариф не найдены, сняты с продажи или ошибка БД.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    condition = "e.id = %(id)s" if kind == 'ev' else "e.id = (SELECT event_id FROM products WHERE id = %(id)s)"
+    product_filter = "" if kind == 'ev' else "AND p.id = %(id)s"
+    try:
+        cursor.execute(f"""
+            SELECT o.id, e.id, e.name, e.sale_mode,
+                   EXISTS (SELECT 1 FROM global_blacklist g WHERE g.user_id = %(user_id)s)
+                   OR EXISTS (SELECT 1 FROM org_blacklist b WHERE b.org_id = o.id AND b.user_id = %(user_id)s),
+                   p.id, p.name, p.price
+            FROM events e
+            JOIN organizations o ON o.id = e.org_id
+            LEFT JOIN products p ON p.event_id = e.id {product_filter}
+                 AND (p.quantity_limit = 0 OR p.quantity_sold < p.quantity_limit)
+            WHERE {condition} AND e.is_active = TRUE
+              AND e.cancelled_at IS NULL AND e.deleted_at IS NULL AND o.deleted_at IS NULL
+              AND (e.starts_at IS NULL OR e.starts_at > NOW() - make_interval(hours => %(grace)s))
+            ORDER BY p.id
+        """, {'id': target_id, 'user_id': user_id, 'grace': EVENT_LISTING_GRACE_HOURS})
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        org_id, event_id, event_name, sale_mode, blacklisted = rows[0][:5]
+        return {
+            'org_id': org_id, 'event_id': event_id, 'event_name': event_name, 'sale_mode': sale_mode,
+            'blacklisted': blacklisted,
+            # Те же ключи, что у get_product_info (buy_prod / корзина)
+            'products': [{'id': r[5], 'name': r[6], 'price': r[7], 'event_name': event_name, 'org_id': org_id}
+                         for r in rows if r[5] is not None],
+        }
+    except Exception as e:
+        logging.error(f"Deep link target error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ИМПОРТ КАТАЛОГА (catalog_import.py) ---
+
+def import_catalog(org_id: int, events: list[dict]) -> dict | None:
+    """
+    Все мероприятия и тарифы из файла одной транзакцией: многострочные INSERT (execute_values) вместо
+    запроса на каждую строку. Если мероприятие с таким названием и датой уже есть у организации,
+    ничего не создается: {'duplicates': [...]}. Успех - {'events': N, 'products': M}, ошибка БД - None.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT name, date_str FROM events
+            WHERE org_id = %s AND deleted_at IS NULL AND (name, date_str) IN %s
+        """, (org_id, tuple((e['name'], e['date_str']) for e in events)))
+        duplicates = [f"{name} ({date_str})" for name, date_str in cursor.fetchall()]
+        if duplicates:
+            conn.rollback()
+            return {'duplicates': duplicates}
+
+        created = psycopg2.extras.execute_values(cursor, """
+            INSERT INTO events (org_id, name, date_str, starts_at, location, description) VALUES %s
+            RETURNING id, name, date_str
+        """, [(org_id, e['name'], e['date_str'], e['starts_at'], e['location'], e['description']) for e in events],
+            page_size=len(events), fetch=True)
+        event_ids = {(name, date_str): event_id for event_id, name, date_str in created}
+
+        products = [(event_ids[(e['name'], e['date_str'])], p['name'], p['price'], p['limit'], p['refundable'])
+                    for e in events for p in e['products']]
+        if products:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO products (event_id, name, price, quantity_limit, is_refundable) VALUES %s
+            """, products, page_size=len(products))
+        conn.commit()
+        return {'events': len(event_ids), 'products': len(products)}
+    except Exception as e:
+        logging.error(f"Catalog import error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ПАРТИИ ПРОМОКОДОВ (promo_codes.py) ---
+
+def create_promo_batch(event_id: int, label: str, discount: int, usage_limit: int, created_by: int) -> int | None:
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO promo_batches (event_id, label, discount_percent, usage_limit, created_by)
+            VALUES (%s, %s, %s, %s, %s) RETURNING id
+        """, (event_id, label, discount, usage_limit, created_by))
+        batch_id = cursor.fetchone()[0]
+        conn.commit()
+        return batch_id
+    except Exception as e:
+        logging.error(f"Create promo batch error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def insert_promo_codes(batch_id: int, codes: list[str]) -> list[str] | None:
+    """
+    Коды партии: COPY во временную таблицу (один поток данных вместо INSERT на код), затем один
+    INSERT ... SELECT с параметрами партии. Совпавшие с существующими коды пропускаются (ON CONFLICT) -
+    возвращаются только реально созданные.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE TEMP TABLE promo_staging (code VARCHAR(50)) ON COMMIT DROP")
+        cursor.copy_expert("COPY promo_staging (code) FROM STDIN", io.StringIO("\n".join(codes) + "\n"))
+        cursor.execute("""
+            INSERT INTO promocodes (code, event_id, discount_percent, usage_limit, batch_id)
+            SELECT s.code, b.event_id, b.discount_percent, b.usage_limit, b.id
+            FROM promo_staging s CROSS JOIN promo_batches b
+            WHERE b.id = %s
+            ON CONFLICT (code) DO NOTHING
+            RETURNING code
+        """, (batch_id,))
+        inserted = [r[0] for r in cursor.fetchall()]
+        conn.commit()
+        return inserted
+    except Exception as e:
+        logging.error(f"Insert promo codes error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def export_promo_batch(batch_id: int, event_id: int) -> bytes | None:
+    """CSV со всеми кодами партии и их использованием (COPY TO STDOUT, без выборки строк в Python)."""
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        buf = io.BytesIO()
+        query = cursor.mogrify("""
+            COPY (SELECT code, discount_percent, usage_limit, used_count FROM promocodes
+                  WHERE batch_id = %s AND event_id = %s ORDER BY code)
+            TO STDOUT WITH (FORMAT csv, HEADER)
+        """, (batch_id, event_id)).decode()
+        cursor.copy_expert(query, buf)
+        return buf.getvalue()
+    except Exception as e:
+        logging.error(f"Export promo batch error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def delete_promo_batch(batch_id: int, event_id: int) -> bool:
+    conn = connect_db()
+    if not conn: return False
+    cursor = conn.cursor()
+    try:
+        # Коды партии удаляются каскадом (promocodes.batch_id ON DELETE CASCADE)
+        cursor.execute("DELETE FROM promo_batches WHERE id = %s AND event_id = %s", (batch_id, event_id))
+        conn.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        logging.error(f"Delete promo batch error: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_event_promo_groups_page(event_id: int, page, limit: int):
+    """
+    Промокоды мероприятия постранично: сначала партии (одна строка со статистикой на партию),
+    затем созданные вручную коды. Строка: {'kind': 'batch' | 'code', 'id', 'label', 'discount', 'limit',
+    'codes', 'used_codes', 'uses'}.
+    """
+    rows, prev_key, next_key = _fetch_page(
+        "g.key, g.label, g.discount, g.usage_limit, g.codes, g.used_codes, g.uses, g.kind",
+        """FROM (
+               SELECT 0 AS kind, b.id AS key, b.label, b.discount_percent AS discount, b.usage_limit,
+                      s.codes, s.used_codes, s.uses
+               FROM promo_batches b
+               CROSS JOIN LATERAL (
+                   SELECT COUNT(*) AS codes, COUNT(*) FILTER (WHERE p.used_count > 0) AS used_codes,
+                          COALESCE(SUM(p.used_count), 0) AS uses
+                   FROM promocodes p WHERE p.batch_id = b.id
+               ) s
+               WHERE b.event_id = %s
+               UNION ALL
+               SELECT 1, p.id, p.code, p.discount_percent, p.usage_limit, 1, (p.used_count > 0)::int, p.used_count
+               FROM promocodes p WHERE p.event_id = %s AND p.batch_id IS NULL
+           ) g WHERE TRUE""",
+        (event_id, event_id), ("g.kind", "g.key"), page, limit)
+    return ([{'kind': 'batch' if r[7] == 0 else 'code', 'id': r[0], 'label': r[1], 'discount': r[2], 'limit': r[3],
+              'codes': r[4], 'used_codes': r[5], 'uses': r[6]} for r in rows], prev_key, next_key)
+
+
+# --- ЧЕРНЫЕ СПИСКИ: ИМПОРТ ИЗ ФАЙЛА (blacklist.py) ---
+
+def import_blacklist(org_id: int | None, rows: list[tuple[int, str | None]], admin_id: int) -> dict | None:
+    """
+    Массовая блокировка: COPY во временную таблицу, затем один INSERT ... SELECT ... ON CONFLICT DO NOTHING
+    в global_blacklist (org_id=None) или org_blacklist. ID без записи в users пропускаются (внешний ключ).
+    Возвращает {'added', 'existing', 'unknown'}. rows - без повторов user_id.
+    """
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE TEMP TABLE bl_staging (user_id BIGINT PRIMARY KEY, reason TEXT) ON COMMIT DROP")
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)  # None -> пустое поле -> NULL
+        buf.seek(0)
+        cursor.copy_expert("COPY bl_staging (user_id, reason) FROM STDIN WITH (FORMAT csv)", buf)
+        cursor.execute("""
+            SELECT COUNT(*) FROM bl_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.chat_id = s.user_id)
+        """)
+        unknown = cursor.fetchone()[0]
+        if org_id is None:
+            cursor.execute("""
+                INSERT INTO global_blacklist (user_id, reason, blocked_by)
+                SELECT s.user_id, s.reason, %s FROM bl_staging s JOIN users u ON u.chat_id = s.user_id
+                ON CONFLICT (user_id) DO NOTHING
+            """, (admin_id,))
+        else:
+            cursor.execute("""
+                INSERT INTO org_blacklist (org_id, user_id, reason)
+                SELECT %s, s.user_id, s.reason FROM bl_staging s JOIN users u ON u.chat_id = s.user_id
+                ON CONFLICT (org_id, user_id) DO NOTHING
+            """, (org_id,))
+        added = cursor.rowcount
+        conn.commit()
+        return {'added': added, 'existing': len(rows) - unknown - added, 'unknown': unknown}
+    except Exception as e:
+        logging.error(f"Blacklist import error: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_blacklist_count(org_id: int | None) -> int | None:
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        if org_id is None:
+            cursor.execute("SELECT COUNT(*) FROM global_blacklist")
+        else:
+            cursor.execute("SELECT COUNT(*) FROM org_blacklist WHERE org_id = %s", (org_id,))
+        return cursor.fetchone()[0]
+    except Exception as e:
+        logging.error(f"Blacklist count error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ID БИЛЕТОВ И НОМЕРА ЗАКАЗОВ (ticket_codes.py) ---
+
+def _next_ticket_ids(cursor, count: int) -> list[str]:
+    """ID для count новых билетов: значения ticket_id_seq не повторяются - коллизий первичного ключа нет."""
+    cursor.execute("SELECT nextval('ticket_id_seq') FROM generate_series(1, %s)", (count,))
+    return [ticket_codes.ticket_id(r[0]) for r in cursor.fetchall()]
+
+
+def next_order_ref() -> str | None:
+    conn = connect_db()
+    if not conn: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT nextval('order_ref_seq')")
+        return ticket_codes.order_ref(cursor.fetchone()[0])
+    except Exception as e:
+        logging.error(f"Order ref error: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- ИНСТРУМЕНТАЦИЯ (должна оставаться в конце файла) ---
+# Каждая публичная функция модуля оборачивается трассировкой (db_trace.py):
+# латентность в metrics, а при включенном DB_TRACE - строки, место вызова и slow-query лог.
+db_trace.instrument_module(globals(), exclude=('connect_db',))
@@ -0,0 +1,70 @@
+# deep_links.py
+
+import os
+import hmac
+import base64
+import hashlib
+
+# Ссылки t.me/<бот>?start=<payload>: Telegram передает payload в /start (context.args).
+# Payload: <вид>_<id в base36>_<подпись>, например ev_2n_Xa9-fQ. Подпись (HMAC, 6 символов) не дает
+# перебором id открывать скрытые тарифы и мероприятия; разрешенные символы и лимит в 64 байта соблюдены.
+KINDS = ('ev', 'p')  # мероприятие | тариф
+SIGNATURE_CHARS = 6
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _b36(n: int) -> str:
+    s = ""
+    while True:
+        n, r = divmod(n, 36)
+        s = _DIGITS[r] + s
+        if not n:
+            return s
+
+
+def check_secret():
+    """Проверка при старте (setup_application): без DEEP_LINK_SECRET бот не запускается."""
+    if not os.getenv("DEEP_LINK_SECRET"):
+        raise RuntimeError("DEEP_LINK_SECRET не задан: нужен для подписи ссылок t.me/<бот>?start= (deep_links.py)")
+
+
+def _sign(body: str) -> str:
+    # Секрет читается при вызове: .env загружается после импорта модулей.
+    # Отдельный секрет, не токен бота: токен перевыпускают, а смена секрета ломает все розданные ссылки.
+    # Чтобы сохранить ссылки, выданные до появления DEEP_LINK_SECRET, задайте его равным старому TELEGRAM_TOKEN
+    secret = os.environ["DEEP_LINK_SECRET"].encode()
+    digest = hmac.new(secret, body.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode()[:SIGNATURE_CHARS]
+
+
+def make_payload(kind: str, target_id: int) -> str:
+    body = f"{kind}_{_b36(target_id)}"
+    return f"{body}_{_sign(body)}"
+
+
+def event_payload(event_id: int) -> str:
+    return make_payload('ev', event_id)
+
+
+def product_payload(product_id: int) -> str:
+    return make_payload('p', product_id)
+
+
+def parse_payload(payload: str | None) -> tuple[str, int] | None:
+    """('ev' | 'p', id) для подписанного payload; None - чужой, битый или подделанный."""
+    if not payload:
+        return None
+    kind, _, rest = payload.partition('_')
+    id_part, _, signature = rest.partition('_')
+    if kind not in KINDS or not id_part or not signature:
+        return None
+    if not hmac.compare_digest(signature, _sign(f"{kind}_{id_part}")):
+        return None
+    try:
+        return kind, int(id_part, 36)
+    except ValueError:
+        return None
+
+
+def start_link(bot_username: str, payload: str) -> str:
+    return f"https://t.me/{bot_username}?start={payload}"
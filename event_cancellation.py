@@ -0,0 +1,140 @@
+# event_cancellation.py
+
+import os
+import io
+import time
+import asyncio
+import logging
+import openpyxl
+from datetime import datetime
+from telegram import InputFile
+from db_utils import (get_event_cancel_info, start_event_cancellation, refund_event_tickets_chunk,
+                      finish_event_cancellation, get_event_refund_payouts, mark_refunds_notified)
+from notifications import Notification, send_bulk
+from utils import escape_html
+
+# --- НАСТРОЙКИ ---
+# Сколько билетов аннулируется одной транзакцией
+CANCEL_CHUNK_SIZE = int(os.getenv("CANCEL_CHUNK_SIZE", 1000))
+# Как часто обновлять сообщение с прогрессом у админа (лимиты Telegram на редактирование)
+PROGRESS_EDIT_INTERVAL = float(os.getenv("CANCEL_PROGRESS_INTERVAL", 3))
+
+# Мероприятия, отмена которых идет прямо сейчас (защита от двойного запуска)
+running: set[int] = set()
+
+
+def build_payout_report(event_id: int, event_name: str, card: str | None, payouts: list[tuple]) -> tuple[io.BytesIO, str]:
+    """Excel со списком выплат: строка на покупателя + итог. Выполняется в потоке."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Refunds"
+    ws.append(["Chat ID", "Name", "Email", "Tickets", "Paid tickets", "Refund", "Paid to card"])
+    for chat_id, name, email, tickets, paid, amount in payouts:
+        ws.append([chat_id, name, email, tickets, paid, amount, card or 'N/A'])
+    ws.append([])
+    ws.append(["TOTAL", event_name, "", sum(p[3] for p in payouts), sum(p[4] for p in payouts),
+               sum(p[5] for p in payouts), card or 'N/A'])
+
+    bio = io.BytesIO()
+    filename = f"refunds_event_{event_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
+    wb.save(bio)
+    bio.seek(0)
+    return bio, filename
+
+
+def cancellation_notification(event_name: str, payout: tuple) -> Notification:
+    chat_id, _, _, tickets, paid, amount = payout
+    text = f"⛔ <b>Мероприятие «{escape_html(event_name)}» отменено.</b>\n\n"
+    if amount:
+        text += (f"Ваши билеты ({tickets} шт.) аннулированы.\n"
+                 f"Сумма к возврату: <b>{amount} руб.</b> ({paid} оплаченных билетов) - "
+                 f"организатор переведет ее в ближайшее время.")
+    else:
+        text += "Ваши неоплаченные заявки на билеты аннулированы. Списаний не было."
+    return Notification(chat_id, text)
+
+
+def _progress_text(event_name: str, done: int, total: int, stage: str) -> str:
+    percent = min(100, done * 100 // total) if total else 100
+    return (
+        f"⛔ <b>Отмена «{escape_html(event_name)}»</b>\n\n"
+        f"Билетов аннулировано: {done} из {total} ({percent}%)\n"
+        f"{stage}"
+    )
+
+
+async def _edit(bot, message, text: str):
+    try:
+        await bot.edit_message_text(chat_id=message.chat_id, message_id=message.message_id, text=text,
+                                    parse_mode='HTML')
+    except Exception as e:
+        logging.debug(f"Cancellation progress edit failed: {e}")
+
+
+async def run(bot, admin_chat_id: int, event_id: int):
+    """
+    Фоновая отмена мероприятия: снять с продажи -> аннулировать билеты порциями -> один раз сбросить
+    счетчики -> отправить админу список выплат -> уведомить покупателей (send_bulk).
+    Прерванную отмену можно запустить повторно - она продолжится с места остановки; список выплат
+    и уведомления получат только покупатели, которых еще не было в прошлых списках.
+    """
+    if event_id in running:
+        await bot.send_message(admin_chat_id, "⏳ Отмена этого мероприятия уже идет.")
+        return
+    running.add(event_id)
+    try:
+        await _run(bot, admin_chat_id, event_id)
+    except Exception as e:
+        logging.error(f"Event {event_id} cancellation failed: {e}")
+        await bot.send_message(admin_chat_id, "❌ Отмена прервана из-за ошибки. Запустите ее повторно - "
+                                              "уже аннулированные билеты и уведомленные покупатели "
+                                              "не обрабатываются дважды.")
+    finally:
+        running.discard(event_id)
+
+
+async def _run(bot, admin_chat_id: int, event_id: int):
+    info = await asyncio.to_thread(get_event_cancel_info, event_id)
+    if not info or not await asyncio.to_thread(start_event_cancellation, event_id):
+        raise RuntimeError("event not found or DB error")
+    event_name, total = info['name'], info['pending']
+
+    progress = await bot.send_message(admin_chat_id, _progress_text(event_name, 0, total, "Аннулирую билеты..."),
+                                      parse_mode='HTML')
+    done, last_edit = 0, time.monotonic()
+    while True:
+        count = await asyncio.to_thread(refund_event_tickets_chunk, event_id, CANCEL_CHUNK_SIZE)
+        if count is None:
+            raise RuntimeError("refund chunk failed")
+        if count == 0:
+            break
+        done += count
+        if time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+            last_edit = time.monotonic()
+            await _edit(bot, progress, _progress_text(event_name, done, total, "Аннулирую билеты..."))
+
+    count = await asyncio.to_thread(finish_event_cancellation, event_id)
+    payouts = await asyncio.to_thread(get_event_refund_payouts, event_id)
+    if count is None or payouts is None:
+        raise RuntimeError("finish cancellation failed")
+    done += count
+    if not payouts:
+        await _edit(bot, progress, _progress_text(event_name, done, max(total, done),
+                                                  "✅ Готово. Все покупатели уже уведомлены ранее."))
+        return
+
+    refund_total = sum(p[5] for p in payouts)
+    bio, filename = await asyncio.to_thread(build_payout_report, event_id, event_name, info['card'], payouts)
+    await bot.send_document(chat_id=admin_chat_id, document=InputFile(bio, filename=filename),
+                            caption=f"💸 Выплаты по «{event_name}»: {refund_total} руб., "
+                                    f"{sum(1 for p in payouts if p[5])} получателей")
+    # Отметка до рассылки (как у напоминаний): повтор после сбоя не дублирует ни список, ни уведомления
+    if not await asyncio.to_thread(mark_refunds_notified, event_id, [p[0] for p in payouts]):
+        raise RuntimeError("mark refunds notified failed")
+
+    await _edit(bot, progress, _progress_text(event_name, done, max(total, done),
+                                              f"Уведомляю покупателей ({len(payouts)})..."))
+    sent, failed = await send_bulk(bot, (cancellation_notification(event_name, p) for p in payouts),
+                                   mode='cancellation')
+    await _edit(bot, progress, _progress_text(event_name, done, max(total, done),
+                                              f"✅ Готово. Уведомлено: {sent}, не доставлено: {failed}."))
@@ -0,0 +1,112 @@
+# event_dates.py
+
+import os
+import re
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from telegram.ext import ContextTypes
+from db_utils import get_events_missing_start, set_event_starts
+
+# --- НАСТРОЙКИ ---
+# Часовой пояс, в котором организаторы вводят дату мероприятия
+EVENT_TZ = ZoneInfo(os.getenv("EVENT_TZ", "Europe/Moscow"))
+# Время начала, если в дате указан только день
+DEFAULT_TIME = (12, 0)
+BACKFILL_BATCH = 500
+
+_TIME_RE = re.compile(r'(?<!\d)([01]?\d|2[0-3]):([0-5]\d)(?!\d)')
+# Время через точку ('19.30') неотличимо от даты '19.03' - принимается только после даты
+_DOT_TIME_RE = re.compile(r'(?<!\d)([01]?\d|2[0-3])\.([0-5]\d)(?!\d)')
+_LEFTOVER_RE = re.compile(r'(?<!\d)\d{1,2}[.:]\d{2}(?!\d)')
+_ISO_RE = re.compile(r'(?<!\d)(\d{4})-(\d{1,2})-(\d{1,2})(?!\d)')
+_NUMERIC_RE = re.compile(r'(?<!\d)(\d{1,2})[./](\d{1,2})(?:[./](\d{4}|\d{2}))?(?!\d)')
+_WORDS_RE = re.compile(r'(?<!\d)(\d{1,2})\s+([а-я]+)\.?(?:\s+(\d{4}))?')
+_MONTHS = {'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'мая': 5, 'май': 5, 'июн': 6,
+           'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12}
+
+
+def _find_date(s: str):
+    """(match, day, month, year | None) первой даты в строке или None. Месяц словом - раньше числового вида."""
+    if m := _ISO_RE.search(s):
+        year, month, day = (int(g) for g in m.groups())
+        return m, day, month, year
+    for m in _WORDS_RE.finditer(s):
+        if month := _MONTHS.get(m.group(2)[:3]):
+            return m, int(m.group(1)), month, m.group(3) and int(m.group(3))
+    for m in _NUMERIC_RE.finditer(s):
+        if 1 <= int(m.group(2)) <= 12:  # '19.00' - не дата
+            return m, int(m.group(1)), int(m.group(2)), m.group(3) and int(m.group(3))
+    return None
+
+
+def parse_event_datetime(text: str | None, now: datetime | None = None, require_year: bool = False) -> datetime | None:
+    """
+    Разбирает дату мероприятия из свободного текста (как ее вводят в input_event_date):
+    '25.12.2025 18:00', '25.12.25', '25/12 18:00', '2025-12-25 18:00', '25 декабря 2025 в 18:00',
+    '05.04 в 19.30', 'суббота 5 апреля 19.00'. Время через точку - только после даты.
+    Без года - ближайшая такая дата (не в прошлом) или None при require_year, без времени - DEFAULT_TIME.
+    Возвращает datetime в EVENT_TZ или None, если дату не распознать или время неоднозначно.
+    """
+    if not text:
+        return None
+    now = now or datetime.now(EVENT_TZ)
+    s = text.strip().lower().replace('ё', 'е')
+
+    hour, minute = DEFAULT_TIME
+    if m := _TIME_RE.search(s):
+        hour, minute = int(m.group(1)), int(m.group(2))
+        s = s[:m.start()] + ' ' + s[m.end():]
+        found_time = True
+    else:
+        found_time = False
+
+    found = _find_date(s)
+    if not found:
+        return None
+    m, day, month, year = found
+    before, after = s[:m.start()], s[m.end():]
+    if not found_time and (t := _DOT_TIME_RE.search(after)):
+        hour, minute = int(t.group(1)), int(t.group(2))
+        after = after[:t.start()] + ' ' + after[t.end():]
+    if _LEFTOVER_RE.search(before + ' ' + after):
+        return None  # Еще одно время/дата ('19.00 5 апреля', '10:00 12:00') - не угадываем
+    if not year and require_year:
+        return None
+
+    try:
+        if not year:
+            result = datetime(now.year, month, day, hour, minute, tzinfo=EVENT_TZ)
+            if result < now - timedelta(days=1):
+                result = datetime(now.year + 1, month, day, hour, minute, tzinfo=EVENT_TZ)
+            return result
+        return datetime(year + 2000 if year < 100 else year, month, day, hour, minute, tzinfo=EVENT_TZ)
+    except ValueError:
+        return None  # 31.02, 25:61 и т.п.
+
+
+def _backfill() -> tuple[int, int]:
+    """Заполняет events.starts_at по date_str для старых мероприятий порциями по id."""
+    parsed = failed = last_id = 0
+    while True:
+        rows = get_events_missing_start(last_id, BACKFILL_BATCH)
+        if not rows:
+            return parsed, failed
+        last_id = rows[-1][0]
+        # Без года не достраиваем: старое '25/12' - скорее прошедшее мероприятие, чем будущее
+        pairs = [(event_id, starts_at) for event_id, date_str in rows
+                 if (starts_at := parse_event_datetime(date_str, require_year=True))]
+        parsed += set_event_starts(pairs) if pairs else 0
+        failed += len(rows) - len(pairs)
+
+
+async def backfill(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue (однократно при старте): разбор date_str у мероприятий без starts_at."""
+    try:
+        parsed, failed = await asyncio.to_thread(_backfill)
+    except Exception as e:
+        logging.error(f"Event date backfill error: {e}")
+        return
+    if parsed or failed:
+        logging.info(f"Event date backfill: parsed {parsed}, unparseable {failed}")
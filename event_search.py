@@ -0,0 +1,48 @@
+# event_search.py
+
+import os
+import time
+from collections import OrderedDict
+from db_utils import search_events
+import metrics
+
+# --- НАСТРОЙКИ ---
+# Короче 3 символов триграммы почти ничего не отсекают
+SEARCH_MIN_LENGTH = int(os.getenv("SEARCH_MIN_LENGTH", 3))
+# Порог pg_trgm word_similarity (0..1): ниже - терпимее к опечаткам, но больше шума
+SEARCH_THRESHOLD = float(os.getenv("SEARCH_THRESHOLD", 0.4))
+# Сколько лучших результатов запоминаем на запрос (дальше листание идет по кэшу)
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", 50))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 60))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1000))
+
+# нормализованный запрос -> (monotonic время истечения, результаты); LRU
+_cache: OrderedDict = OrderedDict()
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().replace('ё', 'е').split())
+
+
+def search(text: str) -> list[dict] | None:
+    """
+    Ранжированные результаты по запросу: один запрос к БД на SEARCH_CACHE_TTL для одинаковых
+    запросов всех пользователей, листание страниц в БД не ходит. None - ошибка БД.
+    """
+    key = normalize(text)
+    now = time.monotonic()
+    cached = _cache.get(key)
+    if cached and cached[0] > now:
+        _cache.move_to_end(key)
+        metrics.SEARCH_QUERIES.inc(result='cache')
+        return cached[1]
+
+    results = search_events(key, SEARCH_THRESHOLD, SEARCH_MAX_RESULTS)
+    if results is None:
+        return None
+    metrics.SEARCH_QUERIES.inc(result='db')
+    _cache[key] = (now + SEARCH_CACHE_TTL, results)
+    _cache.move_to_end(key)
+    while len(_cache) > SEARCH_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return results
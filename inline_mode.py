@@ -0,0 +1,62 @@
+# inline_mode.py
+
+import os
+from telegram import Update, InlineQueryResultArticle, InputTextMessageContent, InlineKeyboardButton, \
+    InlineKeyboardMarkup, InlineQueryResultsButton
+from telegram.ext import ContextTypes
+import event_search
+import deep_links
+from utils import escape_html
+
+# --- НАСТРОЙКИ ---
+# Inline-режим нужно включить у @BotFather (/setinline).
+# Сколько секунд Telegram отдает ответ на тот же запрос из своего кэша (всем пользователям, is_personal=False):
+# при рассылке ссылки по чатам одинаковые запросы до бота не доходят
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))
+# Результатов в одном ответе (остальные - по next_offset при прокрутке)
+INLINE_PAGE_SIZE = 20
+
+
+def _article(event: dict, link: str) -> InlineQueryResultArticle:
+    price = f"от {event['min_price']} руб." if event['min_price'] is not None else "билетов пока нет"
+    description = " · ".join(filter(None, [event['date'], event['location'], event['org_name'], price]))
+    text = (
+        f"🎉 <b>{escape_html(event['name'])}</b>\n"
+        f"📅 {escape_html(event['date'] or 'Дата уточняется')}\n"
+        + (f"📍 {escape_html(event['location'])}\n" if event['location'] else "")
+        + f"🏢 {escape_html(event['org_name'])}\n"
+        f"🎫 {price}"
+    )
+    return InlineQueryResultArticle(
+        id=str(event['id']),
+        title=event['name'],
+        description=description,
+        input_message_content=InputTextMessageContent(text, parse_mode='HTML'),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🎫 Купить билет", url=link)]]),
+    )
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    @бот <запрос>: мероприятия из поиска покупателя (event_search: триграммный индекс + кэш процесса)
+    со ссылкой на покупку. Набор запроса по буквам почти всегда попадает в кэш Telegram или процесса.
+    """
+    query = update.inline_query
+    text = query.query
+    if len(event_search.normalize(text)) < event_search.SEARCH_MIN_LENGTH:
+        await query.answer([], cache_time=INLINE_CACHE_TIME,
+                           button=InlineQueryResultsButton("🎫 Открыть бота", start_parameter="inline"))
+        return
+
+    results = event_search.search(text)
+    if results is None:
+        await query.answer([], cache_time=0)  # Ошибка БД - пустой ответ не кэшируем
+        return
+
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    page = results[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(results) else ""
+    username = context.bot.username
+    await query.answer(
+        [_article(e, deep_links.start_link(username, deep_links.event_payload(e['id']))) for e in page],
+        cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset)
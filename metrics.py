@@ -0,0 +1,263 @@
+# metrics.py
+
+import os
+import time
+import bisect
+import logging
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram.ext import ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+
+# Минимальная реализация формата Prometheus (text exposition 0.0.4) без внешних зависимостей.
+# Все операции - O(1) под неконкурентным локом, так что накладные расходы ничтожны.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list = []
+_collectors: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики по бакетам (не кумулятивные), сумма, количество]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def register_collector(fn):
+    """fn() -> list[str]: строки, вычисляемые в момент чтения /metrics (например, счетчики других модулей)."""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            logging.error(f"Metrics collector error: {e}")
+    return "\n".join(lines) + "\n"
+
+
+# --- МЕТРИКИ БОТА ---
+
+HANDLER_LATENCY = Histogram("bot_handler_duration_seconds", "Handler latency",
+                            ("conversation", "state", "handler", "pattern"))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handler exceptions",
+                         ("conversation", "state", "handler"))
+
+DB_QUERY_LATENCY = Histogram("bot_db_call_duration_seconds", "db_utils call latency", ("function",))
+DB_QUERY_ERRORS = Counter("bot_db_call_errors_total", "db_utils calls that raised", ("function",))
+DB_CONNECTIONS = Counter("bot_db_connections_total", "DB connections by event (opened/closed/failed)", ("event",))
+
+TG_API_LATENCY = Histogram("bot_telegram_api_duration_seconds", "Telegram Bot API call latency", ("endpoint",))
+TG_API_ERRORS = Counter("bot_telegram_api_errors_total", "Telegram Bot API errors", ("endpoint", "code"))
+
+THROTTLED_UPDATES = Counter("bot_throttled_updates_total", "Updates shed by rate limiting", ("scope", "pattern"))
+
+LANE_WAIT = Histogram("bot_lane_wait_seconds", "Time an update waited for a slot in its priority lane", ("lane",))
+LANE_QUEUE_DEPTH = Gauge("bot_lane_queue_depth", "Updates waiting per priority lane", ("lane",))
+LANE_ACTIVE = Gauge("bot_lane_active", "Updates running per priority lane", ("lane",))
+
+BROADCAST_PROGRESS = Gauge("bot_broadcast_messages", "Current broadcast progress", ("mode", "state"))
+
+REAPER_DELETED_ROWS = Counter("bot_reaper_deleted_rows_total", "Rows deleted by the background reaper", ("table",))
+
+SEARCH_QUERIES = Counter("bot_search_queries_total", "Buyer event searches by source (db/cache)", ("result",))
+
+
+@register_collector
+def _db_connections_open() -> list[str]:
+    # Соединения не переиспользуются (connect_db открывает новое), поэтому
+    # "пул" = сколько соединений открыто сейчас. Рост без падения = утечка.
+    with DB_CONNECTIONS._lock:
+        opened = DB_CONNECTIONS._values.get(("opened",), 0)
+        closed = DB_CONNECTIONS._values.get(("closed",), 0)
+    return ["# HELP bot_db_connections_open DB connections currently open",
+            "# TYPE bot_db_connections_open gauge",
+            f"bot_db_connections_open {opened - closed}"]
+
+
+# --- ИНСТРУМЕНТАЦИЯ ---
+
+def _handler_pattern(handler) -> str:
+    if isinstance(handler, CallbackQueryHandler) and handler.pattern is not None:
+        return getattr(handler.pattern, 'pattern', str(handler.pattern))
+    if isinstance(handler, CommandHandler):
+        return "/" + ",".join(sorted(handler.commands))
+    return type(handler).__name__
+
+
+def instrument_handler(handler, conversation: str = "-", state="-"):
+    """Оборачивает callback хендлера замером латентности (labels вычисляются один раз)."""
+    callback = handler.callback
+    if getattr(callback, '__instrumented__', False):
+        return handler
+
+    labels = {'conversation': conversation, 'state': str(state), 'handler': callback.__name__}
+    pattern = _handler_pattern(handler)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context, *args, **kwargs)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(**labels)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, pattern=pattern, **labels)
+
+    wrapper.__instrumented__ = True
+    handler.callback = wrapper
+    return handler
+
+
+def instrument_conversation(conv: ConversationHandler, name: str) -> ConversationHandler:
+    for h in conv.entry_points:
+        instrument_handler(h, name, "entry")
+    for state, handlers in conv.states.items():
+        for h in handlers:
+            instrument_handler(h, name, state)
+    for h in conv.fallbacks:
+        instrument_handler(h, name, "fallback")
+    return conv
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest с замером латентности и ошибок каждого вызова Bot API."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            TG_API_ERRORS.inc(endpoint=endpoint, code=type(e).__name__)
+            raise
+        finally:
+            TG_API_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+        if code >= 400:
+            TG_API_ERRORS.inc(endpoint=endpoint, code=str(code))
+        return code, payload
+
+
+# --- HTTP ЭНДПОИНТ (режим polling; в webhook-режиме /metrics отдает FastAPI) ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str | None = None) -> ThreadingHTTPServer:
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Metrics endpoint: http://{host}:{port}/metrics")
+    return server
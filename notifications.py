@@ -0,0 +1,74 @@
+# notifications.py
+
+import os
+import asyncio
+import logging
+from telegram.error import Forbidden, BadRequest, RetryAfter
+from rate_limit import TokenBucket
+import metrics
+
+# --- НАСТРОЙКИ ---
+# Глобальный лимит Telegram ~30 сообщений/с на бота; оставляем запас для обычных ответов
+BULK_SEND_RATE = float(os.getenv("BULK_SEND_RATE", 20))
+BULK_SEND_CONCURRENCY = int(os.getenv("BULK_SEND_CONCURRENCY", 8))
+BULK_SEND_RETRIES = 3
+
+
+class Notification:
+    __slots__ = ('chat_id', 'text', 'reply_markup')
+
+    def __init__(self, chat_id: int, text: str, reply_markup=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+
+
+async def _send_one(bot, n: Notification) -> bool:
+    for _ in range(BULK_SEND_RETRIES):
+        try:
+            await bot.send_message(chat_id=n.chat_id, text=n.text, reply_markup=n.reply_markup, parse_mode='HTML')
+            return True
+        except RetryAfter as e:
+            # Flood control: ждем, сколько просит Telegram, и пробуем снова
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            await asyncio.sleep(delay)
+        except (Forbidden, BadRequest):
+            # Бот заблокирован / чат не существует - повтор не поможет
+            return False
+        except Exception as e:
+            logging.warning(f"Bulk send to {n.chat_id} failed: {e}")
+            await asyncio.sleep(1)
+    return False
+
+
+async def send_bulk(bot, notifications, mode: str = "bulk") -> tuple[int, int]:
+    """
+    Рассылает уведомления с ограничением скорости (token bucket) и параллельности.
+    Прогресс - в metrics.BROADCAST_PROGRESS (mode=<mode>). Возвращает (отправлено, не доставлено).
+    """
+    notifications = list(notifications)
+    bucket = TokenBucket(BULK_SEND_RATE, BULK_SEND_RATE)
+    semaphore = asyncio.Semaphore(BULK_SEND_CONCURRENCY)
+    counts = {'sent': 0, 'failed': 0}
+
+    metrics.BROADCAST_PROGRESS.set(len(notifications), mode=mode, state='total')
+    metrics.BROADCAST_PROGRESS.set(0, mode=mode, state='sent')
+    metrics.BROADCAST_PROGRESS.set(0, mode=mode, state='failed')
+
+    async def worker(n: Notification):
+        try:
+            state = 'sent' if await _send_one(bot, n) else 'failed'
+        finally:
+            semaphore.release()
+        counts[state] += 1
+        metrics.BROADCAST_PROGRESS.inc(mode=mode, state=state)
+
+    tasks = []
+    for n in notifications:
+        await semaphore.acquire()
+        while not bucket.consume():
+            await asyncio.sleep(bucket.retry_after())
+        tasks.append(asyncio.create_task(worker(n)))
+    await asyncio.gather(*tasks)
+
+    return counts['sent'], counts['failed']
@@ -0,0 +1,69 @@
+# paginator.py
+
+import os
+from datetime import datetime, timezone
+from telegram import InlineKeyboardButton
+
+# --- НАСТРОЙКИ ---
+# Кнопок (строк) на странице списка
+PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", 8))
+
+# Токен страницы в callback_data: pg_<список>_<n|p>_<ключ>, ключ - значения через '.',
+# числа в base36 ('-' для отрицательных chat_id), даты - '~' + unix-время в base36.
+# Пример: pg_uev_n_0.~tqlwc0.9ix - все укладывается в лимит Telegram 64 байта.
+PREFIX = "pg_"
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _b36(n: int) -> str:
+    if n < 0:
+        return '-' + _b36(-n)
+    s = ""
+    while True:
+        n, r = divmod(n, 36)
+        s = _DIGITS[r] + s
+        if not n:
+            return s
+
+
+def _encode(value) -> str:
+    if isinstance(value, datetime):
+        return '~' + _b36(int(value.timestamp()))
+    return _b36(int(value))
+
+
+def _decode(s: str):
+    if s.startswith('~'):
+        return datetime.fromtimestamp(int(s[1:], 36), timezone.utc)
+    return int(s, 36)
+
+
+def pattern(listing: str) -> str:
+    """Шаблон CallbackQueryHandler для кнопок листания списка listing."""
+    return f"^{PREFIX}{listing}_"
+
+
+def parse(data: str | None, listing: str):
+    """
+    Токен страницы из callback_data: ('n' | 'p', ключ) для db_utils.*_page
+    или None - первая страница (любой другой callback, например "Назад" в список).
+    """
+    if not data or not data.startswith(f"{PREFIX}{listing}_"):
+        return None
+    try:
+        direction, key = data[len(PREFIX) + len(listing) + 1:].split('_', 1)
+        if direction not in ('n', 'p'):
+            return None
+        return direction, tuple(_decode(v) for v in key.split('.'))
+    except ValueError:
+        return None
+
+
+def nav_row(listing: str, prev_key, next_key) -> list[InlineKeyboardButton]:
+    """Строка "◀ ▶" (пустая, если список помещается на одну страницу)."""
+    row = []
+    if prev_key is not None:
+        row.append(InlineKeyboardButton("◀", callback_data=f"{PREFIX}{listing}_p_{'.'.join(map(_encode, prev_key))}"))
+    if next_key is not None:
+        row.append(InlineKeyboardButton("▶", callback_data=f"{PREFIX}{listing}_n_{'.'.join(map(_encode, next_key))}"))
+    return row
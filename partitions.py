@@ -0,0 +1,31 @@
+# partitions.py
+
+import os
+import asyncio
+import logging
+from telegram.ext import ContextTypes
+from db_utils import ensure_ticket_partitions, archive_ticket_partitions
+
+# --- НАСТРОЙКИ ---
+# На сколько месяцев вперед держать готовые секции tickets
+TICKET_PARTITIONS_AHEAD = int(os.getenv("TICKET_PARTITIONS_AHEAD", 3))
+# Через сколько месяцев секция уходит в архив (tickets_archive), если мероприятия по ней прошли
+TICKET_ARCHIVE_AFTER_MONTHS = int(os.getenv("TICKET_ARCHIVE_AFTER_MONTHS", 12))
+PARTITIONS_TICK = float(os.getenv("PARTITIONS_TICK", 6 * 3600))
+
+
+def _maintain() -> tuple[list[str], list[str]]:
+    created = ensure_ticket_partitions(TICKET_PARTITIONS_AHEAD) or []
+    archived = archive_ticket_partitions(TICKET_ARCHIVE_AFTER_MONTHS) or []
+    return created, archived
+
+
+async def tick(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: создание будущих секций tickets и архивирование старых."""
+    try:
+        created, archived = await asyncio.to_thread(_maintain)
+    except Exception as e:
+        logging.error(f"Ticket partitions maintenance error: {e}")
+        return
+    if created or archived:
+        logging.info(f"Ticket partitions: created {created}, archived {archived}")
@@ -0,0 +1,125 @@
+# passwords.py
+
+import os
+import hmac
+import base64
+import asyncio
+import hashlib
+import logging
+import secrets
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+# --- НАСТРОЙКИ KDF (scrypt) ---
+# Стоимость настраивается через .env; при изменении параметров старые хеши
+# прозрачно пересчитываются при следующем успешном входе.
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", 8))
+SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", 1))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# 'thread' (по умолчанию, hashlib.scrypt отпускает GIL) или 'process'
+HASH_EXECUTOR_KIND = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+
+SCHEME = "scrypt"
+LEGACY_SHA256_LEN = 64
+
+_executor: Executor | None = None
+
+
+def _get_executor() -> Executor:
+    """Ленивая инициализация пула, в котором считается KDF."""
+    global _executor
+    if _executor is None:
+        if HASH_EXECUTOR_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pwhash")
+        logging.info(f"Password hashing pool: {HASH_EXECUTOR_KIND} x{HASH_WORKERS} (scrypt n={SCRYPT_N})")
+    return _executor
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2), dklen=KEY_BYTES)
+
+
+def legacy_sha256(password: str) -> str:
+    """Старый формат: несолёный SHA256 (hex). Только для проверки существующих хешей."""
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+def hash_password_sync(password: str) -> str:
+    """
+    Синхронный расчет хеша: scrypt$n$r$p$salt$hash.
+    Вызывать только из пула (см. hash_password), не из хендлеров напрямую.
+    """
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+
+def verify_password_sync(password: str, stored_hash: str | None) -> bool:
+    """Синхронная проверка пароля для обоих форматов (scrypt и legacy SHA256)."""
+    if not stored_hash:
+        return False
+
+    if is_legacy_hash(stored_hash):
+        return hmac.compare_digest(legacy_sha256(password), stored_hash)
+
+    try:
+        scheme, n, r, p, salt_b64, key_b64 = stored_hash.split('$')
+        if scheme != SCHEME:
+            return False
+        salt = base64.b64decode(salt_b64)
+        expected = base64.b64decode(key_b64)
+        key = _scrypt(password, salt, int(n), int(r), int(p))
+    except (ValueError, TypeError) as e:
+        logging.error(f"Malformed password hash: {e}")
+        return False
+
+    return hmac.compare_digest(key, expected)
+
+
+def is_legacy_hash(stored_hash: str) -> bool:
+    return len(stored_hash) == LEGACY_SHA256_LEN and '$' not in stored_hash
+
+
+def needs_rehash(stored_hash: str | None) -> bool:
+    """True, если хеш старого формата или посчитан с другими параметрами стоимости."""
+    if not stored_hash or is_legacy_hash(stored_hash):
+        return True
+    try:
+        scheme, n, r, p, _, _ = stored_hash.split('$')
+    except ValueError:
+        return True
+    return (scheme, int(n), int(r), int(p)) != (SCHEME, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+# --- ASYNC API (для хендлеров) ---
+
+async def hash_password(password: str) -> str:
+    """Хеширует пароль в пуле, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), hash_password_sync, password)
+
+
+async def verify_password(password: str, stored_hash: str | None) -> tuple[bool, str | None]:
+    """
+    Проверяет пароль в пуле.
+    Возврат: (пароль верный, новый хеш или None).
+    Новый хеш возвращается, если старый нужно обновить (legacy SHA256 / другие параметры).
+    """
+    loop = asyncio.get_running_loop()
+    ok = await loop.run_in_executor(_get_executor(), verify_password_sync, password, stored_hash)
+    if not ok:
+        return False, None
+
+    if needs_rehash(stored_hash):
+        return True, await hash_password(password)
+    return True, None
@@ -0,0 +1,45 @@
+# promo_codes.py
+
+import io
+import os
+import secrets
+from datetime import datetime
+from db_utils import create_promo_batch, insert_promo_codes
+
+# --- НАСТРОЙКИ ---
+PROMO_BATCH_MAX = int(os.getenv("PROMO_BATCH_MAX", 50000))
+# 10 символов из 32 - 50 бит случайности: перебором не угадать
+CODE_LENGTH = 10
+ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # без 0/O и 1/I - коды переписывают руками
+LABEL_MAX_LENGTH = 12
+# Повторы на случай совпадения с уже существующими кодами (на практике не нужны)
+_MAX_ATTEMPTS = 3
+
+
+def generate(count: int, prefix: str) -> set[str]:
+    codes = set()
+    while len(codes) < count:
+        codes.add(prefix + "-" + "".join(secrets.choice(ALPHABET) for _ in range(CODE_LENGTH)))
+    return codes
+
+
+def create_batch(event_id: int, label: str, discount: int, count: int, created_by: int) -> list[str] | None:
+    """Партия одноразовых кодов: генерация в памяти, вставка через COPY (insert_promo_codes). Выполняется в потоке."""
+    batch_id = create_promo_batch(event_id, label, discount, 1, created_by)
+    if batch_id is None:
+        return None
+    codes: list[str] = []
+    for _ in range(_MAX_ATTEMPTS):
+        missing = count - len(codes)
+        if not missing:
+            break
+        inserted = insert_promo_codes(batch_id, sorted(generate(missing, label)))
+        if inserted is None:
+            return codes or None
+        codes += inserted
+    return codes
+
+
+def codes_file(label: str, codes: list[str]) -> tuple[io.BytesIO, str]:
+    bio = io.BytesIO(("code\n" + "\n".join(sorted(codes)) + "\n").encode())
+    return bio, f"promo_{label}_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
@@ -0,0 +1,157 @@
+# rate_limit.py
+
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from telegram import Update
+from telegram.ext import ContextTypes, TypeHandler, ApplicationHandlerStop
+from metrics import THROTTLED_UPDATES
+
+
+class TokenBucket:
+    """
+    Классический token bucket: `capacity` токенов, пополнение `rate` токенов/сек.
+    Не потокобезопасен (используется только из event loop).
+    """
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated_at')
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def consume(self, amount: float = 1.0) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def retry_after(self, amount: float = 1.0) -> float:
+        """Сколько секунд ждать, пока накопится `amount` токенов."""
+        self._refill(time.monotonic())
+        if self.tokens >= amount or self.rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class KeyedRateLimiter:
+    """
+    Набор token bucket'ов по ключу (user_id, логин и т.п.) в памяти процесса.
+    Старые ключи вытесняются (LRU), чтобы память не росла бесконечно.
+    """
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = 100_000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+        self.shed_count = 0
+
+    def _bucket(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.capacity, self.rate)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, key, amount: float = 1.0) -> bool:
+        if self._bucket(key).consume(amount):
+            return True
+        self.shed_count += 1
+        return False
+
+    def retry_after(self, key, amount: float = 1.0) -> float:
+        return self._bucket(key).retry_after(amount)
+
+    def reset(self, key):
+        self._buckets.pop(key, None)
+
+
+# --- MIDDLEWARE ДЛЯ ВСЕХ ХЕНДЛЕРОВ ---
+# Регистрируется в bot.py в группе -1 (раньше buy_handler/admin_handler).
+# Превышение лимита -> ApplicationHandlerStop: апдейт не доходит до хендлеров и до БД.
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", 20))
+USER_RATE_PER_SEC = float(os.getenv("USER_RATE_PER_SEC", 3))
+CHAT_RATE_BURST = float(os.getenv("CHAT_RATE_BURST", 40))
+CHAT_RATE_PER_SEC = float(os.getenv("CHAT_RATE_PER_SEC", 6))
+# Одна и та же кнопка (buy_org_*, buy_ev_* ...) от одного пользователя
+PATTERN_RATE_BURST = float(os.getenv("PATTERN_RATE_BURST", 5))
+PATTERN_RATE_PER_SEC = float(os.getenv("PATTERN_RATE_PER_SEC", 1))
+
+try:
+    _THROTTLE_EXEMPT_ID = int(os.getenv("ADMIN_ID"))
+except (TypeError, ValueError):
+    _THROTTLE_EXEMPT_ID = 0
+
+user_limiter = KeyedRateLimiter(USER_RATE_BURST, USER_RATE_PER_SEC)
+chat_limiter = KeyedRateLimiter(CHAT_RATE_BURST, CHAT_RATE_PER_SEC)
+pattern_limiter = KeyedRateLimiter(PATTERN_RATE_BURST, PATTERN_RATE_PER_SEC)
+
+# Хвост из заглавных/цифр после '_' - номер заказа, ID билета, промокод (ticket_codes.py); иначе hex и числа
+_ID_SUFFIX_RE = re.compile(r'(?<=_)[0-9A-Z-]+$|[0-9A-Fa-f]*\d[0-9A-Fa-f]*$|\d+')
+
+
+def callback_pattern(data: str | None) -> str:
+    """'buy_org_12' -> 'buy_org_#', 'adm_approve_EQYHJACGF' -> 'adm_approve_#'."""
+    if not data:
+        return 'none'
+    return _ID_SUFFIX_RE.sub('#', data)
+
+
+def update_pattern(update: Update) -> str:
+    """Ключ апдейта для лимитов и метрик: шаблон кнопки или тип сообщения."""
+    if update.callback_query:
+        return callback_pattern(update.callback_query.data)
+    if update.message:
+        if update.message.text and update.message.text.startswith('/'):
+            return update.message.text.split()[0].split('@')[0]
+        return 'photo' if update.message.photo else 'message'
+    if update.inline_query:
+        return 'inline'
+    return 'other'
+
+
+async def throttle_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user or user.id == _THROTTLE_EXEMPT_ID:
+        return
+
+    pattern = update_pattern(update)
+    chat = update.effective_chat
+
+    if not user_limiter.allow(user.id):
+        scope = 'user'
+    elif chat and chat.id != user.id and not chat_limiter.allow(chat.id):
+        scope = 'chat'
+    elif not pattern_limiter.allow((user.id, pattern)):
+        scope = 'pattern'
+    else:
+        return
+
+    THROTTLED_UPDATES.inc(scope=scope, pattern=pattern)
+    logging.warning(f"Throttled update from {user.id} ({scope}, {pattern})")
+
+    if update.callback_query:
+        try:
+            await update.callback_query.answer("⏳ Слишком часто. Подождите немного.")
+        except Exception:
+            pass
+
+    raise ApplicationHandlerStop
+
+
+throttle_handler = TypeHandler(Update, throttle_updates)
@@ -0,0 +1,93 @@
+# reaper.py
+
+import os
+import time
+import asyncio
+import logging
+from telegram.ext import ContextTypes, Application
+from db_utils import get_next_reap_target, reap_chunk
+import metrics
+
+# --- НАСТРОЙКИ ---
+REAPER_TICK = float(os.getenv("REAPER_TICK", 60))
+# Сколько строк удаляется одной транзакцией
+REAPER_CHUNK = int(os.getenv("REAPER_CHUNK", 500))
+# Пауза между порциями: блокировки отпускаются, покупки и проверки билетов проходят без очереди
+REAPER_PAUSE = float(os.getenv("REAPER_PAUSE", 0.2))
+# Как часто обновлять сообщение с прогрессом у админа
+PROGRESS_EDIT_INTERVAL = float(os.getenv("REAPER_PROGRESS_INTERVAL", 5))
+
+# (вид, id) -> chat_id админа, который ждет отчет об удалении
+_watchers: dict[tuple[str, int], int] = {}
+_busy = False
+
+
+def _progress_text(label: str, totals: dict, done: bool) -> str:
+    lines = [f"🗑 <b>Удаление: {label}</b>", ""]
+    lines += [f"{table}: {count}" for table, count in totals.items()] or ["Подготовка..."]
+    lines += ["", "✅ Данные удалены." if done else "⏳ Идет удаление..."]
+    return "\n".join(lines)
+
+
+async def _report(bot, chat_id: int | None, message, text: str):
+    """Отправляет (message=None) или обновляет сообщение с прогрессом. Возвращает сообщение."""
+    if not chat_id:
+        return None
+    try:
+        if message is None:
+            return await bot.send_message(chat_id, text, parse_mode='HTML')
+        await bot.edit_message_text(chat_id=chat_id, message_id=message.message_id, text=text, parse_mode='HTML')
+    except Exception as e:
+        logging.debug(f"Reaper progress report failed: {e}")
+    return message
+
+
+async def _reap(bot, kind: str, target_id: int, org_id: int) -> bool:
+    """Удаляет один объект порциями. False - ошибка БД (повторим на следующем тике)."""
+    chat_id = _watchers.get((kind, target_id)) or _watchers.get(('org', org_id))
+    label = f"мероприятие #{target_id}" if kind == 'event' else f"организация #{target_id}"
+    totals: dict[str, int] = {}
+    message = await _report(bot, chat_id, None, _progress_text(label, totals, False))
+    last_edit = time.monotonic()
+
+    while True:
+        result = await asyncio.to_thread(reap_chunk, kind, target_id, REAPER_CHUNK)
+        if result is None:
+            return False
+        table, count = result
+        totals[table] = totals.get(table, 0) + count
+        metrics.REAPER_DELETED_ROWS.inc(count, table=table)
+        if table in ('events', 'organizations'):
+            break
+        if time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+            last_edit = time.monotonic()
+            await _report(bot, chat_id, message, _progress_text(label, totals, False))
+        await asyncio.sleep(REAPER_PAUSE)
+
+    logging.info(f"Reaper: {label} deleted {totals}")
+    _watchers.pop((kind, target_id), None)
+    await _report(bot, chat_id, message, _progress_text(label, totals, True))
+    return True
+
+
+async def tick(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: по очереди удаляет все помеченные (deleted_at) мероприятия и организации."""
+    global _busy
+    if _busy:
+        return  # Новые объекты подхватит уже работающий цикл
+    _busy = True
+    try:
+        while True:
+            target = await asyncio.to_thread(get_next_reap_target)
+            if target is None or not await _reap(context.bot, *target):
+                break
+    except Exception as e:
+        logging.error(f"Reaper error: {e}")
+    finally:
+        _busy = False
+
+
+def kick(application: Application, chat_id: int, kind: str, target_id: int):
+    """Запускает удаление сразу и присылает chat_id прогресс по объекту (kind: 'event' | 'org')."""
+    _watchers[(kind, target_id)] = chat_id
+    application.job_queue.run_once(tick, 0, name="reaper_kick")
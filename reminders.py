@@ -0,0 +1,78 @@
+# reminders.py
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from telegram.ext import ContextTypes
+from db_utils import get_due_reminders, claim_reminder_recipients
+from notifications import Notification, send_bulk
+from utils import escape_html
+from event_dates import EVENT_TZ
+
+# --- НАСТРОЙКИ ---
+# За сколько часов до начала напоминать (через запятую)
+REMINDER_OFFSETS = sorted({int(h) for h in os.getenv("EVENT_REMINDER_OFFSETS", "24,2").split(",") if h.strip()})
+REMINDER_TICK = float(os.getenv("EVENT_REMINDER_TICK", 300))
+# Сколько получателей забирается из БД за раз (остальные - следующими порциями, без длинной транзакции)
+REMINDER_BATCH = int(os.getenv("EVENT_REMINDER_BATCH", 500))
+
+_busy = False
+
+
+def _time_left_text(starts_at: datetime, now: datetime) -> str:
+    """Сколько осталось до начала - по фактическому времени, а не по смещению напоминания
+    (мероприятие, заведенное за 3 ч до начала, получает 24-часовое напоминание с "через 3 ч.").
+    starts_at из TIMESTAMPTZ - с часовым поясом; день и время показываем в EVENT_TZ."""
+    starts_at, now = starts_at.astimezone(EVENT_TZ), now.astimezone(EVENT_TZ)
+    minutes = max(1, int((starts_at - now).total_seconds() // 60))
+    if minutes < 60:
+        return f"через {minutes} мин."
+    if minutes < 6 * 60:
+        return f"через {round(minutes / 60)} ч."
+    days = (starts_at.date() - now.date()).days
+    if days == 0:
+        return f"сегодня в {starts_at:%H:%M}"
+    if days == 1:
+        return f"завтра в {starts_at:%H:%M}"
+    return f"через {days} дн."
+
+
+def reminder_notification(chat_id: int, event: dict) -> Notification:
+    when = _time_left_text(event['starts_at'], datetime.now(EVENT_TZ))
+    text = (
+        f"⏰ <b>Напоминание</b>\n\n"
+        f"Мероприятие <b>{escape_html(event['name'])}</b> начнется {when}\n"
+        f"📅 {escape_html(event['date'] or event['starts_at'].astimezone(EVENT_TZ).strftime('%d.%m.%Y %H:%M'))}\n\n"
+        f"На входе покажите QR-код билета."
+    )
+    return Notification(chat_id, text)
+
+
+async def _remind(bot, event: dict) -> int:
+    sent = 0
+    while True:
+        chat_ids = await asyncio.to_thread(claim_reminder_recipients, event['event_id'], event['offset_hours'],
+                                           REMINDER_BATCH)
+        if not chat_ids:
+            return sent
+        ok, _ = await send_bulk(bot, (reminder_notification(c, event) for c in chat_ids), mode='reminder')
+        sent += ok
+
+
+async def tick(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: напоминания держателям билетов за REMINDER_OFFSETS часов до начала мероприятий."""
+    global _busy
+    if _busy or not REMINDER_OFFSETS:
+        return  # Предыдущая рассылка еще идет - ее цикл доберет и новых получателей
+    _busy = True
+    try:
+        events = await asyncio.to_thread(get_due_reminders, REMINDER_OFFSETS)
+        for event in events:
+            sent = await _remind(context.bot, event)
+            if sent:
+                logging.info(f"Reminders: event {event['event_id']} ({event['offset_hours']}h) sent to {sent}")
+    except Exception as e:
+        logging.error(f"Reminder dispatch error: {e}")
+    finally:
+        _busy = False
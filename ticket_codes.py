@@ -0,0 +1,87 @@
+# ticket_codes.py
+
+import os
+import hmac
+import hashlib
+
+# ID билета: T- + 8 символов Crockford base32 (40 бит) + контрольный символ, например T-7QK2M9XH4.
+# Число - очередное значение последовательности БД (ticket_id_seq), пропущенное через перестановку
+# (сеть Фейстеля с секретом): уникальность дает последовательность, а по своему билету соседние не угадать.
+# Номера заказов (order_ref_seq) кодируются так же, но без префикса и с другой перестановкой.
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # без I, L, O, U - их путают при вводе
+BITS = 40
+LENGTH = BITS // 5
+TICKET_PREFIX = "T-"
+_HALF = BITS // 2
+_MASK = (1 << _HALF) - 1
+_ROUNDS = 4
+# Похожие символы при ручном вводе - как в Crockford base32
+_TYPOS = str.maketrans({'O': '0', 'I': '1', 'L': '1'})
+# Старые ID: T- + 8 hex из uuid4 (без контрольного символа)
+_LEGACY = set("0123456789ABCDEF")
+
+
+def check_secret():
+    """Проверка при старте (setup_application): без TICKET_ID_SECRET бот не запускается."""
+    if not os.getenv("TICKET_ID_SECRET"):
+        raise RuntimeError("TICKET_ID_SECRET не задан: нужен для ID билетов и номеров заказов (ticket_codes.py)")
+
+
+def _round_key(domain: str, i: int, half: int) -> int:
+    # Секрет читается при вызове: .env загружается после импорта модулей.
+    # TICKET_ID_SECRET НЕЛЬЗЯ менять после первой продажи: с другим ключом перестановка другая, и новые ID
+    # могут совпасть с уже выданными (такую вставку отклонит ticket_registry, но покупка сорвется).
+    secret = os.environ["TICKET_ID_SECRET"].encode()
+    digest = hmac.new(secret, f"{domain}:{i}:{half}".encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:4], 'big') & _MASK
+
+
+def _permute(n: int, domain: str) -> int:
+    """Биекция на [0, 2^40): разные номера всегда дают разные ID."""
+    left, right = n >> _HALF, n & _MASK
+    for i in range(_ROUNDS):
+        left, right = right, left ^ _round_key(domain, i, right)
+    return (left << _HALF) | right
+
+
+def _check_char(body: str) -> str:
+    """Luhn mod 32: ловит любую замену одного символа и почти все перестановки соседних."""
+    total, factor = 0, 2
+    for ch in reversed(body):
+        addend = factor * ALPHABET.index(ch)
+        total += addend // 32 + addend % 32
+        factor = 3 - factor
+    return ALPHABET[-total % 32]
+
+
+def encode(n: int, domain: str) -> str:
+    n = _permute(n, domain)
+    body = "".join(ALPHABET[(n >> shift) & 31] for shift in range(BITS - 5, -1, -5))
+    return body + _check_char(body)
+
+
+def ticket_id(seq: int) -> str:
+    return TICKET_PREFIX + encode(seq, 'ticket')
+
+
+def order_ref(seq: int) -> str:
+    return encode(seq, 'order')
+
+
+def normalize_ticket_id(text: str | None) -> str | None:
+    """
+    ID билета из ручного ввода или QR в каноническом виде (T- необязателен, O/I/L читаются как 0/1).
+    None - не ID билета или опечатка (не сошелся контрольный символ): в БД ходить незачем.
+    Старые ID (8 hex) локально не проверить - возвращаются как есть.
+    """
+    if not text:
+        return None
+    s = text.strip().upper().replace(' ', '')
+    if s.startswith(TICKET_PREFIX):
+        s = s[len(TICKET_PREFIX):]
+    s = s.translate(_TYPOS)
+    if len(s) == LENGTH and set(s) <= _LEGACY:
+        return TICKET_PREFIX + s
+    if len(s) == LENGTH + 1 and set(s) <= set(ALPHABET) and _check_char(s[:-1]) == s[-1]:
+        return TICKET_PREFIX + s
+    return None
@@ -0,0 +1,215 @@
+# update_processing.py
+
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable
+from telegram.ext import BaseUpdateProcessor
+import metrics
+import ticket_codes
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 64))
+# Потолок апдейтов внутри процессора: ждущие очереди своего чата или слота полосы + выполняемые.
+# Выполнение ограничивает LaneScheduler (MAX_CONCURRENT_UPDATES), семафор базового класса - только эта очередь
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", 4096))
+
+# --- ПОЛОСЫ ПРИОРИТЕТА ---
+# Имя полосы: (вес в WFQ, максимум одновременно выполняемых апдейтов полосы).
+# Переопределяются через .env: LANE_CHECKIN_WEIGHT=10, LANE_BROWSING_CAP=16 и т.п.
+_DEFAULT_LANES = {
+    'checkin': (8, 32),     # проверка билетов на входе
+    'payment': (6, 16),     # подтверждение оплаты админом
+    'purchase': (4, 32),    # шаги покупки и ввод текста
+    'browsing': (2, 32),    # листание организаций/мероприятий
+    'admin_bulk': (1, 4),   # отчеты, рассылки, удаления
+}
+LANES = {
+    name: (float(os.getenv(f"LANE_{name.upper()}_WEIGHT", w)), int(os.getenv(f"LANE_{name.upper()}_CAP", cap)))
+    for name, (w, cap) in _DEFAULT_LANES.items()
+}
+
+# Классификация callback_data по префиксу (первое совпадение)
+_CALLBACK_LANES = [
+    (re.compile(r'^(use_|check_ticket)'), 'checkin'),
+    (re.compile(r'^adm_(approve|reject)_'), 'payment'),
+    (re.compile(r'^(buy_prod_|buy_qty_|cart_|do_pay|paid_ok|skip_promo|back_to_email|ballot_|wl_)'), 'purchase'),
+    (re.compile(r'^(report_excel|audience_|confirm_del_org|del_ev_select_|db_reset|promo_exp_|adm_ballot_run|cancel_ev_run)'), 'admin_bulk'),
+]
+
+
+def classify_update(update: object) -> str:
+    """Определяет полосу приоритета апдейта."""
+    query = getattr(update, 'callback_query', None)
+    if query is not None:
+        data = query.data or ''
+        for pattern, lane in _CALLBACK_LANES:
+            if pattern.match(data):
+                return lane
+        return 'browsing'
+
+    message = getattr(update, 'message', None)
+    if message is not None:
+        # Фото присылают только контролеры (QR на входе), ID билета - ручной ввод на входе
+        if message.photo or (message.text and ticket_codes.normalize_ticket_id(message.text)):
+            return 'checkin'
+        # Файлы присылают только админы (импорт каталога, промокодов, черного списка)
+        if message.document:
+            return 'admin_bulk'
+        if message.text and message.text.startswith('/'):
+            return 'browsing'
+        return 'purchase'
+
+    return 'browsing'
+
+
+class LaneScheduler:
+    """
+    Взвешенная справедливая очередь (WFQ) перед выполнением апдейтов.
+    Общая емкость - capacity слотов; у каждой полосы свой лимит (cap).
+    Когда слот освобождается, его получает ожидающая полоса с наименьшим
+    виртуальным временем; каждый запуск сдвигает время полосы на 1/вес.
+    """
+
+    def __init__(self, capacity: int, lanes: dict = None):
+        self.capacity = capacity
+        self.lanes = lanes or LANES
+        self.active = 0
+        self.lane_active = {name: 0 for name in self.lanes}
+        self.queues = {name: deque() for name in self.lanes}
+        self.vtime = {name: 0.0 for name in self.lanes}
+
+    def _can_start(self, lane: str) -> bool:
+        return self.active < self.capacity and self.lane_active[lane] < self.lanes[lane][1]
+
+    def _start(self, lane: str):
+        self.active += 1
+        self.lane_active[lane] += 1
+        self.vtime[lane] += 1.0 / self.lanes[lane][0]
+        metrics.LANE_ACTIVE.set(self.lane_active[lane], lane=lane)
+
+    def _virtual_now(self) -> float:
+        backlogged = [self.vtime[n] for n, q in self.queues.items() if q]
+        return min(backlogged) if backlogged else max(self.vtime.values())
+
+    async def acquire(self, lane: str):
+        enqueued_at = time.perf_counter()
+
+        if self._can_start(lane) and not any(self.queues.values()):
+            self._start(lane)
+            metrics.LANE_WAIT.observe(0.0, lane=lane)
+            return
+
+        if not self.queues[lane]:
+            # Полоса только что стала активной: без "накопленного кредита" за время простоя
+            self.vtime[lane] = max(self.vtime[lane], self._virtual_now())
+
+        fut = asyncio.get_running_loop().create_future()
+        self.queues[lane].append(fut)
+        metrics.LANE_QUEUE_DEPTH.set(len(self.queues[lane]), lane=lane)
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Слот уже выдан, но задача отменена - возвращаем его
+                self.release(lane)
+            else:
+                self.queues[lane].remove(fut)
+                metrics.LANE_QUEUE_DEPTH.set(len(self.queues[lane]), lane=lane)
+            raise
+        metrics.LANE_WAIT.observe(time.perf_counter() - enqueued_at, lane=lane)
+
+    def release(self, lane: str):
+        self.active -= 1
+        self.lane_active[lane] -= 1
+        metrics.LANE_ACTIVE.set(self.lane_active[lane], lane=lane)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.capacity:
+            ready = [n for n, q in self.queues.items() if q and self.lane_active[n] < self.lanes[n][1]]
+            if not ready:
+                return
+            lane = min(ready, key=lambda n: self.vtime[n])
+            fut = self.queues[lane].popleft()
+            metrics.LANE_QUEUE_DEPTH.set(len(self.queues[lane]), lane=lane)
+            self._start(lane)
+            fut.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, lane: str):
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка апдейтов из разных чатов (до max_concurrent_updates одновременно),
+    при этом апдейты одного чата выполняются строго по очереди - состояния
+    ConversationHandler не "перепрыгивают" друг через друга.
+
+    Порядок захвата: сначала очередь чата, потом слот в полосе приоритета (LaneScheduler).
+    Так пачка апдейтов одного чата ждет в своей очереди и не занимает слоты,
+    а проверка билетов и подтверждение оплат обгоняют листание каталога.
+
+    process_update базового класса (final в PTB) держит семафор вокруг do_process_update, поэтому
+    его размер - max_pending_updates: иначе ждущие своей очереди апдейты заняли бы все места семафора.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES, lanes: dict = None,
+                 max_pending_updates: int = MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.scheduler = LaneScheduler(max_concurrent_updates, lanes)
+        self._chat_locks: dict = {}
+        self._chat_waiters: dict = {}
+
+    @staticmethod
+    def ordering_key(update: object):
+        """Ключ упорядочивания: чат, иначе пользователь (inline-запросы), иначе None (без порядка)."""
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return ('user', user.id)
+        return None
+
+    @asynccontextmanager
+    async def _chat_turn(self, key):
+        if key is None:
+            yield
+            return
+
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            # asyncio.Lock отдает управление ожидающим в порядке FIFO
+            async with lock:
+                yield
+        finally:
+            left = self._chat_waiters[key] - 1
+            if left:
+                self._chat_waiters[key] = left
+            else:
+                # Чат простаивает - не держим лок в памяти
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        async with self._chat_turn(self.ordering_key(update)):
+            async with self.scheduler.slot(classify_update(update)):
+                await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -1,10 +1,10 @@
 # user_handlers.py
 
 import os
-import uuid
 import logging
 import re
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ReplyKeyboardRemove
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaPhoto, \
+    ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters, CallbackQueryHandler, \
     CommandHandler
 from io import BytesIO
@@ -14,7 +14,25 @@ import html  # Для escape_html
 
 # Абсолютные импорты
 from db_utils import *
-from utils import cancel_global, escape_html, hash_password  # <-- hash_password
+from utils import cancel_global, escape_html
+from passwords import hash_password, verify_password
+from rate_limit import KeyedRateLimiter
+import waiting_room
+import ballot
+import waitlist
+import paginator
+import event_search
+import deep_links
+
+# Ограничение попыток входа (in-memory token bucket): отсекаем перебор паролей до похода в БД
+LOGIN_ATTEMPTS_BURST = int(os.getenv("LOGIN_ATTEMPTS_BURST", 10))
+LOGIN_ATTEMPTS_PER_MIN = float(os.getenv("LOGIN_ATTEMPTS_PER_MIN", 10))
+login_limiter_by_chat = KeyedRateLimiter(LOGIN_ATTEMPTS_BURST, LOGIN_ATTEMPTS_PER_MIN / 60)
+login_limiter_by_login = KeyedRateLimiter(LOGIN_ATTEMPTS_BURST, LOGIN_ATTEMPTS_PER_MIN / 60)
+
+# Максимум билетов в одном заказе (все QR приходят одним альбомом, а в альбоме до 10 фото)
+MAX_TICKETS_PER_ORDER = int(os.getenv("MAX_TICKETS_PER_ORDER", 10))
+MEDIA_GROUP_SIZE = 10
 
 # Определяем состояния для ConversationHandler
 (
@@ -34,8 +52,22 @@ from utils import cancel_global, escape_html, hash_password  # <-- hash_password
     ENTER_EMAIL,
     ENTER_PROMO,
     CONFIRM_PAY,
-    WAIT_APPROVAL
-) = range(14)
+    WAIT_APPROVAL,
+
+    # Waiting room
+    WAITING_ROOM,
+
+    # Ballot
+    BALLOT_SELECT,
+
+    # Cart (заказ из нескольких билетов)
+    SELECT_QUANTITY,
+    CART,
+
+    # Поиск мероприятий
+    SEARCH_INPUT,
+    SEARCH_RESULTS
+) = range(20)
 
 
 # --- HELPERS ---
@@ -87,8 +119,12 @@ async def start_auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     add_user(user_id, update.effective_user.username, update.effective_user.first_name)
 
+    # Ссылка на мероприятие/тариф (/start <payload>) - откроем сразу или после входа
+    if context.args:
+        context.user_data['start_payload'] = context.args[0]
+
     if get_user_auth_status(user_id):
-        return await send_main_menu(update, context)
+        return await after_auth(update, context)
 
     text = "👋 Добро пожаловать!\nДля продолжения работы необходимо войти или зарегистрироваться."
     keyboard = [
@@ -105,6 +141,62 @@ async def start_auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ASK_LOGIN_OR_REGISTER
 
 
+async def after_auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Вход выполнен: открываем отложенную ссылку из /start, иначе главное меню."""
+    payload = context.user_data.pop('start_payload', None)
+    if payload and (state := await open_deep_link(update, context, payload)) is not None:
+        return state
+    return await send_main_menu(update, context)
+
+
+async def open_deep_link(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> int | None:
+    """
+    /start ev_... / p_... (подписанные, см. deep_links.py): один запрос к БД вместо шести шагов меню,
+    затем сразу анкета. Очередь, лотерея и выбор из нескольких тарифов - через обычный выбор мероприятия.
+    None - ссылка недействительна (показываем главное меню).
+    """
+    parsed = deep_links.parse_payload(payload)
+    if not parsed:
+        return None
+
+    user_id = update.effective_user.id
+    chat = update.effective_chat
+    target = get_deep_link_target(*parsed, user_id)
+    if not target:
+        await chat.send_message("❌ Мероприятие не найдено или продажи закрыты.")
+        return None
+    if target['blacklisted']:
+        await chat.send_message("❌ Вы в черном списке этой организации или глобально.")
+        return None
+
+    ev_id = target['event_id']
+    context.user_data['buy_org_id'] = target['org_id']
+    context.user_data['buy_ev_id'] = ev_id
+    context.user_data.pop('ballot_entry', None)
+    context.user_data.pop('waitlist_id', None)
+    safe_event = escape_html(target['event_name'])
+
+    products = target['products']
+    if (len(products) != 1 or target['sale_mode'] != ballot.MODE_FCFS
+            or waiting_room.requires_queue(ev_id, user_id)):
+        keyboard = [[InlineKeyboardButton("🎫 Выбрать билет", callback_data=f"buy_ev_{ev_id}")]]
+        await chat.send_message(f"🎉 <b>{safe_event}</b>", parse_mode='HTML',
+                                reply_markup=InlineKeyboardMarkup(keyboard))
+        return SELECT_EVENT
+
+    info = products[0]
+    context.user_data['buy_prod'] = info
+    context.user_data['cart'] = {'event_id': ev_id, 'items': {info['id']: dict(info, qty=1)}}
+    keyboard = [[InlineKeyboardButton("🛒 Изменить заказ", callback_data="cart_show")]]
+    await chat.send_message(
+        f"🎉 <b>{safe_event}</b>\n"
+        f"Выбрано: <b>{escape_html(info['name'])}</b>\nЦена: {info['price']} руб.\n\n"
+        f"Введите ваше <b>ФИО</b>:",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return ENTER_NAME
+
+
 # --- LOGIN FLOW ---
 
 async def ask_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -116,17 +208,42 @@ async def ask_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return INPUT_LOGIN
 
 
+async def _reject_login_flood(update: Update, login: str | None = None, charge: bool = True) -> bool:
+    """
+    Проверяет лимит попыток входа. True - попытка отброшена (ответ уже отправлен).
+    charge=False - только проверка, без списания: попытка (логин + пароль) списывается с чата один раз.
+    """
+    chat_id = update.effective_user.id
+    limiters = [(login_limiter_by_chat, chat_id)]
+    if login:
+        limiters.append((login_limiter_by_login, login))
+
+    for limiter, key in limiters:
+        allowed = limiter.allow(key) if charge else limiter.retry_after(key) == 0
+        if not allowed:
+            wait = int(limiter.retry_after(key)) + 1
+            await update.message.reply_text(f"⏳ Слишком много попыток входа. Повторите через {wait} сек.")
+            return True
+    return False
+
+
 async def process_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     login = update.message.text.strip().lower()
 
+    # Попытка списывается в process_password (или здесь, если логин не найден)
+    if await _reject_login_flood(update, charge=False):
+        return INPUT_LOGIN
+
     user_data = get_user_by_login(login)
 
     if not user_data:
+        login_limiter_by_chat.allow(update.effective_user.id)  # Перебор логинов - тоже попытки
         await update.message.reply_text(
             "❌ Пользователь с таким логином не найден. Попробуйте снова или нажмите /cancel:")
         return INPUT_LOGIN
 
-    context.user_data['temp_login'] = login
+    # Хеш кешируется между состояниями: process_password больше не ходит в БД за ним
+    context.user_data['login_record'] = {'login': user_data['login'], 'hash': user_data['hash']}
 
     await update.message.reply_text("Введите <b>Пароль</b>:", parse_mode='HTML')
     return INPUT_PASSWORD
@@ -134,15 +251,24 @@ async def process_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 async def process_password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     password = update.message.text.strip()
-    login = context.user_data.get('temp_login')
+    record = context.user_data.get('login_record')
 
-    user_data = get_user_by_login(login)
-    hashed_password = hash_password(password)
+    if not record:
+        await update.message.reply_text("Введите ваш <b>Логин</b>:", parse_mode='HTML')
+        return INPUT_LOGIN
+
+    if await _reject_login_flood(update, record['login']):
+        return INPUT_PASSWORD
+
+    # KDF считается в пуле, event loop не блокируется
+    is_valid, new_hash = await verify_password(password, record['hash'])
 
-    if user_data and user_data['hash'] == hashed_password:
-        authenticate_user_db(update.effective_user.id)
+    # Один запрос: is_authenticated + (при необходимости) миграция хеша legacy SHA256 -> scrypt
+    if is_valid and complete_login(update.effective_user.id, record['login'], record['hash'], new_hash):
+        context.user_data.pop('login_record', None)
+        login_limiter_by_login.reset(record['login'])
         await update.message.reply_text("✅ Авторизация успешна!", reply_markup=ReplyKeyboardRemove())
-        return await send_main_menu(update, context)
+        return await after_auth(update, context)
     else:
         await update.message.reply_text("❌ Неверный пароль. Попробуйте снова или нажмите /cancel:")
         return INPUT_PASSWORD
@@ -190,11 +316,11 @@ async def process_register_password(update: Update, context: ContextTypes.DEFAUL
 
     login = context.user_data['reg_login']
     user_id = update.effective_user.id
-    password_hash = hash_password(password)
+    password_hash = await hash_password(password)
 
     if register_user_db(user_id, login, password_hash):
         await update.message.reply_text("🎉 Регистрация успешна! Выполнен вход.", reply_markup=ReplyKeyboardRemove())
-        return await send_main_menu(update, context)
+        return await after_auth(update, context)
     else:
         # Это должно быть невозможным, если логин проверен выше, но на всякий случай
         await update.message.reply_text("❌ Ошибка регистрации (логин занят). Начните сначала: /start")
@@ -204,12 +330,13 @@ async def process_register_password(update: Update, context: ContextTypes.DEFAUL
 # --- BUY FLOW (Unchanged, but now starts from MAIN_MENU) ---
 
 async def start_buy(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    orgs = get_active_orgs()
-    if not orgs:
+    page = paginator.parse(update.callback_query.data, 'uorg')
+    orgs, prev_key, next_key = get_active_orgs_page(page, paginator.PAGE_SIZE)
+    if not orgs and page is None:
         await update.callback_query.edit_message_text("Нет доступных мероприятий.")
         return MAIN_MENU  # Возвращаемся в главное меню
 
-    if len(orgs) == 1:
+    if len(orgs) == 1 and page is None and next_key is None:
         context.user_data['buy_org_id'] = orgs[0]['id']
         return await show_events(update, context)
 
@@ -218,12 +345,89 @@ async def start_buy(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         safe_name = escape_html(o['name'])
         keyboard.append([InlineKeyboardButton(safe_name, callback_data=f"buy_org_{o['id']}")])
 
+    if nav := paginator.nav_row('uorg', prev_key, next_key):
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("🔍 Поиск мероприятия", callback_data="search_start")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="goto_main_menu")])
 
     await update.callback_query.edit_message_text("Выберите организатора:", reply_markup=InlineKeyboardMarkup(keyboard))
     return SELECT_ORG
 
 
+# --- SEARCH ---
+
+async def ask_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="buy_start")]]
+    await query.edit_message_text("🔍 Введите название мероприятия, место или организатора:",
+                                  reply_markup=InlineKeyboardMarkup(keyboard))
+    return SEARCH_INPUT
+
+
+async def search_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text = update.message.text.strip()
+    if len(event_search.normalize(text)) < event_search.SEARCH_MIN_LENGTH:
+        await update.message.reply_text(f"Введите хотя бы {event_search.SEARCH_MIN_LENGTH} символа.")
+        return SEARCH_INPUT
+
+    context.user_data['search_q'] = text
+    return await show_search_results(update, context)
+
+
+async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    if query:
+        await query.answer()
+    text = context.user_data.get('search_q', '')
+    results = event_search.search(text)
+
+    # Страницы листаются по закэшированному списку: ключ страницы - индекс граничной строки
+    start = 0
+    if page := paginator.parse(query and query.data, 'srch'):
+        direction, (index,) = page
+        start = index + 1 if direction == 'n' else max(0, index - paginator.PAGE_SIZE)
+    rows = (results or [])[start:start + paginator.PAGE_SIZE]
+
+    keyboard = []
+    if results is None:
+        msg = "❌ Поиск временно недоступен, попробуйте позже."
+    elif not results:
+        msg = f"Ничего не найдено по запросу «{escape_html(text)}»."
+    else:
+        msg = f"🔍 Найдено по запросу «{escape_html(text)}»:"
+        for e in rows:
+            label = escape_html(f"{e['name']} ({e['date']}) · {e['org_name']}")
+            keyboard.append([InlineKeyboardButton(label, callback_data=f"srch_ev_{e['id']}_{e['org_id']}")])
+        prev_key = (start,) if start > 0 else None
+        next_key = (start + len(rows) - 1,) if start + len(rows) < len(results) else None
+        if nav := paginator.nav_row('srch', prev_key, next_key):
+            keyboard.append(nav)
+
+    keyboard.append([InlineKeyboardButton("🔍 Новый поиск", callback_data="search_start")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="buy_start")])
+
+    if query:
+        await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    else:
+        await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    return SEARCH_RESULTS
+
+
+async def search_event_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Мероприятие из поиска: те же проверки, что при выборе организации, затем обычный выбор билета."""
+    query = update.callback_query
+    org_id = int(query.data.split('_')[3])  # srch_ev_<event_id>_<org_id>
+
+    if is_blacklisted(org_id, query.from_user.id):
+        await query.answer()
+        await query.edit_message_text("❌ Вы в черном списке этой организации или глобально.")
+        return MAIN_MENU
+
+    context.user_data['buy_org_id'] = org_id
+    return await event_selected(update, context)
+
+
 async def org_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -239,7 +443,8 @@ async def org_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     org_id = context.user_data['buy_org_id']
-    events = get_org_events_public(org_id)
+    page = paginator.parse(update.callback_query and update.callback_query.data, 'uev')
+    events, prev_key, next_key = get_org_events_public_page(org_id, page, paginator.PAGE_SIZE)
 
     keyboard = []
     if not events:
@@ -249,6 +454,8 @@ async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         for e in events:
             safe_name = escape_html(e['name'])
             keyboard.append([InlineKeyboardButton(f"{safe_name} ({e['date']})", callback_data=f"buy_ev_{e['id']}")])
+        if nav := paginator.nav_row('uev', prev_key, next_key):
+            keyboard.append(nav)
 
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="buy_start")])  # К выбору организаций
 
@@ -269,7 +476,26 @@ async def event_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     ev_id = int(query.data.split('_')[2])
     context.user_data['buy_ev_id'] = ev_id
 
-    products = get_event_products(ev_id)
+    # Высокий спрос: до списка билетов пускаем через виртуальную очередь (без запросов к БД)
+    if waiting_room.requires_queue(ev_id, query.from_user.id):
+        return await enter_waiting_room(update, context, ev_id)
+
+    context.user_data.pop('ballot_entry', None)
+    sale_mode = get_event_sale_mode(ev_id)
+    if sale_mode != ballot.MODE_FCFS:
+        return await show_ballot(update, context, ev_id, sale_mode)
+
+    # Корзина живет в пределах одного мероприятия
+    if context.user_data.get('cart', {}).get('event_id') != ev_id:
+        context.user_data['cart'] = {'event_id': ev_id, 'items': {}}
+
+    return await show_products(update, context, ev_id)
+
+
+async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE, ev_id: int) -> int:
+    query = update.callback_query
+    page = paginator.parse(query.data, 'uprod')
+    products, prev_key, next_key = get_event_products_page(ev_id, page, paginator.PAGE_SIZE)
 
     keyboard = []
     if not products:
@@ -281,7 +507,12 @@ async def event_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             safe_name = escape_html(p['name'])
             keyboard.append(
                 [InlineKeyboardButton(f"{safe_name} - {p['price']} руб.", callback_data=f"buy_prod_{p['id']}")])
+        if nav := paginator.nav_row('uprod', prev_key, next_key):
+            keyboard.append(nav)
 
+    if context.user_data['cart']['items']:
+        keyboard.append([InlineKeyboardButton(f"🛒 Корзина ({_cart_count(context.user_data['cart'])})",
+                                              callback_data="cart_show")])
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="goto_events_list")])  # К списку мероприятий
 
 
@@ -289,16 +520,32 @@ async def event_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return SELECT_PRODUCT
 
 
+async def products_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Листание тарифов мероприятия (◀ ▶)."""
+    await update.callback_query.answer()
+    return await show_products(update, context, context.user_data['buy_ev_id'])
+
+
 async def product_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     prod_id = int(query.data.split('_')[2])
 
+    # Пропуск из очереди истек - обратно в очередь
+    ev_id = context.user_data.get('buy_ev_id')
+    if ev_id and waiting_room.requires_queue(ev_id, query.from_user.id):
+        return await enter_waiting_room(update, context, ev_id)
+
     # ПРОВЕРКА ЛИМИТА
     available, remaining = check_product_availability(prod_id)
 
     if not available:
-        await query.edit_message_text("❌ Извините, билеты этой категории **закончились**.", parse_mode='Markdown')
+        keyboard = [
+            [InlineKeyboardButton("🔔 Сообщить, когда освободится", callback_data=f"wl_join_{prod_id}")],
+            [InlineKeyboardButton("🔙 К выбору билетов", callback_data=f"buy_ev_{ev_id}")]
+        ]
+        await query.edit_message_text("❌ Извините, билеты этой категории <b>закончились</b>.", parse_mode='HTML',
+                                      reply_markup=InlineKeyboardMarkup(keyboard))
         # Возврат к списку (можно вызвать show_events или остаться)
         return SELECT_PRODUCT
 
@@ -307,22 +554,306 @@ async def product_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     safe_name = escape_html(info['name'])
 
-    rem_text = f" (Осталось: {remaining})" if remaining != -1 else ""
+    rem_text = f" (Осталось: {remaining})" if remaining != 9999 else ""
+
+    # Сколько еще можно добавить: остаток тарифа и лимит билетов в заказе
+    cart = context.user_data['cart']
+    in_cart = cart['items'].get(prod_id, {}).get('qty', 0)
+    max_qty = min(remaining - in_cart, MAX_TICKETS_PER_ORDER - _cart_count(cart))
+    if max_qty <= 0:
+        return await show_cart(update, context, note="⚠️ Больше билетов этой категории добавить нельзя.")
 
     # Кнопка отмены (вернет к списку товаров)
     # Важно: callback_data должна вести назад к списку товаров этого ивента
     ev_id = context.user_data.get('buy_ev_id')
-    keyboard = [[InlineKeyboardButton("🔙 К выбору билетов", callback_data=f"buy_ev_{ev_id}")]]
+    buttons = [InlineKeyboardButton(str(n), callback_data=f"buy_qty_{n}") for n in range(1, max_qty + 1)]
+    keyboard = [buttons[i:i + 5] for i in range(0, len(buttons), 5)]
+    keyboard.append([InlineKeyboardButton("🔙 К выбору билетов", callback_data=f"buy_ev_{ev_id}")])
 
     await query.edit_message_text(
         f"Выбрано: <b>{safe_name}</b>\nЦена: {info['price']} руб.{rem_text}\n\n"
-        f"Введите ваше <b>ФИО</b>:",
+        f"Сколько билетов добавить в заказ?",
         parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
+    return SELECT_QUANTITY
+
+
+# --- CART ---
+
+def _cart_count(cart: dict) -> int:
+    return sum(item['qty'] for item in cart['items'].values())
+
+
+async def quantity_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.answer()
+    qty = int(update.callback_query.data.split('_')[2])
+    info = context.user_data['buy_prod']
+
+    item = context.user_data['cart']['items'].setdefault(info['id'], dict(info, qty=0))
+    item['qty'] += qty
+    return await show_cart(update, context)
+
+
+async def show_cart(update: Update, context: ContextTypes.DEFAULT_TYPE, note: str = "") -> int:
+    query = update.callback_query
+    if query.data == "cart_show":
+        await query.answer()
+
+    cart = context.user_data['cart']
+    lines = [f"• {escape_html(item['name'])} x{item['qty']} - {item['price'] * item['qty']} руб."
+             for item in cart['items'].values()]
+    total = sum(item['price'] * item['qty'] for item in cart['items'].values())
+
+    keyboard = []
+    if _cart_count(cart) < MAX_TICKETS_PER_ORDER:
+        keyboard.append([InlineKeyboardButton("➕ Добавить билеты", callback_data=f"buy_ev_{cart['event_id']}")])
+    keyboard.append([InlineKeyboardButton("➡️ Оформить заказ", callback_data="cart_checkout")])
+    keyboard.append([InlineKeyboardButton("🗑 Очистить корзину", callback_data="cart_clear")])
+
+    await query.edit_message_text(
+        (f"{note}\n\n" if note else "") +
+        f"🛒 <b>Ваш заказ</b>\n" + "\n".join(lines) + f"\n\n<b>Итого: {total} руб.</b>",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return CART
+
+
+async def cart_clear(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.callback_query.answer()
+    context.user_data['cart']['items'].clear()
+    return await show_products(update, context, context.user_data['cart']['event_id'])
+
+
+async def cart_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    keyboard = [[InlineKeyboardButton("🔙 К заказу", callback_data="cart_show")]]
+    await query.edit_message_text("Введите ваше <b>ФИО</b>:", parse_mode='HTML',
+                                  reply_markup=InlineKeyboardMarkup(keyboard))
+    return ENTER_NAME
+
+
+# --- WAITING ROOM ---
+
+async def enter_waiting_room(update: Update, context: ContextTypes.DEFAULT_TYPE, ev_id: int) -> int:
+    """Ставит пользователя в очередь мероприятия и показывает позицию (сообщение обновляет waiting_room.tick)."""
+    query = update.callback_query
+    room = waiting_room.get_room(ev_id)
+    entry = room.join(query.from_user.id, update.effective_chat.id)
+    entry.message_id = query.message.message_id
+
+    position = room.position(entry.user_id)
+    entry.last_position = position
+    await query.edit_message_text(waiting_room.position_text(position, room.rate_per_min),
+                                  reply_markup=waiting_room.position_keyboard(ev_id), parse_mode='HTML')
+    return WAITING_ROOM
+
+
+async def waiting_room_position(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    ev_id = int(query.data.split('_')[2])
+    room = waiting_room.rooms.get(ev_id)
+
+    if room and room.is_admitted(query.from_user.id):
+        await query.answer()
+        await query.edit_message_text("✅ Ваша очередь подошла!", reply_markup=waiting_room.admitted_keyboard(ev_id))
+        return WAITING_ROOM
+
+    position = room.position(query.from_user.id) if room else None
+    if position is None:
+        # Очередь выключили или пользователь выпал - просто показываем билеты (там же query.answer)
+        return await event_selected(update, context)
+
+    await query.answer(f"Ваша позиция в очереди: {position}", show_alert=True)
+    return WAITING_ROOM
+
+
+async def leave_waiting_room(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    ev_id = context.user_data.get('buy_ev_id')
+    room = waiting_room.rooms.get(ev_id)
+    if room:
+        room.leave(update.callback_query.from_user.id)
+    await update.callback_query.answer()
+    return await start_buy(update, context)
+
+
+# --- BALLOT ---
+# Заявка: основной тариф -> запасной тариф -> количество -> ФИО/Email (общие шаги ENTER_NAME/ENTER_EMAIL)
+
+async def show_ballot(update: Update, context: ContextTypes.DEFAULT_TYPE, ev_id: int, sale_mode: str) -> int:
+    query = update.callback_query
+    back = [InlineKeyboardButton("🔙 Назад", callback_data="goto_events_list")]
+
+    if sale_mode == ballot.MODE_BALLOT_DRAWN:
+        await query.edit_message_text("🎲 Розыгрыш билетов на это мероприятие уже проведен.",
+                                      reply_markup=InlineKeyboardMarkup([back]))
+        return SELECT_PRODUCT
+
+    # Текст кнопок - обычный текст, не HTML: название без экранирования
+    keyboard = [[InlineKeyboardButton(f"{p['name']} - {p['price']} руб.",
+                                      callback_data=f"ballot_prod_{p['id']}")]
+                for p in get_event_products(ev_id)]
+    keyboard.append(back)
+
+    await query.edit_message_text(
+        "🎲 <b>Билеты распределяются лотереей</b>\n\n"
+        "Оставьте заявку - после окончания приема победители будут выбраны случайно "
+        "и получат сообщение с реквизитами для оплаты. Время подачи заявки не влияет на шансы.\n\n"
+        "Выберите <b>основной</b> тариф:",
+        parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return BALLOT_SELECT
+
+
+async def ballot_product_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    prod_id = int(query.data.split('_')[2])
+    ev_id = context.user_data.get('buy_ev_id')
+    context.user_data['ballot_entry'] = {'event_id': ev_id, 'product_id': prod_id, 'alt_product_id': None,
+                                         'quantity': 1}
+
+    keyboard = [[InlineKeyboardButton(f"{p['name']} - {p['price']} руб.",
+                                      callback_data=f"ballot_alt_{p['id']}")]
+                for p in get_event_products(ev_id) if p['id'] != prod_id]
+    keyboard.append([InlineKeyboardButton("Без запасного варианта", callback_data="ballot_alt_0")])
+
+    await query.edit_message_text("Если основной тариф закончится, какой взять <b>вместо него</b>?",
+                                  parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+    return BALLOT_SELECT
+
+
+async def ballot_alt_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    alt_id = int(query.data.split('_')[2])
+    context.user_data['ballot_entry']['alt_product_id'] = alt_id or None
+
+    keyboard = [[InlineKeyboardButton(str(n), callback_data=f"ballot_qty_{n}")
+                 for n in range(1, ballot.BALLOT_MAX_PER_USER + 1)]]
+    await query.edit_message_text(f"Сколько билетов вам нужно? (не больше {ballot.BALLOT_MAX_PER_USER})",
+                                  reply_markup=InlineKeyboardMarkup(keyboard))
+    return BALLOT_SELECT
+
+
+async def ballot_qty_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    qty = int(query.data.split('_')[2])
+    context.user_data['ballot_entry']['quantity'] = max(1, min(qty, ballot.BALLOT_MAX_PER_USER))
+
+    await query.edit_message_text("Введите ваше <b>ФИО</b>:", parse_mode='HTML')
+    return ENTER_NAME
+
+
+async def submit_ballot_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    entry = context.user_data.pop('ballot_entry')
+    ok = add_ballot_entry(entry['event_id'], update.effective_user.id, entry['product_id'], entry['alt_product_id'],
+                          entry['quantity'], context.user_data['buy_name'], context.user_data['buy_email'])
+
+    keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data="goto_main_menu")]]
+    if ok:
+        text = "✅ Заявка принята! Результаты розыгрыша придут в этот чат."
+    else:
+        text = "❌ Прием заявок уже закрыт (или розыгрыш проведен)."
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return MAIN_MENU
+
+
+async def ballot_paid(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Глобальный хендлер: победитель лотереи сообщает об оплате (кнопка из рассылки результатов)."""
+    query = update.callback_query
+    await query.answer()
+    entry_id = int(query.data.split('_')[2])
+
+    payment = get_ballot_payment(entry_id, query.from_user.id)
+    if not payment:
+        await query.edit_message_reply_markup(reply_markup=None)
+        return
+
+    # Повторное нажатие, пока заявка ждет проверки: не плодим новые номера и сообщения админу
+    pending = context.application.bot_data.get(f"ballot_ref_{entry_id}")
+    if pending and f"pay_{pending}" in context.application.bot_data:
+        await query.edit_message_text(
+            f"⏳ Заявка <code>{pending}</code> уже отправлена. Ожидайте билеты после проверки платежа.",
+            parse_mode='HTML')
+        return
+
+    ref = next_order_ref()
+    if not ref:
+        await query.message.reply_text("❌ Не удалось оформить заявку. Попробуйте нажать кнопку позже.")
+        return
+    context.application.bot_data[f"pay_{ref}"] = {
+        'ref': ref,
+        'ticket_id': payment['ticket_ids'][0],
+        'ticket_ids': payment['ticket_ids'],
+        'user_id': query.from_user.id,
+        'amount': payment['amount'],
+        'buyer': payment['buyer']
+    }
+    context.application.bot_data[f"ballot_ref_{entry_id}"] = ref
+    await notify_admin_payment(context, ref, payment['org_id'], payment['amount'], payment['buyer'])
+    await query.edit_message_text("✅ Заявка на оплату отправлена! Ожидайте билеты после проверки платежа.")
+
+
+# --- WAITLIST ---
+
+async def waitlist_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    prod_id = int(query.data.split('_')[2])
+    if not join_waitlist(prod_id, query.from_user.id):
+        await query.answer("❌ Не удалось встать в лист ожидания.", show_alert=True)
+        return SELECT_PRODUCT
+
+    await query.answer()
+    ev_id = context.user_data.get('buy_ev_id')
+    keyboard = [[InlineKeyboardButton("🔙 К выбору билетов", callback_data=f"buy_ev_{ev_id}")]]
+    await query.edit_message_text(
+        f"🔔 Вы в листе ожидания. Как только место освободится, бот пришлет сообщение - "
+        f"на оформление будет {waitlist.WAITLIST_CLAIM_MINUTES} мин.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return SELECT_PRODUCT
+
+
+async def waitlist_claim(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Кнопка "Оформить" из предложения листа ожидания: место уже придержано, сразу к анкете."""
+    query = update.callback_query
+    await query.answer()
+    waitlist_id = int(query.data.split('_')[2])
+
+    offer = get_waitlist_offer(waitlist_id, query.from_user.id)
+    if not offer:
+        await query.edit_message_text("⌛ Время на оформление истекло, место передано следующему в очереди.")
+        return MAIN_MENU
+
+    info = get_product_info(offer['product_id'])
+    context.user_data['buy_ev_id'] = offer['event_id']
+    context.user_data['buy_prod'] = info
+    context.user_data['cart'] = {'event_id': offer['event_id'], 'items': {info['id']: dict(info, qty=1)}}
+    context.user_data['waitlist_id'] = waitlist_id
+
+    await query.edit_message_text(
+        f"Выбрано: <b>{escape_html(info['name'])}</b>\nЦена: {info['price']} руб.\n"
+        f"Место за вами до {offer['expires_at'].strftime('%H:%M')}.\n\n"
+        f"Введите ваше <b>ФИО</b>:",
+        parse_mode='HTML'
+    )
     return ENTER_NAME
 
 
+async def waitlist_decline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Глобальный хендлер: отказ от предложения - место сразу уходит следующему."""
+    query = update.callback_query
+    await query.answer()
+    waitlist_id = int(query.data.split('_')[2])
+
+    if decline_waitlist_offer(waitlist_id, query.from_user.id):
+        waitlist.kick(context.application)
+    await query.edit_message_text("Хорошо, место передано следующему в очереди.")
+
+
 async def enter_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['buy_name'] = update.message.text
     # Кнопка отмены (полный выход в меню)
@@ -335,6 +866,9 @@ async def enter_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def enter_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['buy_email'] = update.message.text
 
+    if context.user_data.get('ballot_entry'):
+        return await submit_ballot_entry(update, context)
+
     # Сразу предлагаем ввести промокод
     keyboard = [
         [InlineKeyboardButton("Нет промокода", callback_data="skip_promo")],
@@ -376,25 +910,28 @@ async def skip_promo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def show_payment_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Вспомогательная функция для отображения итога
-    info = context.user_data['buy_prod']
+    items = list(context.user_data['cart']['items'].values())
     name = context.user_data['buy_name']
     promo = context.user_data.get('applied_promo')
 
-    price = info['price']
-    final_price = price
-
+    discount = 0
     promo_text = "Нет"
     if promo:
         discount = promo['discount']
-        final_price = int(price * (100 - discount) / 100)
         promo_text = f"{promo['code']} (-{discount}%)"
 
+    # Позиции заказа: (тариф, количество, цена за билет со скидкой)
+    order_items = [(item['id'], item['qty'], int(item['price'] * (100 - discount) / 100)) for item in items]
+    final_price = sum(qty * price for _, qty, price in order_items)
+
+    context.user_data['order_items'] = order_items
     context.user_data['final_price'] = final_price
 
+    lines = "\n".join(f"  {escape_html(item['name'])} x{item['qty']}" for item in items)
     txt = (
         f"<b>Подтверждение заказа:</b>\n"
-        f"Ивент: {escape_html(info['event_name'])}\n"
-        f"Билет: {escape_html(info['name'])}\n"
+        f"Ивент: {escape_html(items[0]['event_name'])}\n"
+        f"Билеты:\n{lines}\n"
         f"Покупатель: {escape_html(name)}\n"
         f"Промокод: {promo_text}\n"
         f"-------------------\n"
@@ -431,89 +968,136 @@ async def confirm_pay(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     query = update.callback_query
     await query.answer()
 
-    ref = uuid.uuid4().hex[:8].upper()
+    ref = next_order_ref()
+    if not ref:
+        keyboard = [[InlineKeyboardButton("🔙 Назад к вводу email", callback_data="back_to_email")]]
+        await query.edit_message_text("❌ Не удалось оформить заказ. Попробуйте еще раз.",
+                                      reply_markup=InlineKeyboardMarkup(keyboard))
+        return WAIT_APPROVAL
     context.user_data['pay_ref'] = ref
     final_price = context.user_data['final_price']
-    org_id = context.user_data['buy_prod']['org_id']
+    items = list(context.user_data['cart']['items'].values())
+    org_id = items[0]['org_id']
 
     # Получаем карту из БД
     card = get_org_card(org_id)
     if not card:
         card = "УТОЧНИТЕ У ОРГАНИЗАТОРА"
 
+    tickets_text = ", ".join(f"{escape_html(item['name'])} x{item['qty']}" for item in items)
     msg = (
-        f"💳 **ПОДТВЕРЖДЕНИЕ ПОКУПКИ**\n\n"
-        f"**Билет:** {escape_html(product_name)}\n"
-        f"**Мероприятие:** {escape_html(event_name)}\n"
-        f"**Цена:** {final_price:.2f} ₽\n"
-        f"**Получатель (Номер карты):** `{card}`\n\n"
-        f"❗ **ВАЖНОЕ ПРАВИЛО ОПЛАТЫ:**\n"
-        f"**НЕ УКАЗЫВАЙТЕ НИКАКИХ КОММЕНТАРИЕВ К ПЛАТЕЖУ!**\n" # <--- НОВОЕ ПРЕДУПРЕЖДЕНИЕ
+        f"💳 <b>ПОДТВЕРЖДЕНИЕ ПОКУПКИ</b>\n\n"
+        f"<b>Билеты:</b> {tickets_text}\n"
+        f"<b>Мероприятие:</b> {escape_html(items[0]['event_name'])}\n"
+        f"<b>Цена:</b> {final_price:.2f} ₽\n"
+        f"<b>Получатель (Номер карты):</b> <code>{card}</code>\n\n"
+        f"❗ <b>ВАЖНОЕ ПРАВИЛО ОПЛАТЫ:</b>\n"
+        f"<b>НЕ УКАЗЫВАЙТЕ НИКАКИХ КОММЕНТАРИЕВ К ПЛАТЕЖУ!</b>\n" # <--- НОВОЕ ПРЕДУПРЕЖДЕНИЕ
         f"Просто переведите сумму ({final_price:.2f} ₽) на указанную карту.\n"
-        f"После оплаты нажмите кнопку **«Я оплатил»**.\n"
+        f"После оплаты нажмите кнопку <b>«Я оплатил»</b>.\n"
     )
 
-    keyboard = [[InlineKeyboardButton("✅ Я оплатил", callback_data="paid_ok")]
-    [InlineKeyboardButton("🔙 Назад к вводу email", callback_data="back_to_email")]]
+    keyboard = [[InlineKeyboardButton("✅ Я оплатил", callback_data="paid_ok")],
+                [InlineKeyboardButton("🔙 Назад к вводу email", callback_data="back_to_email")]]
     await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
     return WAIT_APPROVAL
 
 
+async def notify_admin_payment(context: ContextTypes.DEFAULT_TYPE, ref: str, org_id: int, amount: int, buyer: str):
+    """Сообщение админу с кнопками подтверждения/отклонения оплаты (данные заявки - в bot_data[pay_<ref>])."""
+    adm_id = os.getenv("ADMIN_ID")
+    if not adm_id:
+        return
+
+    admin_msg = (
+        f"💰 <b>Новая оплата</b>\n"
+        f"Орг ID: {org_id}\n"
+        f"Сумма: {amount}\n"
+        f"Ref: <code>{ref}</code>\n"
+        f"Покупатель: {escape_html(buyer)}"
+    )
+
+    kb = [
+        [InlineKeyboardButton("✅ Подтвердить", callback_data=f"adm_approve_{ref}")],
+        [InlineKeyboardButton("❌ Отклонить", callback_data=f"adm_reject_{ref}")]
+    ]
+
+    try:
+        await context.bot.send_message(chat_id=adm_id, text=admin_msg, reply_markup=InlineKeyboardMarkup(kb),
+                                       parse_mode='HTML')
+    except Exception as e:
+        logging.error(f"Failed to send admin notification: {e}")
+
+
 async def send_approval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
 
     ref = context.user_data['pay_ref']
-    prod = context.user_data['buy_prod']
+    cart = context.user_data['cart']
     name = context.user_data['buy_name']
     email = context.user_data['buy_email']
+    amount = context.user_data['final_price']
     user_id = query.from_user.id
+    promo = context.user_data.get('applied_promo')
 
-    ticket_id = f"T-{uuid.uuid4().hex[:8].upper()}"
+    # Все билеты заказа: одна транзакция (промокод + проверка лимитов + multi-row INSERT)
+    ticket_ids = create_order_tickets(ref, context.user_data['order_items'], user_id, name, email,
+                                      waitlist_id=context.user_data.pop('waitlist_id', None),
+                                      promo_code=promo and promo['code'])
 
-    # --- Вызываем обновленную функцию, которая проверяет лимит и инкрементирует счетчик ---
-    if create_ticket_record(ticket_id, prod['id'], user_id, name, email, prod['price']):
+    if ticket_ids:
         admin_data = {
             'ref': ref,
-            'ticket_id': ticket_id,
+            'ticket_id': ticket_ids[0],
+            'ticket_ids': ticket_ids,
             'user_id': user_id,
-            'amount': prod['price'],
-            'buyer': name
+            'amount': amount,
+            'buyer': name,
+            'promo_code': promo and promo['code']  # При отклонении оплаты использование кода возвращается
         }
 
         context.application.bot_data[f"pay_{ref}"] = admin_data
+        org_id = next(iter(cart['items'].values()))['org_id']
+        cart['items'].clear()
+        context.user_data['applied_promo'] = None
 
-    adm_id = os.getenv("ADMIN_ID")
-    if adm_id:
-        admin_msg = (
-            f"💰 <b>Новая оплата</b>\n"
-            f"Орг ID: {prod['org_id']}\n"
-            f"Сумма: {prod['price']}\n"
-            f"Ref: <code>{ref}</code>\n"
-            f"Покупатель: {escape_html(name)}"
-        )
-
-        kb = [
-            [InlineKeyboardButton("✅ Подтвердить", callback_data=f"adm_approve_{ref}")],
-            [InlineKeyboardButton("❌ Отклонить", callback_data=f"adm_reject_{ref}")]
-        ]
-
-        try:
-            await context.bot.send_message(chat_id=adm_id, text=admin_msg, reply_markup=InlineKeyboardMarkup(kb),
-                                           parse_mode='HTML')
-        except Exception as e:
-            logging.error(f"Failed to send admin notification: {e}")
-
-        await query.edit_message_text("✅ Заявка отправлена! Ожидайте билет после проверки платежа.")
+        await notify_admin_payment(context, ref, org_id, amount, name)
+        await query.edit_message_text("✅ Заявка отправлена! Ожидайте билеты после проверки платежа.")
+    elif promo and not find_promo(promo['code'], cart['event_id']):
+        # Одноразовый код успели использовать в другом заказе
+        await query.edit_message_text(
+        f"❌ Не удалось создать заявку. Промокод {promo['code']} уже использован. Оформите заказ заново.")
     else:
         # Если билеты закончились в момент отправки заявки
         await query.edit_message_text(
-        "❌ Не удалось создать заявку. Билеты этой категории закончились. Попробуйте другую категорию.")
+        "❌ Не удалось создать заявку. Билетов на весь заказ уже не хватает. Попробуйте изменить заказ.")
 
 
     return MAIN_MENU  # Возвращаемся в главное меню
 
 
+async def send_ticket_qrs(context: ContextTypes.DEFAULT_TYPE, user_id: int, ticket_ids: list[str]):
+    """QR-коды билетов: один билет - фото, несколько - альбомом (media group, до 10 фото)."""
+    if len(ticket_ids) == 1:
+        ticket_id = ticket_ids[0]
+        caption = f"✅ <b>ВАШ БИЛЕТ</b>\nID: <code>{ticket_id}</code>\nПокажите этот QR-код на входе."
+        qr_img = generate_qr(ticket_id)
+        await context.bot.send_photo(chat_id=user_id, photo=InputFile(qr_img, filename=f'{ticket_id}.png'),
+                                     caption=caption, parse_mode='HTML')
+        return
+
+    for start in range(0, len(ticket_ids), MEDIA_GROUP_SIZE):
+        media = []
+        for ticket_id in ticket_ids[start:start + MEDIA_GROUP_SIZE]:
+            caption = f"ID: <code>{ticket_id}</code>"
+            if start == 0 and not media:
+                caption = f"✅ <b>ВАШИ БИЛЕТЫ ({len(ticket_ids)})</b>\nПокажите QR-коды на входе.\n" + caption
+            media.append(InputMediaPhoto(media=generate_qr(ticket_id), filename=f'{ticket_id}.png',
+                                         caption=caption, parse_mode='HTML'))
+        await context.bot.send_media_group(chat_id=user_id, media=media)
+
+
 async def issue_ticket_from_admin_notification(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Глобальный хендлер для подтверждения/отклонения билета администратором."""
     query = update.callback_query
@@ -529,22 +1113,20 @@ async def issue_ticket_from_admin_notification(update: Update, context: ContextT
         return
 
     user_id = pay_data['user_id']
-    ticket_id = pay_data['ticket_id']
+    # Заявка может включать несколько билетов (выигрыш в лотерее)
+    ticket_ids = pay_data.get('ticket_ids') or [pay_data['ticket_id']]
+    ids_html = ", ".join(f"<code>{t}</code>" for t in ticket_ids)
 
     if action == 'approve':
-        activate_ticket_db(ticket_id)
-
-        qr_img = generate_qr(ticket_id)
-        caption = f"✅ <b>ВАШ БИЛЕТ</b>\nID: <code>{ticket_id}</code>\nПокажите этот QR-код на входе."
+        activate_tickets_db(ticket_ids)
 
         try:
-            await context.bot.send_photo(chat_id=user_id, photo=InputFile(qr_img, filename=f'{ticket_id}.png'),
-                                         caption=caption, parse_mode='HTML')
+            await send_ticket_qrs(context, user_id, ticket_ids)
             await query.edit_message_text(
-                f"✅ Билет <code>{ticket_id}</code> выдан пользователю (Ref: <code>{ref}</code>).", parse_mode='HTML')
+                f"✅ Билет {ids_html} выдан пользователю (Ref: <code>{ref}</code>).", parse_mode='HTML')
         except Exception as e:
             await query.edit_message_text(
-                f"⚠️ Билет активирован, но не отправлен (блок бота?). ID: <code>{ticket_id}</code>", parse_mode='HTML')
+                f"⚠️ Билет активирован, но не отправлен (блок бота?). ID: {ids_html}", parse_mode='HTML')
             logging.error(f"Failed to send ticket to {user_id}: {e}")
 
         reset_kb = [[InlineKeyboardButton("🏠 В главное меню", callback_data="user_reset_to_menu")]]
@@ -556,6 +1138,8 @@ async def issue_ticket_from_admin_notification(update: Update, context: ContextT
         )
 
     elif action == 'reject':
+        if pay_data.get('promo_code'):
+            release_promo_usage(pay_data['promo_code'])
         try:
             await context.bot.send_message(chat_id=user_id,
                                            text=f"❌ Оплата по заявке <code>{ref}</code> отклонена администратором. Свяжитесь с поддержкой.",
@@ -570,7 +1154,10 @@ async def issue_ticket_from_admin_notification(update: Update, context: ContextT
 
 
 buy_handler = ConversationHandler(
-    entry_points=[CommandHandler("start", start_auth)],
+    entry_points=[
+        CommandHandler("start", start_auth),
+        CallbackQueryHandler(waitlist_claim, pattern="^wl_claim_"),  # Предложение из листа ожидания
+    ],
     states={
         # --- AUTH STATES ---
         ASK_LOGIN_OR_REGISTER: [
@@ -599,19 +1186,47 @@ buy_handler = ConversationHandler(
         # --- BUY STATES ---
         SELECT_ORG: [
             CallbackQueryHandler(org_selected, pattern="^buy_org_"),
+            CallbackQueryHandler(start_buy, pattern=paginator.pattern('uorg')),
+            CallbackQueryHandler(ask_search, pattern="^search_start$"),
             CallbackQueryHandler(start_buy, pattern="^buy_start$"),  # Назад к выбору
         ],
+        SEARCH_INPUT: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, search_input),
+            CallbackQueryHandler(start_buy, pattern="^buy_start$"),
+        ],
+        SEARCH_RESULTS: [
+            CallbackQueryHandler(search_event_selected, pattern="^srch_ev_"),
+            CallbackQueryHandler(show_search_results, pattern=paginator.pattern('srch')),
+            CallbackQueryHandler(ask_search, pattern="^search_start$"),
+            CallbackQueryHandler(start_buy, pattern="^buy_start$"),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, search_input),  # Сразу новый запрос
+        ],
         SELECT_EVENT: [
             CallbackQueryHandler(event_selected, pattern="^buy_ev_"),
+            CallbackQueryHandler(show_events, pattern=paginator.pattern('uev')),
             CallbackQueryHandler(start_buy, pattern="^buy_start$"),  # Назад к выбору организаций
         ],
         SELECT_PRODUCT: [
             CallbackQueryHandler(product_selected, pattern="^buy_prod_"),
+            CallbackQueryHandler(products_page, pattern=paginator.pattern('uprod')),
+            CallbackQueryHandler(show_cart, pattern="^cart_show$"),
+            CallbackQueryHandler(waitlist_join, pattern="^wl_join_"),
+            CallbackQueryHandler(event_selected, pattern="^buy_ev_"),  # Назад из "закончились"
             CallbackQueryHandler(show_events, pattern="^goto_events_list$"),  # Назад к выбору мероприятий
         ],
+        SELECT_QUANTITY: [
+            CallbackQueryHandler(quantity_selected, pattern="^buy_qty_"),
+            CallbackQueryHandler(event_selected, pattern="^buy_ev_"),  # "К выбору билетов"
+        ],
+        CART: [
+            CallbackQueryHandler(event_selected, pattern="^buy_ev_"),  # Добавить еще билеты
+            CallbackQueryHandler(cart_checkout, pattern="^cart_checkout$"),
+            CallbackQueryHandler(cart_clear, pattern="^cart_clear$"),
+        ],
         ENTER_NAME: [
             MessageHandler(filters.TEXT & ~filters.COMMAND, enter_name),
-            # Обработка кнопки "К выбору билетов", которая была отправлена в product_selected
+            CallbackQueryHandler(show_cart, pattern="^cart_show$"),  # "К заказу"
+            # Обработка кнопки "К выбору билетов" (из анкеты лотереи)
             CallbackQueryHandler(event_selected, pattern="^buy_ev_")
         ],
 
@@ -631,7 +1246,32 @@ buy_handler = ConversationHandler(
             CallbackQueryHandler(confirm_pay, pattern="^do_pay"),
             CallbackQueryHandler(back_to_email, pattern="^back_to_email"),
         ],
-        WAIT_APPROVAL: [CallbackQueryHandler(send_approval, pattern="^paid_ok")]
+        WAIT_APPROVAL: [
+            CallbackQueryHandler(send_approval, pattern="^paid_ok"),
+            CallbackQueryHandler(back_to_email, pattern="^back_to_email"),
+        ],
+
+        # --- BALLOT ---
+        BALLOT_SELECT: [
+            CallbackQueryHandler(ballot_product_selected, pattern="^ballot_prod_"),
+            CallbackQueryHandler(ballot_alt_selected, pattern="^ballot_alt_"),
+            CallbackQueryHandler(ballot_qty_selected, pattern="^ballot_qty_"),
+            CallbackQueryHandler(show_events, pattern="^goto_events_list$"),
+        ],
+
+        # --- WAITING ROOM ---
+        WAITING_ROOM: [
+            CallbackQueryHandler(event_selected, pattern="^buy_ev_"),  # Кнопка после допуска
+            CallbackQueryHandler(waiting_room_position, pattern="^wr_pos_"),
+            CallbackQueryHandler(leave_waiting_room, pattern="^wr_leave$"),
+        ],
     },
-    fallbacks=[CommandHandler("cancel", cancel_global), CallbackQueryHandler(cancel_global, pattern='^cancel_global')]
+    fallbacks=[
+        CommandHandler("cancel", cancel_global),
+        CallbackQueryHandler(cancel_global, pattern='^cancel_global'),
+        # Предложение из листа ожидания может прийти в любом состоянии диалога
+        CallbackQueryHandler(waitlist_claim, pattern="^wl_claim_"),
+        # Ссылка на мероприятие/тариф (/start <payload>) открывается из любого состояния
+        CommandHandler("start", start_auth),
+    ]
 )
\ No newline at end of file
@@ -6,7 +6,6 @@ import io
 import html
 import logging
 from typing import Final
-import hashlib
 import numpy as np
 import cv2  # OpenCV
 
@@ -20,11 +19,6 @@ STATUS_PENDING: Final[str] = 'pending'
 
 # --- ХЕЛПЕРЫ ---
 
-def hash_password(password: str) -> str:
-    """Хеширование пароля с использованием SHA256."""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
-
-
 def escape_html(text: str) -> str:
     """Экранирование HTML-символов в тексте."""
     return html.escape(text)
@@ -0,0 +1,205 @@
+# waiting_room.py
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from db_utils import get_waiting_room_rates
+
+# --- НАСТРОЙКИ ---
+TICK_SECONDS = float(os.getenv("WAITING_ROOM_TICK", 5))
+# Сколько живет "пропуск" после допуска (выбор билета + оформление)
+ADMISSION_TTL = float(os.getenv("WAITING_ROOM_ADMISSION_TTL", 600))
+# Как часто обновлять сообщение с позицией одному пользователю
+POSITION_UPDATE_INTERVAL = float(os.getenv("WAITING_ROOM_POSITION_INTERVAL", 30))
+# Сколько сообщений с позицией редактируем за один тик (лимиты Telegram)
+POSITION_EDITS_PER_TICK = int(os.getenv("WAITING_ROOM_EDITS_PER_TICK", 20))
+
+
+class QueueEntry:
+    __slots__ = ('user_id', 'chat_id', 'message_id', 'seq', 'last_edit_at', 'last_position')
+
+    def __init__(self, user_id: int, chat_id: int, seq: int):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = None
+        self.seq = seq
+        self.last_edit_at = time.monotonic()
+        self.last_position = None
+
+
+class WaitingRoom:
+    """
+    Очередь одного мероприятия. Все в памяти процесса: вход в очередь, позиция
+    и допуск не трогают БД, поэтому нагрузка на БД не зависит от размера толпы.
+    """
+
+    def __init__(self, event_id: int, rate_per_min: int):
+        self.event_id = event_id
+        self.rate_per_min = rate_per_min
+        self.queue: OrderedDict = OrderedDict()  # user_id -> QueueEntry (в порядке входа)
+        self.admitted: dict = {}                 # user_id -> monotonic время истечения пропуска
+        self.next_seq = 0
+        self.served_seq = 0                      # seq последнего допущенного
+        self.allowance = 0.0
+
+    def join(self, user_id: int, chat_id: int) -> QueueEntry:
+        entry = self.queue.get(user_id)
+        if entry is None:
+            self.next_seq += 1
+            entry = self.queue[user_id] = QueueEntry(user_id, chat_id, self.next_seq)
+        return entry
+
+    def leave(self, user_id: int):
+        self.queue.pop(user_id, None)
+
+    def position(self, user_id: int) -> int | None:
+        """Приблизительная позиция (O(1)): ушедшие из очереди не пересчитываются."""
+        entry = self.queue.get(user_id)
+        if entry is None:
+            return None
+        return max(1, entry.seq - self.served_seq)
+
+    def is_admitted(self, user_id: int) -> bool:
+        expires_at = self.admitted.get(user_id)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self.admitted[user_id]
+            return False
+        return True
+
+    def admit_due(self, elapsed: float) -> list[QueueEntry]:
+        """Допускает столько людей из головы очереди, сколько накопилось по скорости rate_per_min."""
+        self.allowance = min(self.allowance + self.rate_per_min / 60 * elapsed, max(1.0, self.rate_per_min))
+        admitted = []
+        expires_at = time.monotonic() + ADMISSION_TTL
+        while self.queue and self.allowance >= 1:
+            _, entry = self.queue.popitem(last=False)
+            self.allowance -= 1
+            self.served_seq = entry.seq
+            self.admitted[entry.user_id] = expires_at
+            admitted.append(entry)
+        return admitted
+
+    def expire_admissions(self):
+        now = time.monotonic()
+        for user_id in [u for u, exp in self.admitted.items() if exp < now]:
+            del self.admitted[user_id]
+
+
+# event_id -> WaitingRoom; rates обновляются раз в тик одним запросом
+rooms: dict[int, WaitingRoom] = {}
+rates: dict[int, int] = {}
+_last_tick = time.monotonic()
+
+
+def requires_queue(event_id: int, user_id: int) -> bool:
+    """Нужно ли пользователю стоять в очереди на это мероприятие."""
+    if not rates.get(event_id):
+        return False
+    room = rooms.get(event_id)
+    return not (room and room.is_admitted(user_id))
+
+
+def get_room(event_id: int) -> WaitingRoom:
+    room = rooms.get(event_id)
+    if room is None:
+        room = rooms[event_id] = WaitingRoom(event_id, rates.get(event_id, 0))
+    return room
+
+
+def position_text(position: int | None, rate_per_min: int) -> str:
+    if position is None:
+        return "⏳ Вы в очереди."
+    eta_min = max(1, round(position / max(rate_per_min, 1)))
+    return (
+        "🚦 <b>Высокий спрос - вы в очереди</b>\n\n"
+        f"Ваша позиция: <b>{position}</b>\n"
+        f"Примерное ожидание: ~{eta_min} мин.\n\n"
+        "Сообщение обновляется автоматически. Не выходите из очереди - место сохранится."
+    )
+
+
+def position_keyboard(event_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Моя позиция", callback_data=f"wr_pos_{event_id}")],
+        [InlineKeyboardButton("🚪 Выйти из очереди", callback_data="wr_leave")],
+    ])
+
+
+def admitted_keyboard(event_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🎫 Перейти к билетам", callback_data=f"buy_ev_{event_id}")]])
+
+
+async def tick(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: допуск по расписанию, истечение пропусков и обновление позиций."""
+    global rates, _last_tick
+    now = time.monotonic()
+    elapsed, _last_tick = now - _last_tick, now
+
+    fresh = get_waiting_room_rates()
+    if fresh is not None:
+        # При ошибке БД оставляем прежние настройки, а не открываем все очереди
+        rates = fresh
+
+    for event_id in list(rooms):
+        room = rooms[event_id]
+        room.rate_per_min = rates.get(event_id, 0)
+
+        if not room.rate_per_min:
+            # Очередь выключена - пускаем всех оставшихся
+            admitted = list(room.queue.values())
+            room.queue.clear()
+        else:
+            admitted = room.admit_due(elapsed)
+        room.expire_admissions()
+
+        for entry in admitted:
+            await _notify_admitted(context, room, entry)
+
+        await _refresh_positions(context, room)
+
+        if not room.queue and not room.admitted and not room.rate_per_min:
+            del rooms[event_id]
+
+
+async def _notify_admitted(context: ContextTypes.DEFAULT_TYPE, room: WaitingRoom, entry: QueueEntry):
+    text = (f"✅ <b>Ваша очередь подошла!</b>\n"
+            f"У вас есть {int(ADMISSION_TTL // 60)} мин., чтобы выбрать билет.")
+    try:
+        if entry.message_id:
+            await context.bot.edit_message_text(chat_id=entry.chat_id, message_id=entry.message_id, text=text,
+                                                reply_markup=admitted_keyboard(room.event_id), parse_mode='HTML')
+        else:
+            await context.bot.send_message(chat_id=entry.chat_id, text=text,
+                                           reply_markup=admitted_keyboard(room.event_id), parse_mode='HTML')
+    except Exception as e:
+        logging.warning(f"Waiting room admit notify failed for {entry.user_id}: {e}")
+
+
+async def _refresh_positions(context: ContextTypes.DEFAULT_TYPE, room: WaitingRoom):
+    now = time.monotonic()
+    edits = 0
+    # Снимок: пока ждем edit_message_text, join/leave на том же цикле событий меняют room.queue
+    for entry in list(room.queue.values()):
+        if edits >= POSITION_EDITS_PER_TICK:
+            break
+        if room.queue.get(entry.user_id) is not entry:
+            continue  # Уже вышел из очереди (или допущен)
+        if not entry.message_id or now - entry.last_edit_at < POSITION_UPDATE_INTERVAL:
+            continue
+        position = room.position(entry.user_id)
+        entry.last_edit_at = now
+        if position == entry.last_position:
+            continue
+        entry.last_position = position
+        edits += 1
+        try:
+            await context.bot.edit_message_text(chat_id=entry.chat_id, message_id=entry.message_id,
+                                                text=position_text(position, room.rate_per_min),
+                                                reply_markup=position_keyboard(room.event_id), parse_mode='HTML')
+        except Exception as e:
+            logging.debug(f"Waiting room position edit failed for {entry.user_id}: {e}")
@@ -0,0 +1,60 @@
+# waitlist.py
+
+import os
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, Application
+from db_utils import expire_waitlist_offers, get_waitlisted_products_with_free_seats, offer_waitlist_seats
+from notifications import Notification, send_bulk
+from utils import escape_html
+
+# --- НАСТРОЙКИ ---
+WAITLIST_TICK = float(os.getenv("WAITLIST_TICK", 15))
+# Сколько минут место держится за пользователем после предложения
+WAITLIST_CLAIM_MINUTES = int(os.getenv("WAITLIST_CLAIM_MINUTES", 10))
+# Максимум предложений по одному тарифу за тик
+WAITLIST_BATCH = int(os.getenv("WAITLIST_BATCH", 50))
+
+
+def _dispatch() -> list[dict]:
+    """
+    Синхронная часть (в отдельном потоке): вернуть в продажу истекшие предложения,
+    затем раздать свободные места следующим в очереди. Освобождение мест из любого
+    источника (возврат, истекшее предложение, рост лимита/вместимости) ловится одним запросом.
+    """
+    expire_waitlist_offers()
+    offers = []
+    for product_id in get_waitlisted_products_with_free_seats():
+        offers.extend(offer_waitlist_seats(product_id, WAITLIST_BATCH, WAITLIST_CLAIM_MINUTES))
+    return offers
+
+
+def offer_notification(offer: dict) -> Notification:
+    text = (
+        f"🔔 <b>Освободилось место!</b>\n\n"
+        f"Мероприятие: {escape_html(offer['event_name'])}\n"
+        f"Билет: {escape_html(offer['product_name'])}\n\n"
+        f"Место закреплено за вами на {WAITLIST_CLAIM_MINUTES} мин."
+    )
+    kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎫 Оформить", callback_data=f"wl_claim_{offer['waitlist_id']}")],
+        [InlineKeyboardButton("Не нужно", callback_data=f"wl_decline_{offer['waitlist_id']}")],
+    ])
+    return Notification(offer['chat_id'], text, kb)
+
+
+async def tick(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: диспетчер листа ожидания."""
+    try:
+        offers = await asyncio.to_thread(_dispatch)
+    except Exception as e:
+        logging.error(f"Waitlist dispatch error: {e}")
+        return
+    if offers:
+        await send_bulk(context.bot, (offer_notification(o) for o in offers), mode='waitlist')
+
+
+def kick(application: Application):
+    """Внеочередной запуск диспетчера (места освободились прямо сейчас)."""
+    application.job_queue.run_once(tick, 0, name="waitlist_kick")